@@ -0,0 +1,107 @@
+"""
+Reproducible synthetic datasets for the benchmarks.
+
+Everything is generated from a seeded random.Random, so two runs with the
+same seed and scale measure exactly the same work.
+"""
+
+import hashlib
+import os
+import random
+
+SEED = 0x4d4444
+
+# File size distributions used for hashing benchmarks: (name, size, count)
+FILE_SIZES = [
+    ("1k", 1024, 1000),
+    ("64k", 64 * 1024, 100),
+    ("4m", 4 * 1024 * 1024, 4),
+]
+
+
+def digests(count, seed=SEED):
+    """digests() - Generate random MD5 hex digests.
+
+    Args:
+        count (int) - Number of digests.
+        seed (int) - Random seed.
+
+    Returns:
+        list of hex digests.
+    """
+    rng = random.Random(seed)
+    return [
+        hashlib.md5(rng.getrandbits(64).to_bytes(8, "little")).hexdigest()
+        for _ in range(count)
+    ]
+
+
+def random_bytes(rng, size):
+    """random_bytes() - Generate random bytes from a seeded generator.
+
+    Args:
+        rng (random.Random) - Generator to use.
+        size (int) - Number of bytes.
+
+    Returns:
+        bytes
+    """
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def make_files(path, size, count, seed=SEED):
+    """make_files() - Create files of a fixed size with random contents.
+
+    Args:
+        path (str) - Directory to create files in.
+        size (int) - Size of each file.
+        count (int) - Number of files.
+        seed (int) - Random seed.
+
+    Returns:
+        list of paths created.
+    """
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    paths = []
+    for index in range(count):
+        filename = os.path.join(path, "%06d" % index)
+        with open(filename, "wb") as f:
+            f.write(random_bytes(rng, size))
+        paths.append(filename)
+    return paths
+
+
+def make_tree(path, count, seed=SEED, fanout=20):
+    """make_tree() - Create a directory tree resembling a filesystem.
+
+    File sizes follow a log-normal distribution (median ~4k) and some
+    contents are duplicated, like shared libraries on a real host.
+
+    Args:
+        path (str) - Root of the tree.
+        count (int) - Number of files.
+        seed (int) - Random seed.
+        fanout (int) - Maximum files per directory.
+
+    Returns:
+        Total number of bytes written.
+    """
+    rng = random.Random(seed)
+    written = 0
+    contents = []
+    for index in range(count):
+        directory = os.path.join(path, "d%03d" % (index // fanout % 50),
+                                 "s%03d" % (index // (fanout * 50)))
+        os.makedirs(directory, exist_ok=True)
+        if contents and rng.random() < 0.1:
+            data = rng.choice(contents)
+        else:
+            size = min(int(rng.lognormvariate(8.3, 1.5)), 8 * 1024 * 1024)
+            data = random_bytes(rng, size)
+            if len(contents) < 100:
+                contents.append(data)
+        with open(os.path.join(directory, "f%06d" % index), "wb") as f:
+            f.write(data)
+        written += len(data)
+    return written
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""
+Compare the orders a scan can read files in on a loopback-mounted image.
+
+Example:
+    sudo python3 -m benchmarks.ordering --files 20000 --image-mb 2048
+    python3 -m benchmarks.ordering --dir /srv/data --no-drop-caches
+
+By default an ext4 image is created, mounted through a loop device and
+filled with files written in random order, so walk order, inode order and
+disk order all differ. The page cache is dropped before each run, so every
+file is read from the device. This needs root. With --dir an existing tree
+is scanned instead. Loop devices sit on a file in the host's page cache, so
+results say more about the number of requests than about seeking; point
+--image at a file on a hard disk to measure seeking.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+from million_dollar_dream.scanner import Scanner
+from million_dollar_dream.schedule import ORDERS
+
+
+def drop_caches():
+    """drop_caches() - Write dirty pages and drop the page cache.
+
+    Args:
+        None.
+
+    Returns:
+        True if the cache was dropped.
+    """
+    os.sync()
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+    except OSError:
+        return False
+    return True
+
+
+def make_image(image, megabytes, mountpoint):
+    """make_image() - Create and mount an ext4 image through a loop device.
+
+    Args:
+        image (str) - Path of the image file.
+        megabytes (int) - Size of the image.
+        mountpoint (str) - Directory to mount it on.
+
+    Returns:
+        Nothing.
+
+    Raises:
+        subprocess.CalledProcessError if mkfs or mount fail.
+    """
+    with open(image, "wb") as f:
+        f.truncate(megabytes * 1024 * 1024)
+    subprocess.run(["mkfs.ext4", "-q", "-F", image], check=True)
+    subprocess.run(["mount", "-o", "loop", image, mountpoint], check=True)
+
+
+def populate(root, files, max_size, seed=0):
+    """populate() - Fill a directory with files written in random order.
+
+    Args:
+        root (str) - Directory to fill.
+        files (int) - Number of files.
+        max_size (int) - Largest file in bytes. Sizes are log-uniform.
+        seed (int) - Random seed.
+
+    Returns:
+        Total bytes written (int).
+    """
+    rng = random.Random(seed)
+    directories = [os.path.join(root, "d%03d" % index)
+                   for index in range(max(1, files // 200))]
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+    names = [os.path.join(rng.choice(directories), "f%06d" % index)
+             for index in range(files)]
+    rng.shuffle(names)
+    total = 0
+    for name in names:
+        size = int(2 ** rng.uniform(9, max_size.bit_length()))
+        with open(name, "wb") as f:
+            f.write(os.urandom(min(size, max_size)))
+        total += min(size, max_size)
+    return total
+
+
+def run(root, order, jobs, drop):
+    """run() - Time a scan of a tree in one order.
+
+    Args:
+        root (str) - Directory to scan.
+        order (str) - One of schedule.ORDERS.
+        jobs (int) - Workers per device, or in total for "walk".
+        drop (bool) - Drop the page cache first.
+
+    Returns:
+        tuple of (seconds, files, bytes).
+    """
+    if drop and not drop_caches():
+        raise SystemExit("dropping the page cache needs root, or pass "
+                         "--no-drop-caches")
+    files = size = 0
+    start = time.perf_counter()
+    for result in Scanner([root], jobs=jobs, order=order).scan():
+        files += 1
+        size += result.size or 0
+    return time.perf_counter() - start, files, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--dir", help="scan this tree instead of an image")
+    parser.add_argument("--image", help="path of the image file (default: "
+                        "in a temporary directory)")
+    parser.add_argument("--image-mb", type=int, default=1024,
+                        help="size of the image (default: 1024)")
+    parser.add_argument("--files", type=int, default=10000,
+                        help="files written to the image (default: 10000)")
+    parser.add_argument("--max-size", type=int, default=256 * 1024,
+                        help="largest file in bytes (default: 262144)")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 4],
+                        help="job counts to try (default: 1 4)")
+    parser.add_argument("--orders", nargs="+", default=ORDERS,
+                        choices=ORDERS, help="orders to compare")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="runs of each, best is reported (default: 1)")
+    parser.add_argument("--no-drop-caches", action="store_true",
+                        help="don't drop the page cache between runs")
+    args = parser.parse_args()
+
+    workdir = mountpoint = None
+    root = args.dir
+    try:
+        if root is None:
+            workdir = tempfile.mkdtemp(prefix="mdd-ordering-")
+            mountpoint = os.path.join(workdir, "mnt")
+            os.mkdir(mountpoint)
+            image = args.image or os.path.join(workdir, "image.ext4")
+            make_image(image, args.image_mb, mountpoint)
+            root = mountpoint
+            print("[+] Writing %d files to %s" % (args.files, image))
+            total = populate(mountpoint, args.files, args.max_size)
+            print("    %.1fMB written" % (total / 1024 / 1024))
+
+        print("%-8s %5s %10s %10s %10s" % ("Order", "Jobs", "Seconds",
+                                           "Files/s", "MB/s"))
+        for jobs in args.jobs:
+            for order in args.orders:
+                seconds, files, size = min(
+                    run(root, order, jobs, not args.no_drop_caches)
+                    for _ in range(args.repeat))
+                print("%-8s %5d %10.2f %10.0f %10.1f"
+                      % (order, jobs, seconds, files / seconds,
+                         size / seconds / 1024 / 1024))
+    finally:
+        if mountpoint is not None and os.path.ismount(mountpoint):
+            subprocess.run(["umount", mountpoint], check=False)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Report the probes and cache lines each lookup touches under each sizing policy.
+
+Example:
+    python3 -m benchmarks.probes --count 1000000
+
+Every probe of a filter bigger than the CPU cache is likely a cache miss, so
+the number of distinct cache lines a lookup touches is what its latency
+mostly depends on. Lookups stop at the first unset bit, so elements that
+aren't in the filter touch fewer lines than those that are.
+"""
+
+import argparse
+import time
+
+from million_dollar_dream.bloomfilter import (
+    POLICIES, BloomFilter, element_hashes)
+
+from benchmarks import datasets
+
+# Size of a CPU cache line in bytes.
+CACHE_LINE = 64
+
+
+def probe_counts(bloomfilter, elements):
+    """probe_counts() - Count the bits and cache lines lookups probe.
+
+    Args:
+        bloomfilter (BloomFilter) - Filter to probe.
+        elements (list) - Elements to look up.
+
+    Returns:
+        tuple of (average probes, average cache lines) per lookup.
+    """
+    probes = lines = 0
+    bytesize = bloomfilter.bytesize
+    for element in elements:
+        touched = set()
+        for result in element_hashes(element, bloomfilter.hashcount):
+            position = result % bloomfilter.size
+            byte = (position - 1) >> 3 if position else bytesize - 1
+            probes += 1
+            touched.add(byte // CACHE_LINE)
+            if not bloomfilter.filter.getbit(position):
+                break
+        lines += len(touched)
+    return probes / len(elements), lines / len(elements)
+
+
+def measure(policy, count, sample):
+    """measure() - Build a filter with a policy and measure its lookups.
+
+    Args:
+        policy (str) - Key of POLICIES.
+        count (int) - Number of elements in the filter.
+        sample (int) - Number of present and of absent elements to probe.
+
+    Returns:
+        dict of results.
+    """
+    bloomfilter = BloomFilter(count, 0.01, policy=policy)
+    present = datasets.digests(count)
+    bloomfilter.add_many(present)
+    absent = datasets.digests(count, seed=1)
+
+    start = time.perf_counter()
+    false_positives = sum(bloomfilter.lookup_many(absent))
+    seconds = time.perf_counter() - start
+
+    absent_probes, absent_lines = probe_counts(bloomfilter, absent[:sample])
+    present_probes, present_lines = probe_counts(bloomfilter,
+                                                 present[:sample])
+    return dict(
+        hashcount=bloomfilter.hashcount,
+        bits_per_element=bloomfilter.size / count,
+        bytesize=bloomfilter.bytesize,
+        fp_rate=false_positives / count,
+        absent_probes=absent_probes,
+        absent_lines=absent_lines,
+        present_probes=present_probes,
+        present_lines=present_lines,
+        lookups_per_sec=count / seconds if seconds else 0.0,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--count", type=int, default=1000000,
+                        help="elements per filter (default: 1000000)")
+    parser.add_argument("--sample", type=int, default=20000,
+                        help="lookups probed per kind (default: 20000)")
+    args = parser.parse_args()
+
+    print("%-9s %6s %9s %9s %8s %13s %13s %11s" % (
+        "Policy", "Hashes", "Bits/elt", "Size", "FP rate",
+        "Absent p/l", "Present p/l", "Lookups/s"))
+    for policy in sorted(POLICIES, key=POLICIES.get):
+        result = measure(policy, args.count, min(args.sample, args.count))
+        print("%-9s %6d %9.2f %8.1fM %8.4f %6.2f/%-6.2f %6.2f/%-6.2f %11.0f"
+              % (policy, result["hashcount"], result["bits_per_element"],
+                 result["bytesize"] / 1024 / 1024, result["fp_rate"],
+                 result["absent_probes"], result["absent_lines"],
+                 result["present_probes"], result["present_lines"],
+                 result["lookups_per_sec"]))
+
+
+if __name__ == "__main__":
+    main()
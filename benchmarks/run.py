@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""
+Run the benchmark suite and optionally compare against a previous run.
+
+Example:
+    python3 -m benchmarks.run --output baseline.json
+    ...
+    python3 -m benchmarks.run --output current.json --baseline baseline.json
+
+Exits with a non-zero status if any benchmark's throughput dropped by more
+than --threshold compared to the baseline.
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import sys
+import time
+
+from million_dollar_dream.__version__ import __version__
+
+from benchmarks import suite
+
+
+def measure(func, scale, repeat):
+    """measure() - Time a benchmark.
+
+    Args:
+        func (function) - Benchmark from suite.BENCHMARKS.
+        scale (float) - Scale factor passed to the benchmark.
+        repeat (int) - Number of timed runs. The fastest is reported.
+
+    Returns:
+        dict containing ops, seconds and ops_per_sec.
+    """
+    ops, run = func(scale)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return dict(
+        ops=ops,
+        seconds=best,
+        ops_per_sec=ops / best if best else 0.0,
+        timings=timings,
+    )
+
+
+def compare(results, baseline, threshold):
+    """compare() - Find benchmarks slower than the baseline.
+
+    Args:
+        results (dict) - Results from this run.
+        baseline (dict) - Results from a previous run.
+        threshold (float) - Allowed fractional drop in throughput.
+
+    Returns:
+        list of (name, baseline ops/s, current ops/s, change) tuples for
+        benchmarks that regressed.
+    """
+    regressions = []
+    for name, result in sorted(results["results"].items()):
+        previous = baseline["results"].get(name)
+        if not previous or not previous["ops_per_sec"]:
+            continue
+        change = result["ops_per_sec"] / previous["ops_per_sec"] - 1
+        if change < -threshold:
+            regressions.append(
+                (name, previous["ops_per_sec"], result["ops_per_sec"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed throughput drop (default: 0.2)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="dataset size multiplier (default: 1.0)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per benchmark (default: 3)")
+    parser.add_argument("--filter", default="*",
+                        help="glob of benchmark names to run")
+    args = parser.parse_args()
+
+    results = dict(
+        meta=dict(
+            version=__version__,
+            python=platform.python_version(),
+            implementation=platform.python_implementation(),
+            platform=platform.platform(),
+            cpus=os.cpu_count(),
+            native_mmh3=suite.native_mmh3() is not None,
+            scale=args.scale,
+            repeat=args.repeat,
+            time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        ),
+        results=dict(),
+    )
+
+    try:
+        for name, func in sorted(suite.BENCHMARKS.items()):
+            if not fnmatch.fnmatch(name, args.filter):
+                continue
+            result = measure(func, args.scale, args.repeat)
+            results["results"][name] = result
+            print("%-36s %14.1f ops/s %10.4fs" %
+                  (name, result["ops_per_sec"], result["seconds"]))
+    finally:
+        suite.cleanup()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, sort_keys=True, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, change in regressions:
+            print("[-] %s regressed %.1f%%: %.1f -> %.1f ops/s" %
+                  (name, -change * 100, before, after))
+        if regressions:
+            sys.exit(1)
+        print("[+] No regressions beyond %.0f%%" % (args.threshold * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Benchmarks for the filter, hashing and scan hot paths.
+
+Each benchmark is a function taking a scale factor. It does any setup it
+needs and returns (operations, run), where run() is the callable that gets
+timed and operations is the number of items run() processes.
+"""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from million_dollar_dream import bloomfilter as bloomfilter_module
+from million_dollar_dream import pymmh3
+from million_dollar_dream.bitfield import BitField
+from million_dollar_dream.bloomfilter import POLICIES, BloomFilter
+from million_dollar_dream.scanner import Scanner, md5_file
+
+from benchmarks import datasets
+
+BENCHMARKS = {}
+
+# Directories created by benchmarks, removed by cleanup().
+TEMP_DIRS = []
+
+
+def benchmark(name):
+    """benchmark() - Decorator registering a benchmark under a name."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def temp_dir():
+    """temp_dir() - Create a temporary directory removed by cleanup()."""
+    path = tempfile.mkdtemp(prefix="mdd-bench-")
+    TEMP_DIRS.append(path)
+    return path
+
+
+def cleanup():
+    """cleanup() - Remove temporary directories created by benchmarks."""
+    while TEMP_DIRS:
+        shutil.rmtree(TEMP_DIRS.pop(), ignore_errors=True)
+
+
+def native_mmh3():
+    """native_mmh3() - Get the mmh3 C extension, or None if not installed."""
+    try:
+        import mmh3
+    except ImportError:
+        return None
+    return mmh3
+
+
+@contextmanager
+def hash_module(module, compiled=None):
+    """hash_module() - Temporarily make BloomFilter use a murmur3 module,
+                       and the compiled extension if one is given."""
+    original = bloomfilter_module.mmh3, bloomfilter_module.compiled
+    bloomfilter_module.mmh3 = module
+    bloomfilter_module.compiled = compiled
+    try:
+        yield
+    finally:
+        bloomfilter_module.mmh3, bloomfilter_module.compiled = original
+
+
+def filled_filter(count, fp_rate=0.01):
+    """filled_filter() - Build a filter holding count random digests."""
+    bloomfilter = BloomFilter(count, fp_rate)
+    for digest in datasets.digests(count):
+        bloomfilter.add(digest)
+    return bloomfilter
+
+
+@benchmark("bitfield.setbit")
+def bitfield_setbit(scale):
+    count = int(1000000 * scale)
+    bitfield = BitField(count * 10)
+    positions = [(index * 7919) % (count * 10) for index in range(count)]
+
+    def run():
+        for position in positions:
+            bitfield.setbit(position)
+    return count, run
+
+
+@benchmark("bitfield.getbit")
+def bitfield_getbit(scale):
+    count = int(1000000 * scale)
+    bitfield = BitField(count * 10)
+    positions = [(index * 7919) % (count * 10) for index in range(count)]
+
+    def run():
+        for position in positions:
+            bitfield.getbit(position)
+    return count, run
+
+
+def bloom_benchmarks(hash_name, module, count, compiled=None):
+    """bloom_benchmarks() - Register add/lookup benchmarks for a murmur3
+                            implementation."""
+
+    @benchmark("bloomfilter.add.%s" % hash_name)
+    def bloom_add(scale):
+        digests = datasets.digests(int(count * scale))
+        bloomfilter = BloomFilter(len(digests), 0.01)
+
+        def run():
+            with hash_module(module, compiled):
+                for digest in digests:
+                    bloomfilter.add(digest)
+        return len(digests), run
+
+    @benchmark("bloomfilter.lookup.%s" % hash_name)
+    def bloom_lookup(scale):
+        bloomfilter = filled_filter(int(count * scale))
+        # Half present, half absent.
+        digests = datasets.digests(int(count * scale) // 2) + \
+            datasets.digests(int(count * scale) // 2, seed=1)
+
+        def run():
+            with hash_module(module, compiled):
+                for digest in digests:
+                    bloomfilter.lookup(digest)
+        return len(digests), run
+
+    @benchmark("bloomfilter.lookup_many.%s" % hash_name)
+    def bloom_lookup_many(scale):
+        bloomfilter = filled_filter(int(count * scale))
+        digests = datasets.digests(int(count * scale) // 2) + \
+            datasets.digests(int(count * scale) // 2, seed=1)
+
+        def run():
+            with hash_module(module, compiled):
+                bloomfilter.lookup_many(digests)
+        return len(digests), run
+
+
+if native_mmh3():
+    bloom_benchmarks("mmh3", native_mmh3(), 200000)
+bloom_benchmarks("pymmh3", pymmh3, 20000)
+if bloomfilter_module.compiled:
+    bloom_benchmarks("cython", pymmh3, 200000, bloomfilter_module.compiled)
+
+
+def policy_benchmarks(policy, count):
+    """policy_benchmarks() - Register lookup benchmarks for a sizing policy,
+                             using the fastest hashing available."""
+
+    @benchmark("bloomfilter.policy.%s.lookup_many" % policy)
+    def policy_lookup_many(scale):
+        size = int(count * scale)
+        bloomfilter = BloomFilter(size, 0.01, policy=policy)
+        bloomfilter.add_many(datasets.digests(size))
+        digests = datasets.digests(size // 2) + \
+            datasets.digests(size // 2, seed=1)
+
+        def run():
+            bloomfilter.lookup_many(digests)
+        return len(digests), run
+
+
+# Big enough that the filters don't fit in L2 cache, unless every element
+# is hashed in pure Python.
+for policy in sorted(POLICIES):
+    policy_benchmarks(policy, 1000000 if native_mmh3() or
+                      bloomfilter_module.compiled else 20000)
+
+
+@benchmark("pymmh3.hash")
+def pymmh3_hash(scale):
+    digests = datasets.digests(int(100000 * scale))
+
+    def run():
+        for digest in digests:
+            pymmh3.hash(digest, 1)
+    return len(digests), run
+
+
+@benchmark("pymmh3.hash_seeds")
+def pymmh3_hash_seeds(scale):
+    # Operations are keys hashed with 7 seeds, like a bloom filter add.
+    digests = datasets.digests(int(20000 * scale))
+    seeds = range(7)
+
+    def run():
+        for digest in digests:
+            pymmh3.hash_seeds(digest, seeds)
+    return len(digests), run
+
+
+@benchmark("npmmh3.hash_batch")
+def npmmh3_hash_batch(scale):
+    from million_dollar_dream import npmmh3
+    digests = datasets.digests(int(1000000 * scale))
+
+    def run():
+        npmmh3.hash_batch(digests, 1)
+    return len(digests), run
+
+
+@benchmark("bloomfilter.save")
+def bloom_save(scale):
+    bloomfilter = filled_filter(int(1000000 * scale))
+    path = os.path.join(temp_dir(), "filter")
+
+    def run():
+        bloomfilter.save(path)
+    return bloomfilter.bytesize, run
+
+
+@benchmark("bloomfilter.load")
+def bloom_load(scale):
+    bloomfilter = filled_filter(int(1000000 * scale))
+    path = os.path.join(temp_dir(), "filter")
+    bloomfilter.save(path)
+
+    def run():
+        BloomFilter(1, 0.01).load(path)
+    return bloomfilter.bytesize, run
+
+
+def md5_benchmark(name, size, count):
+    @benchmark("md5_file.%s" % name)
+    def md5_files(scale):
+        paths = datasets.make_files(temp_dir(), size,
+                                    max(1, int(count * scale)))
+
+        def run():
+            for path in paths:
+                md5_file(path)
+        # Measured in bytes so the file sizes can be compared.
+        return size * len(paths), run
+
+
+for name, size, count in datasets.FILE_SIZES:
+    md5_benchmark(name, size, count)
+
+
+@benchmark("scan.calculate")
+def scan_calculate(scale):
+    root = temp_dir()
+    count = int(5000 * scale)
+    datasets.make_tree(root, count)
+
+    def run():
+        bloomfilter = BloomFilter(count, 0.01)
+        for result in Scanner([root]).scan():
+            if result.digest:
+                bloomfilter.add(result.digest)
+    return count, run
+
+
+@benchmark("scan.lookup")
+def scan_lookup(scale):
+    root = temp_dir()
+    count = int(5000 * scale)
+    datasets.make_tree(root, count)
+    bloomfilter = BloomFilter(count, 0.01)
+    for result in Scanner([root]).scan():
+        bloomfilter.add(result.digest)
+
+    def run():
+        for _ in Scanner([root], bloomfilter).scan():
+            pass
+    return count, run
@@ -6,6 +6,7 @@ Calculate hashes from NIST NSRL datasets
 
 import csv
 from dmfrbloom import bloomfilter
+from million_dollar_dream.digeststore import DigestStoreWriter
 
 OS = {}
 with open("NSRLOS.txt") as csvfile:
@@ -42,11 +43,17 @@ with open("NSRLFile.txt", encoding="utf-8", errors="ignore") as csvfile:
         #    exit()
 
 BF = {}
+# Exact digest lists saved beside each filter. Small runs keep memory bounded
+# with one writer per OS.
+STORES = {}
 for x in COUNT:
     print(x, COUNT[x])
     if COUNT[x] == 0:
         continue
     BF[x] = bloomfilter.BloomFilter(COUNT[x], 0.01)
+    STORES[x] = DigestStoreWriter(
+        "filters/" + x.replace("/", "").replace(" ", "_") + ".digests",
+        run_size=262144)
 
 count = 0
 with open("NSRLFile.txt", encoding="utf-8", errors="ignore") as csvfile:
@@ -57,7 +64,9 @@ with open("NSRLFile.txt", encoding="utf-8", errors="ignore") as csvfile:
         if count % 10000 == 0:
             print(row[1].lower())
         BF[PROD[row[5]][1]].add(row[1].lower())
+        STORES[PROD[row[5]][1]].add(row[1].lower())
 
 for x in BF:
     print(x)
     BF[x].save("filters/" + x.replace("/", "").replace(" ", "_"))
+    STORES[x].close()
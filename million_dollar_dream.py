@@ -8,6 +8,7 @@ a filter has been pre-calculated.
 Example:
     ./million_dollar_dream.py calculate ubuntu-16.04.filter /bin /sbin /etc /usr
     ./million_dollar_dream.py lookup ubuntu-16.04.filter /bin/bash
+    ./million_dollar_dream.py lookup-hashes ubuntu-16.04.filter md5s.txt
     ...
     This will show what is/isn't in the filter
     ...
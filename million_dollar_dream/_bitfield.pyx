@@ -0,0 +1,136 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled BitField.
+
+Same interface and bit layout as the pure-Python BitField in bitfield.py,
+which is used instead when this extension hasn't been built.
+"""
+
+from collections import namedtuple
+
+from libc.string cimport memset
+
+
+Position = namedtuple("position", ["byte", "bit"])
+
+
+cdef class BitField(object):
+    """BitField class -- Implements bitfields as a compiled extension.
+
+    Attributes:
+        size (int) - size of the bit field
+        bitfield (bytearray) - byte array containing the bitfield
+        position (namedtuple) - Named tuple returned by getpos().
+    """
+    cdef public object size
+    cdef public object position
+    cdef object _bitfield
+    cdef const unsigned char[:] view
+    # Same buffer as view, or None if it is read only.
+    cdef unsigned char[:] writable
+
+    def __init__(self, size):
+        self.size = size
+        self.bitfield = bytearray((size + 7) // 8)
+        self.position = Position
+
+    @property
+    def bitfield(self):
+        return self._bitfield
+
+    @bitfield.setter
+    def bitfield(self, value):
+        self.view = value
+        try:
+            self.writable = value
+        except (BufferError, ValueError):
+            self.writable = None
+        self._bitfield = value
+
+    cdef unsigned char[:] write_view(self):
+        if self.writable is None:
+            raise TypeError("bitfield is read only")
+        return self.writable
+
+    cdef Py_ssize_t index(self, Py_ssize_t position) except -1:
+        """Byte holding a bit. Position 0 is in the last byte, like
+        getpos()."""
+        cdef Py_ssize_t byte = (position - 1) // 8
+        if byte < 0:
+            byte += self.view.shape[0]
+        if byte < 0 or byte >= self.view.shape[0]:
+            raise IndexError("bitfield index out of range")
+        return byte
+
+    def setbit(self, Py_ssize_t position):
+        """BitField.setbit() - set bit at specified position to 1
+
+        Args:
+            position (int) - Position to set.
+
+        Returns:
+            Nothing.
+        """
+        self.write_view()[self.index(position)] |= 1 << (-position & 7)
+
+    def unsetbit(self, Py_ssize_t position):
+        """BitField.unsetbit() - set bit at specified position to 0
+
+        Args:
+            position (int) - Position to unset.
+
+        Returns:
+            Nothing.
+        """
+        self.write_view()[self.index(position)] &= ~(1 << (-position & 7))
+
+    def getbit(self, Py_ssize_t position):
+        """Bitfield.getbit() - Retrieve contents of bit at a specific location.
+
+        Args:
+            position (int) - Position to retrieve.
+
+        Returns:
+            True if bit is set (1).
+            False if bit is not set (0).
+        """
+        if self.view[self.index(position)] & (1 << (-position & 7)):
+            return True
+        return False
+
+    def zero(self):
+        """Bitfield.zero() - Set all bits to zero.
+
+        Args:
+            None
+
+        Returns:
+            Nothing
+        """
+        cdef unsigned char[:] view = self.write_view()
+        if view.shape[0]:
+            memset(&view[0], 0x00, view.shape[0])
+
+    def one(self):
+        """Bitfield.one() - Set all bits to one.
+
+        Args:
+            None
+
+        Returns:
+            Nothing
+        """
+        cdef unsigned char[:] view = self.write_view()
+        if view.shape[0]:
+            memset(&view[0], 0xff, view.shape[0])
+
+    def getpos(self, Py_ssize_t position):
+        """Bitfield.getpos() - Get position of a bit in a bitfield.
+
+        Args:
+            position (int) - Position to retrieve.
+
+        Returns:
+            position (namedtuple) containing byte and bit positions.
+        """
+        return self.position((position - 1) // 8, -position & 7)
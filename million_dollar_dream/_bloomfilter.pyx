@@ -0,0 +1,251 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled add and lookup loops for BloomFilter, with murmur3 inlined.
+
+Elements are hashed exactly like mmh3.hash(str(element), seed) and set the
+same bits as BitField.setbit(), so filters built with or without this
+extension are interchangeable. Used by bloomfilter.py when it has been
+built.
+"""
+
+from libc.stdint cimport int32_t, int64_t, uint32_t
+from libc.stdlib cimport free, malloc, qsort
+
+
+cdef inline uint32_t rotl32(uint32_t value, int shift) noexcept nogil:
+    return (value << shift) | (value >> (32 - shift))
+
+
+cdef uint32_t murmur3_32(const unsigned char *data, Py_ssize_t length,
+                         uint32_t seed) noexcept nogil:
+    """murmur3 x86_32. Blocks are assembled byte by byte so the result
+    doesn't depend on the host's byte order."""
+    cdef uint32_t c1 = 0xcc9e2d51
+    cdef uint32_t c2 = 0x1b873593
+    cdef uint32_t n1 = 0xe6546b64
+    cdef uint32_t f1 = 0x85ebca6b
+    cdef uint32_t f2 = 0xc2b2ae35
+    cdef uint32_t h1 = seed
+    cdef uint32_t k1
+    cdef Py_ssize_t nblocks = length // 4
+    cdef Py_ssize_t block
+    cdef const unsigned char *tail
+
+    for block in range(nblocks):
+        k1 = (<uint32_t>data[block * 4] |
+              <uint32_t>data[block * 4 + 1] << 8 |
+              <uint32_t>data[block * 4 + 2] << 16 |
+              <uint32_t>data[block * 4 + 3] << 24)
+        k1 *= c1
+        k1 = rotl32(k1, 15)
+        k1 *= c2
+        h1 ^= k1
+        h1 = rotl32(h1, 13)
+        h1 = h1 * 5 + n1
+
+    tail = data + nblocks * 4
+    k1 = 0
+    if length & 3 >= 3:
+        k1 ^= <uint32_t>tail[2] << 16
+    if length & 3 >= 2:
+        k1 ^= <uint32_t>tail[1] << 8
+    if length & 3 >= 1:
+        k1 ^= tail[0]
+        k1 *= c1
+        k1 = rotl32(k1, 15)
+        k1 *= c2
+        h1 ^= k1
+
+    h1 ^= <uint32_t>length
+    h1 ^= h1 >> 16
+    h1 *= f1
+    h1 ^= h1 >> 13
+    h1 *= f2
+    h1 ^= h1 >> 16
+    return h1
+
+
+cdef inline int64_t bit_position(const unsigned char *data,
+                                 Py_ssize_t length, uint32_t seed,
+                                 int64_t size) noexcept nogil:
+    """mmh3.hash(key, seed) % size with Python's sign rules."""
+    cdef int64_t position = (<int32_t>murmur3_32(data, length, seed)) % size
+    if position < 0:
+        position += size
+    return position
+
+
+cdef inline Py_ssize_t bit_byte(int64_t position,
+                                Py_ssize_t nbytes) noexcept nogil:
+    """Byte holding a bit, like BitField.getpos(). Position 0 is in the
+    last byte."""
+    if position == 0:
+        return nbytes - 1
+    return <Py_ssize_t>((position - 1) >> 3)
+
+
+cdef inline unsigned char bit_mask(int64_t position) noexcept nogil:
+    return 1 << ((8 - (position & 7)) & 7)
+
+
+cdef bytes encode(element):
+    return str(element).encode("utf-8")
+
+
+cdef int check_size(Py_ssize_t nbytes, int64_t size) except -1:
+    if size <= 0 or nbytes < (size + 7) // 8:
+        raise ValueError("bitfield is too small for a filter of %d bits"
+                         % size)
+    return 0
+
+
+cdef void set_bits(unsigned char *bits, Py_ssize_t nbytes, int64_t size,
+                   int hashcount, const unsigned char *data,
+                   Py_ssize_t length) noexcept nogil:
+    cdef int seed
+    cdef int64_t position
+    for seed in range(hashcount):
+        position = bit_position(data, length, seed, size)
+        bits[bit_byte(position, nbytes)] |= bit_mask(position)
+
+
+cdef bint test_bits(const unsigned char *bits, Py_ssize_t nbytes,
+                    int64_t size, int hashcount, const unsigned char *data,
+                    Py_ssize_t length) noexcept nogil:
+    cdef int seed
+    cdef int64_t position
+    for seed in range(hashcount):
+        position = bit_position(data, length, seed, size)
+        if not bits[bit_byte(position, nbytes)] & bit_mask(position):
+            return False
+    return True
+
+
+cdef int compare_positions(const void *first, const void *second) \
+        noexcept nogil:
+    cdef int64_t a = (<const int64_t *>first)[0]
+    cdef int64_t b = (<const int64_t *>second)[0]
+    return (a > b) - (a < b)
+
+
+def hash(key, uint32_t seed=0):
+    """hash() - Same as mmh3.hash(), for testing the inlined murmur3.
+
+    Args:
+        key (str or bytes) - Key to hash.
+        seed (int) - Hash seed.
+
+    Returns:
+        Signed 32 bit hash.
+    """
+    cdef bytes data = key.encode("utf-8") if isinstance(key, str) \
+        else bytes(key)
+    return <int32_t>murmur3_32(data, len(data), seed)
+
+
+def add(unsigned char[:] bitfield, int64_t size, int hashcount, element):
+    """add() - Compiled BloomFilter.add().
+
+    Args:
+        bitfield (bytearray) - The filter's bits.
+        size (int) - Size of the filter in bits.
+        hashcount (int) - Number of hashes per element.
+        element (str) - Element to add.
+
+    Returns:
+        Nothing.
+    """
+    cdef bytes data = encode(element)
+    check_size(bitfield.shape[0], size)
+    set_bits(&bitfield[0], bitfield.shape[0], size, hashcount, data,
+             len(data))
+
+
+def lookup(const unsigned char[:] bitfield, int64_t size, int hashcount,
+           element):
+    """lookup() - Compiled BloomFilter.lookup().
+
+    Args:
+        bitfield (bytearray) - The filter's bits.
+        size (int) - Size of the filter in bits.
+        hashcount (int) - Number of hashes per element.
+        element (str) - Element to look up.
+
+    Returns:
+        True if the element may be in the filter.
+    """
+    cdef bytes data = encode(element)
+    check_size(bitfield.shape[0], size)
+    return test_bits(&bitfield[0], bitfield.shape[0], size, hashcount,
+                     data, len(data))
+
+
+def add_many(unsigned char[:] bitfield, int64_t size, int hashcount,
+             elements, bint ordered=False):
+    """add_many() - Compiled BloomFilter.add_many().
+
+    Args:
+        bitfield (bytearray) - The filter's bits.
+        size (int) - Size of the filter in bits.
+        hashcount (int) - Number of hashes per element.
+        elements (iterable) - Elements to add.
+        ordered (bool) - Set the batch's bits in position order, so writes
+                         to a mapped filter are sequential.
+
+    Returns:
+        Nothing.
+    """
+    cdef bytes data
+    cdef list keys
+    cdef int64_t *positions
+    cdef Py_ssize_t count, index = 0
+    cdef int seed
+    check_size(bitfield.shape[0], size)
+    if not ordered:
+        for element in elements:
+            data = encode(element)
+            set_bits(&bitfield[0], bitfield.shape[0], size, hashcount, data,
+                     len(data))
+        return
+
+    keys = [encode(element) for element in elements]
+    count = len(keys) * hashcount
+    if not count:
+        return
+    positions = <int64_t *>malloc(count * sizeof(int64_t))
+    if positions == NULL:
+        raise MemoryError()
+    try:
+        for data in keys:
+            for seed in range(hashcount):
+                positions[index] = bit_position(data, len(data), seed, size)
+                index += 1
+        qsort(positions, count, sizeof(int64_t), compare_positions)
+        for index in range(count):
+            bitfield[bit_byte(positions[index], bitfield.shape[0])] |= \
+                bit_mask(positions[index])
+    finally:
+        free(positions)
+
+
+def lookup_many(const unsigned char[:] bitfield, int64_t size, int hashcount,
+                elements):
+    """lookup_many() - Compiled BloomFilter.lookup_many().
+
+    Args:
+        bitfield (bytearray) - The filter's bits.
+        size (int) - Size of the filter in bits.
+        hashcount (int) - Number of hashes per element.
+        elements (iterable) - Elements to look up.
+
+    Returns:
+        list of booleans, one per element.
+    """
+    cdef bytes data
+    cdef list results = []
+    check_size(bitfield.shape[0], size)
+    for element in elements:
+        data = encode(element)
+        results.append(test_bits(&bitfield[0], bitfield.shape[0], size,
+                                 hashcount, data, len(data)))
+    return results
@@ -0,0 +1,605 @@
+"""
+Reading the files inside archives without extracting them.
+
+Archives are read as streams, one member at a time, and each member is
+hashed as it is read, so nothing is written to disk and memory use doesn't
+depend on the size of the archive or its members. Supported formats are
+tar, zip, ar (including .deb packages), cpio and rpm, and tar or cpio
+compressed with gzip, bzip2 or xz. zstd compressed payloads, used by newer
+rpms, need the zstandard package. A single file compressed with gzip, bzip2
+or xz is treated as an archive holding the uncompressed file.
+
+Members are named "<archive>!<member>", so a file inside a .deb's data
+tarball is "pkg.deb!data.tar.xz!usr/bin/foo". ArchiveHasher hashes an
+archive with the same read that streams its members.
+"""
+
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Separates an archive's path from the names of its members.
+SEPARATOR = "!"
+
+# Names of files that may be archives. Anything else isn't opened.
+EXTENSIONS = (
+    ".tar", ".tgz", ".tbz", ".tbz2", ".txz", ".gz", ".bz2", ".xz", ".zst",
+    ".zip", ".jar", ".war", ".ear", ".apk", ".whl", ".egg", ".nupkg",
+    ".deb", ".udeb", ".ipk", ".a", ".rpm", ".cpio",
+)
+
+# Levels of archives within archives that are read, ex: a .deb holds
+# data.tar.xz, which is read at the second level.
+MAX_DEPTH = 3
+
+# Largest zip member of a stream that is read into memory to look inside.
+# zip needs random access, so bigger ones are hashed but not descended into.
+MAX_BUFFER = 64 * 1024 * 1024
+
+# Bytes read from a member at a time.
+CHUNK = 65536
+
+# Bytes needed to recognise any supported format.
+HEAD = 512
+
+# Errors meaning an archive or member is damaged or in an unsupported
+# format. zipfile raises RuntimeError for encrypted members and
+# NotImplementedError for compression methods it lacks, ex: deflate64.
+ERRORS = (OSError, EOFError, ValueError, RuntimeError, NotImplementedError,
+          tarfile.TarError, zipfile.BadZipFile, zipfile.LargeZipFile,
+          lzma.LZMAError, zlib.error)
+if zstandard is not None:
+    ERRORS += (zstandard.ZstdError,)
+
+
+def is_archive(name):
+    """is_archive() - Check if a file is named like an archive.
+
+    Args:
+        name (str) - Path or name of the file.
+
+    Returns:
+        True if the file should be opened to look for members.
+    """
+    return name.lower().endswith(EXTENSIONS)
+
+
+def archive_format(head):
+    """archive_format() - Recognise an archive from its first bytes.
+
+    Args:
+        head (bytes) - The first HEAD bytes of the file, or all of it.
+
+    Returns:
+        str naming the format, or None if it isn't recognised.
+    """
+    if head.startswith((b"PK\x03\x04", b"PK\x05\x06")):
+        return "zip"
+    if head.startswith(b"!<arch>\n"):
+        return "ar"
+    if head.startswith(b"\xed\xab\xee\xdb"):
+        return "rpm"
+    if head.startswith((b"070701", b"070702")):
+        return "cpio"
+    if head[257:262] == b"ustar":
+        return "tar"
+    if head.startswith(b"\x1f\x8b"):
+        return "gzip"
+    if head.startswith(b"BZh") and head[3:4].isdigit():
+        return "bzip2"
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return "xz"
+    if head.startswith(b"\x28\xb5\x2f\xfd"):
+        return "zstd"
+    return None
+
+
+def decompressor(compression, fileobj):
+    """decompressor() - Open a compressed stream.
+
+    Args:
+        compression (str) - Format from archive_format().
+        fileobj (file) - Compressed stream.
+
+    Returns:
+        File object reading the decompressed stream.
+
+    Raises:
+        ValueError if the compression isn't supported.
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if compression == "bzip2":
+        return bz2.BZ2File(fileobj, "rb")
+    if compression == "xz":
+        return lzma.LZMAFile(fileobj, "rb")
+    if compression == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    raise ValueError("unsupported compression: %s" % compression)
+
+
+def member_name(name):
+    """member_name() - Tidy the name of an archive member.
+
+    Args:
+        name (str) - Name as stored in the archive, ex: "./usr/bin/foo"
+
+    Returns:
+        str without leading "./" or "/", ex: "usr/bin/foo"
+    """
+    while name.startswith("./"):
+        name = name[2:]
+    return name.lstrip("/")
+
+
+def read_exactly(fileobj, size):
+    """read_exactly() - Read a number of bytes from a stream.
+
+    Args:
+        fileobj (file) - Stream to read.
+        size (int) - Bytes to read.
+
+    Returns:
+        bytes.
+
+    Raises:
+        EOFError if the stream ends first.
+    """
+    data = b""
+    while len(data) < size:
+        chunk = fileobj.read(size - len(data))
+        if not chunk:
+            raise EOFError("archive is truncated")
+        data += chunk
+    return data
+
+
+class Stream(object):
+    """Stream class - Wraps a stream that has had its first bytes read, so
+                      they can be read again.
+
+    Attributes:
+        fileobj (file) - The stream.
+        buffer (bytes) - Bytes read from the stream but not yet returned.
+    """
+    def __init__(self, fileobj, buffer=b""):
+        self.fileobj = fileobj
+        self.buffer = buffer
+
+    def read(self, size=-1):
+        """Stream.read() - Read from the stream.
+
+        Args:
+            size (int) - Most bytes to read, or -1 for all of them.
+
+        Returns:
+            bytes, empty at the end of the stream.
+        """
+        if self.buffer:
+            if size < 0:
+                data, self.buffer = self.buffer + self.fileobj.read(), b""
+            elif size > len(self.buffer):
+                data, self.buffer = self.buffer, b""
+                data += self.fileobj.read(size - len(data))
+            else:
+                data, self.buffer = self.buffer[:size], self.buffer[size:]
+            return data
+        return self.fileobj.read(size)
+
+
+class Region(object):
+    """Region class - Reads a fixed number of bytes from a stream, ex: one
+                      member of an ar or cpio archive.
+
+    Attributes:
+        fileobj (file) - The stream.
+        remaining (int) - Bytes left to read.
+    """
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.remaining = size
+
+    def read(self, size=-1):
+        """Region.read() - Read from the region.
+
+        Args:
+            size (int) - Most bytes to read, or -1 for the rest.
+
+        Returns:
+            bytes, empty at the end of the region.
+        """
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        if not size:
+            return b""
+        data = self.fileobj.read(size)
+        if not data:
+            raise EOFError("archive is truncated")
+        self.remaining -= len(data)
+        return data
+
+    def skip(self):
+        """Region.skip() - Read to the end of the region.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        while self.read(CHUNK):
+            pass
+
+
+class HashingReader(object):
+    """HashingReader class - Hashes everything read through it, so a member
+                             can be hashed while it is read as an archive.
+
+    Attributes:
+        fileobj (file) - The stream.
+        md5hash (hashlib.md5) - Hash of the bytes read so far.
+        size (int) - Number of bytes read so far.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5hash = hashlib.md5()
+        self.size = 0
+
+    def read(self, size=-1):
+        """HashingReader.read() - Read from the stream.
+
+        Args:
+            size (int) - Most bytes to read, or -1 for all of them.
+
+        Returns:
+            bytes.
+        """
+        data = self.fileobj.read(size)
+        self.md5hash.update(data)
+        self.size += len(data)
+        return data
+
+    def finish(self):
+        """HashingReader.finish() - Read the rest of the stream.
+
+        Args:
+            None.
+
+        Returns:
+            tuple of (size, hex digest) of the whole stream.
+        """
+        while self.read(CHUNK):
+            pass
+        return self.size, self.md5hash.hexdigest()
+
+
+def hash_stream(fileobj):
+    """hash_stream() - Hash a stream to its end.
+
+    Args:
+        fileobj (file) - Stream to hash.
+
+    Returns:
+        tuple of (size, hex digest).
+    """
+    return HashingReader(fileobj).finish()
+
+
+def member(fileobj, path, depth):
+    """member() - Hash a member, first reading the archive it holds if it is
+                  one.
+
+    Args:
+        fileobj (file) - Stream of the member's contents.
+        path (str) - Name of the member, including its archive's path.
+        depth (int) - Levels of archives still to read.
+
+    Returns:
+        Generator yielding (path, size, digest) for members of the member,
+        then for the member itself.
+    """
+    reader = HashingReader(fileobj)
+    if depth > 0 and is_archive(path):
+        try:
+            yield from stream_members(reader, path, depth - 1)
+        except ERRORS:
+            # Damaged or unsupported. It is still hashed as a file.
+            pass
+    yield (path,) + reader.finish()
+
+
+def stream_members(fileobj, path, depth):
+    """stream_members() - Read the members of an archive from a stream.
+
+    Args:
+        fileobj (file) - Stream of the archive. Only read() is used, unless
+                         it is a zip in a file that can seek.
+        path (str) - Path or name of the archive.
+        depth (int) - Levels of archives within this one still to read.
+
+    Returns:
+        Generator yielding (path, size, digest) for each regular file in the
+        archive. size and digest are None for a zip member that can't be
+        read.
+
+    Raises:
+        One of ERRORS if the archive is damaged or unsupported.
+    """
+    head = fileobj.read(HEAD)
+    kind = archive_format(head)
+    if kind == "zip" and hasattr(fileobj, "seekable") and fileobj.seekable():
+        fileobj.seek(0)
+        yield from zip_members(fileobj, path, depth)
+        return
+    stream = Stream(fileobj, head)
+    if kind == "zip":
+        data = stream.read(MAX_BUFFER + 1)
+        if len(data) <= MAX_BUFFER:
+            yield from zip_members(io.BytesIO(data), path, depth)
+    elif kind in ("gzip", "bzip2", "xz", "zstd"):
+        stream = decompressor(kind, stream)
+        head = stream.read(HEAD)
+        inner = archive_format(head)
+        stream = Stream(stream, head)
+        if inner in ("tar", "cpio"):
+            yield from stream_members(stream, path, depth)
+        else:
+            # A single compressed file, ex: foo.txt.gz holds foo.txt.
+            name = os.path.basename(path.rsplit(SEPARATOR, 1)[-1])
+            name = os.path.splitext(name)[0]
+            yield from member(stream, path + SEPARATOR + name, depth)
+    elif kind == "tar":
+        yield from tar_members(stream, path, depth)
+    elif kind == "ar":
+        yield from ar_members(stream, path, depth)
+    elif kind == "cpio":
+        yield from cpio_members(stream, path, depth)
+    elif kind == "rpm":
+        yield from rpm_members(stream, path, depth)
+
+
+def zip_members(fileobj, path, depth):
+    """zip_members() - Read the members of a zip file.
+
+    Args:
+        fileobj (file) - The zip file, which must be able to seek.
+        path (str) - Path or name of the zip file.
+        depth (int) - Levels of archives still to read.
+
+    Returns:
+        Generator yielding (path, size, digest). Members that can't be read,
+        ex: encrypted ones, are yielded with a size and digest of None, and
+        the rest are still read.
+    """
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            name = path + SEPARATOR + member_name(info.filename)
+            try:
+                with archive.open(info) as memberfile:
+                    yield from member(memberfile, name, depth)
+            except ERRORS:
+                yield name, None, None
+
+
+def tar_members(fileobj, path, depth):
+    """tar_members() - Read the members of an uncompressed tar stream.
+
+    Args:
+        fileobj (file) - The stream.
+        path (str) - Path or name of the tar file.
+        depth (int) - Levels of archives still to read.
+
+    Returns:
+        Generator yielding (path, size, digest).
+    """
+    with tarfile.open(fileobj=fileobj, mode="r|") as archive:
+        for info in archive:
+            if not info.isreg():
+                continue
+            yield from member(archive.extractfile(info),
+                              path + SEPARATOR + member_name(info.name),
+                              depth)
+
+
+def ar_members(fileobj, path, depth):
+    """ar_members() - Read the members of an ar archive, ex: a .deb.
+
+    Args:
+        fileobj (file) - The stream, including the "!<arch>" signature.
+        path (str) - Path or name of the archive.
+        depth (int) - Levels of archives still to read.
+
+    Returns:
+        Generator yielding (path, size, digest).
+    """
+    read_exactly(fileobj, 8)
+    while True:
+        header = fileobj.read(60)
+        if not header:
+            return
+        if len(header) < 60 or header[58:60] != b"`\n":
+            raise ValueError("%s: bad ar header" % path)
+        name = header[:16].decode("utf-8", "surrogateescape").rstrip()
+        size = int(header[48:58])
+        region = Region(fileobj, size)
+        if name.startswith("#1/"):
+            # BSD ar stores long names before the data.
+            length = int(name[3:])
+            name = region.read(length).rstrip(b"\0").decode(
+                "utf-8", "surrogateescape")
+        name = name.rstrip("/")
+        # "/" and "//" are the symbol and long name tables.
+        if name:
+            yield from member(region, path + SEPARATOR + name, depth)
+        region.skip()
+        if size % 2:
+            fileobj.read(1)
+
+
+def cpio_members(fileobj, path, depth):
+    """cpio_members() - Read the members of a "newc" cpio archive, the
+                        format of rpm payloads.
+
+    Args:
+        fileobj (file) - The stream.
+        path (str) - Path or name of the archive.
+        depth (int) - Levels of archives still to read.
+
+    Returns:
+        Generator yielding (path, size, digest).
+    """
+    while True:
+        header = read_exactly(fileobj, 110)
+        if header[:6] not in (b"070701", b"070702"):
+            raise ValueError("%s: bad cpio header" % path)
+        mode = int(header[14:22], 16)
+        links = int(header[38:46], 16)
+        size = int(header[54:62], 16)
+        namesize = int(header[94:102], 16)
+        name = read_exactly(fileobj, namesize).rstrip(b"\0").decode(
+            "utf-8", "surrogateescape")
+        read_exactly(fileobj, -(110 + namesize) % 4)
+        if name == "TRAILER!!!":
+            return
+        region = Region(fileobj, size)
+        # Hard linked files only store their data once, with the last link.
+        if mode & 0o170000 == 0o100000 and (size or links < 2):
+            yield from member(region, path + SEPARATOR + member_name(name),
+                              depth)
+        region.skip()
+        read_exactly(fileobj, -size % 4)
+
+
+def rpm_members(fileobj, path, depth):
+    """rpm_members() - Read the files of an rpm package from its payload.
+
+    Args:
+        fileobj (file) - The stream.
+        path (str) - Path or name of the package.
+        depth (int) - Levels of archives still to read.
+
+    Returns:
+        Generator yielding (path, size, digest).
+
+    Raises:
+        ValueError if the payload's compression isn't supported.
+    """
+    read_exactly(fileobj, 96)
+    for pad in (True, False):
+        header = read_exactly(fileobj, 16)
+        if header[:3] != b"\x8e\xad\xe8":
+            raise ValueError("%s: bad rpm header" % path)
+        count = int.from_bytes(header[8:12], "big")
+        length = 16 * count + int.from_bytes(header[12:16], "big")
+        # The signature header is padded to a multiple of 8 bytes.
+        if pad:
+            length += -length % 8
+        Region(fileobj, length).skip()
+    head = fileobj.read(HEAD)
+    payload = Stream(fileobj, head)
+    kind = archive_format(head)
+    if kind in ("gzip", "bzip2", "xz", "zstd"):
+        payload = decompressor(kind, payload)
+    yield from cpio_members(payload, path, depth)
+
+
+def archive_members(path, depth=MAX_DEPTH):
+    """archive_members() - Hash the files inside an archive.
+
+    Args:
+        path (str) - Path to the archive.
+        depth (int) - Levels of archives to read, 1 to only read this one.
+
+    Returns:
+        Generator yielding (path, size, digest) for each regular file in the
+        archive, and in archives within it, as "<archive>!<member>" paths.
+
+    Raises:
+        One of ERRORS if the archive can't be read.
+    """
+    with open(path, "rb") as archive:
+        yield from stream_members(archive, path, depth - 1)
+
+
+class ArchiveHasher(object):
+    """ArchiveHasher class - Hashes an archive and the files inside it,
+                             reading the archive once.
+
+    The archive is read through a HashingReader while its members are
+    streamed, so its own digest comes from the same read. Zip files too big
+    to read into memory need random access, so they are read once for their
+    members and again to hash them.
+
+    Attributes:
+        path (str) - Path to the archive.
+        depth (int) - Levels of archives to read, 1 to only read this one.
+        opener (function) - Called with path to open the archive as a
+                            binary file, ex: LowImpact.open_file, or None
+                            for open().
+        size (int) - Size of the archive, set once members() is done.
+        digest (str) - Hex digest of the archive, set once members() is
+                       done.
+        error (Exception) - One of ERRORS that stopped the members being
+                            read, or None.
+    """
+    def __init__(self, path, depth=MAX_DEPTH, opener=None):
+        self.path = path
+        self.depth = depth
+        self.opener = opener
+        self.size = None
+        self.digest = None
+        self.error = None
+
+    def members(self):
+        """ArchiveHasher.members() - Hash the files inside the archive, then
+                                     the archive.
+
+        A damaged or unsupported archive stops yielding members early, and
+        is still hashed.
+
+        Args:
+            None.
+
+        Returns:
+            Generator yielding (path, size, digest) for each regular file in
+            the archive, like archive_members().
+
+        Raises:
+            OSError if the archive can't be opened or read to its end.
+        """
+        if self.opener is None:
+            archive = open(self.path, "rb")
+        else:
+            archive = self.opener(self.path)
+        with archive:
+            head = archive.read(HEAD)
+            archive.seek(0)
+            if archive_format(head) == "zip" and \
+               os.fstat(archive.fileno()).st_size > MAX_BUFFER:
+                try:
+                    yield from stream_members(archive, self.path,
+                                              self.depth - 1)
+                except ERRORS as exc:
+                    self.error = exc
+                archive.seek(0)
+                self.size, self.digest = hash_stream(archive)
+                return
+            reader = HashingReader(archive)
+            try:
+                yield from stream_members(reader, self.path, self.depth - 1)
+            except ERRORS as exc:
+                self.error = exc
+            self.size, self.digest = reader.finish()
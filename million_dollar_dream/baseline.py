@@ -0,0 +1,214 @@
+"""
+Incremental host baselines.
+
+A baseline is a counting bloom filter of the digests of every file on a
+host, plus a manifest recording which digest each path had when it was last
+hashed. When files change, only the changed paths are rehashed: each
+path's old digest is removed from the filter and its new one added, so the
+baseline never has to be rebuilt from the whole filesystem. A plain bloom
+filter can then be exported from it for distribution.
+
+The manifest is saved beside the filter as "<baseline>.manifest", in the
+same format as md5sum output.
+"""
+
+from bisect import bisect_left
+import os
+import sys
+
+from .countingfilter import CountingBloomFilter
+
+MANIFEST_SUFFIX = ".manifest"
+
+# A new baseline is sized for this many times the files it starts with, so
+# it has room to grow.
+HEADROOM = 2
+
+# Smallest number of elements a new baseline is sized for.
+MIN_CAPACITY = 1000
+
+
+def manifest_path(baseline):
+    """manifest_path() - Get the path of a baseline's manifest.
+
+    Args:
+        baseline (str) - Path to the baseline's counting filter.
+
+    Returns:
+        str containing the path of the manifest.
+    """
+    return baseline + MANIFEST_SUFFIX
+
+
+def read_manifest(path):
+    """read_manifest() - Read a manifest.
+
+    Args:
+        path (str) - Location of the manifest.
+
+    Returns:
+        dict mapping paths to hex digests.
+    """
+    manifest = dict()
+    with open(path, "r", encoding="utf-8", errors="surrogateescape") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                digest, filename = line.split("  ", 1)
+                manifest[filename] = digest
+    return manifest
+
+
+def write_manifest(path, manifest):
+    """write_manifest() - Write a manifest, sorted by path.
+
+    Args:
+        path (str) - Location to write.
+        manifest (dict) - Paths mapped to hex digests.
+
+    Returns:
+        Nothing.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8",
+              errors="surrogateescape") as f:
+        for filename in sorted(manifest):
+            f.write("%s  %s\n" % (manifest[filename], filename))
+    os.replace(temp_path, path)
+
+
+def read_paths(lists):
+    """read_paths() - Read lists of changed paths.
+
+    Args:
+        lists (list) - Files listing one path per line, or "-" for stdin.
+
+    Returns:
+        Generator yielding absolute paths.
+    """
+    for listfile in lists:
+        if listfile == "-":
+            lines = sys.stdin
+        else:
+            lines = open(listfile, "r", encoding="utf-8",
+                         errors="surrogateescape")
+        try:
+            for line in lines:
+                line = line.rstrip("\n")
+                if line:
+                    yield os.path.abspath(line)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+
+class Baseline(object):
+    """Baseline class - A counting bloom filter of a host's files and the
+                        manifest of what it contains.
+
+    Attributes:
+        path (str) - Location of the counting filter.
+        filter (CountingBloomFilter) - The filter, or None until a new
+                                       baseline has been updated.
+        manifest (dict) - Paths mapped to the digests in the filter.
+        added (int) - Digests added by the last update().
+        removed (int) - Digests removed by the last update().
+        unchanged (int) - Paths checked by the last update() that hadn't
+                          changed.
+        errors (int) - Old digests the last update() couldn't remove
+                       because they weren't in the filter.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.filter = None
+        self.manifest = dict()
+        self.added = self.removed = self.unchanged = self.errors = 0
+        if os.path.exists(path):
+            self.filter = CountingBloomFilter.load(path)
+            if os.path.exists(manifest_path(path)):
+                self.manifest = read_manifest(manifest_path(path))
+
+    def under(self, roots):
+        """Baseline.under() - Find manifest entries at or below some paths.
+
+        Args:
+            roots (list) - Absolute paths of files or directories.
+
+        Returns:
+            set of paths in the manifest.
+        """
+        ordered = sorted(self.manifest)
+        found = set()
+        for root in roots:
+            index = bisect_left(ordered, root)
+            while index < len(ordered) and ordered[index].startswith(root):
+                path = ordered[index]
+                if path == root or path[len(root)] == os.sep or \
+                   root.endswith(os.sep):
+                    found.add(path)
+                index += 1
+        return found
+
+    def update(self, roots, results, fp_rate=0.01, policy="memory",
+               hashcount=None):
+        """Baseline.update() - Apply rehashed paths to the baseline.
+
+        Paths in the manifest at or below roots that weren't rehashed are
+        treated as deleted. Files that couldn't be read keep their old
+        digest.
+
+        Args:
+            roots (list) - Absolute paths that were rehashed.
+            results (iterable) - Result for each file found under roots,
+                                 ex: from Scanner.scan().
+            fp_rate (float) - False positive rate of a new baseline.
+            policy (str) - Sizing policy of a new baseline.
+            hashcount (int) - Number of hashes of a new baseline, or None.
+
+        Returns:
+            Nothing.
+        """
+        stale = self.under(roots)
+        changes = dict()
+        for result in results:
+            stale.discard(result.path)
+            if result.digest:
+                changes[result.path] = result.digest
+        for path in stale:
+            changes[path] = None
+
+        if self.filter is None:
+            capacity = max(MIN_CAPACITY,
+                           HEADROOM * (len(self.manifest) + len(changes)))
+            self.filter = CountingBloomFilter(capacity, fp_rate, policy,
+                                              hashcount)
+
+        self.added = self.removed = self.unchanged = self.errors = 0
+        for path in sorted(changes):
+            old, new = self.manifest.get(path), changes[path]
+            if old == new:
+                self.unchanged += 1
+                continue
+            if old is not None:
+                try:
+                    self.filter.remove(old)
+                    self.removed += 1
+                except ValueError:
+                    self.errors += 1
+                del self.manifest[path]
+            if new is not None:
+                self.filter.add(new)
+                self.manifest[path] = new
+                self.added += 1
+
+    def save(self):
+        """Baseline.save() - Save the counting filter and manifest.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        self.filter.save(self.path)
+        write_manifest(manifest_path(self.path), self.manifest)
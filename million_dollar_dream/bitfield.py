@@ -1,4 +1,3 @@
-from math import ceil
 from collections import namedtuple
 
 
@@ -13,7 +12,7 @@ class BitField(object):
     """
     def __init__(self, size):
         self.size = size  # TODO bounds checking
-        self.bitfield = bytearray([0x00] * int(ceil(size / 8)))
+        self.bitfield = bytearray((size + 7) // 8)
         self.position = namedtuple("position", ["byte", "bit"])
 
     def setbit(self, position):
@@ -97,8 +96,15 @@ class BitField(object):
                 >>> bitfield.getpos(100)
                 Position(byte=12, bit=4)
         """
-        bytepos = int(ceil(position / 8)) - 1
-        bitpos = position % 8
-        if bitpos != 0:
-            bitpos = 8 - bitpos
-        return self.position(bytepos, bitpos)
+        # Same as ceil(position / 8) - 1 and (8 - position % 8) % 8, without
+        # going through floats.
+        return self.position((position - 1) >> 3, -position & 7)
+
+
+# Use the compiled BitField if it has been built. PyBitField is always the
+# pure-Python one.
+PyBitField = BitField
+try:
+    from ._bitfield import BitField  # noqa: F811
+except ImportError:
+    pass
@@ -1,3 +1,7 @@
+import json
+import mmap
+import os
+import zlib
 from math import ceil, log
 
 try:
@@ -5,7 +9,162 @@ try:
 except ImportError:
     import million_dollar_dream.pymmh3 as mmh3
 
+# Without the mmh3 C extension, batches are hashed with NumPy if it's
+# installed rather than one at a time with pymmh3.
+try:
+    import numpy
+    from . import npmmh3
+except ImportError:
+    numpy = None
+    npmmh3 = None
+
+# add/lookup loops compiled with Cython, built by setup.py when a compiler
+# is available. They set and test the same bits as the code below.
+try:
+    from . import _bloomfilter as compiled
+except ImportError:
+    compiled = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import pymmh3
 from .bitfield import BitField
+from .digeststore import DigestStore
+
+
+# Filters are saved either in the original layout (16 byte size, 16 byte
+# hashcount, raw bits) or in a container starting with this magic. The last
+# eight bytes of the magic are never zero, so it can't be mistaken for the
+# size field of an original filter.
+MAGIC = b"MDDBLOOMFILTER\x00\x01"
+
+# Size of the header of the original layout.
+HEADER_SIZE = 32
+
+# Chunk size used when streaming filters to and from disk.
+READ_SIZE = 1024 * 1024
+
+# Share of bits set above which a filter is reported as saturated. Filters
+# are sized to be about half full at capacity; at 60% the false positive
+# rate is several times what the filter was built for.
+SATURATION = 0.6
+
+# Sizing policies, mapped to the most memory each may use relative to the
+# smallest filter for the false positive rate. Filters use the fewest hashes
+# that fit, so each lookup probes fewer bits, and cache lines, at the cost of
+# a bigger filter. "memory" is the smallest filter, "lookup" gets 0.01 down
+# to 2 probes per element for twice the memory.
+POLICIES = {
+    "memory": 1.0,
+    "balanced": 1.25,
+    "lookup": 2.0,
+}
+
+
+def compressions():
+    """compressions() - List compression methods usable on this host.
+
+    Args:
+        None.
+
+    Returns:
+        list of compression names.
+    """
+    available = ["none", "zlib"]
+    if zstandard:
+        available.append("zstd")
+    return available
+
+
+def compress(data, method):
+    """compress() - Compress a filter's bits.
+
+    Args:
+        data (bytearray) - Bits to compress.
+        method (str) - Compression method. See compressions().
+
+    Returns:
+        bytes containing the compressed data.
+    """
+    if method == "zlib":
+        return zlib.compress(data, 9)
+    if method == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    if method == "none":
+        return bytes(data)
+    raise ValueError("unsupported compression: %s" % method)
+
+
+def compressor(method):
+    """compressor() - Get a streaming compressor. Produces the same format as
+                      compress().
+
+    Args:
+        method (str) - Compression method. See compressions().
+
+    Returns:
+        Object with compress(chunk) and flush() methods returning compressed
+        data.
+    """
+    if method == "zlib":
+        return zlib.compressobj(9)
+    if method == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=19).compressobj()
+    raise ValueError("unsupported compression: %s" % method)
+
+
+def decompressor(method):
+    """decompressor() - Get a streaming decompressor.
+
+    Args:
+        method (str) - Compression method. See compressions().
+
+    Returns:
+        Object with a decompress(chunk) method returning decompressed data.
+    """
+    if method == "zlib":
+        return zlib.decompressobj()
+    if method == "zstd" and zstandard:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError("unsupported compression: %s" % method)
+
+
+def popcount(data):
+    """popcount() - Count the bits set in a buffer.
+
+    Args:
+        data (bytes-like) - Buffer to count.
+
+    Returns:
+        Number of bits set (int).
+    """
+    bits = int.from_bytes(data, byteorder="little")
+    if hasattr(bits, "bit_count"):
+        return bits.bit_count()
+    if numpy is not None:
+        return int(numpy.unpackbits(
+            numpy.frombuffer(data, dtype=numpy.uint8)).sum())
+    return bin(bits).count("1")
+
+
+def element_hashes(element, hashcount):
+    """element_hashes() - Hash an element with seeds 0 to hashcount - 1.
+
+    Args:
+        element (str) - Element to hash.
+        hashcount (int) - Number of hashes.
+
+    Returns:
+        list of mmh3.hash(element, seed) for each seed.
+    """
+    element = str(element)
+    if mmh3 is pymmh3:
+        # Mixes the element's blocks once instead of once per seed.
+        return pymmh3.hash_seeds(element, range(hashcount))
+    return [mmh3.hash(element, seed) for seed in range(hashcount)]
 
 
 class BloomFilter(object):
@@ -15,11 +174,33 @@ class BloomFilter(object):
             size (int) - size of the filter in bits.
             hashcount (int) - number of hashes per element.
             filter - (BitField object) - bitfield containing the filter.
+            path (str) - File the filter is mapped from, or None if it is
+                         in memory.
+            mmap (mmap.mmap) - Mapping of path, or None.
+            digests (DigestStore) - Exact list of the filter's elements,
+                                    checked when the bits say an element is
+                                    present, or None.
+            policy (str) - Sizing policy the filter was built with, a key of
+                           POLICIES or "custom" for an explicit hashcount.
+            changes (int) - Counts adds and loads, so callers caching
+                            lookups can tell when the filter changed.
+            listeners (list) - Callables run with no arguments whenever
+                               changes is bumped, ex: by each FilterBank
+                               holding the filter.
     """
-    def __init__(self, expected_items, fp_rate):
-        self.size = self.ideal_size(expected_items, fp_rate)
-        self.hashcount = self.ideal_hashcount(expected_items)
-        self.filter = BitField(self.size)
+    def __init__(self, expected_items, fp_rate, path=None, policy="memory",
+                 hashcount=None):
+        self.size, self.hashcount, self.policy = self.geometry(
+            expected_items, fp_rate, policy, hashcount)
+        self.path = None
+        self.mmap = None
+        self.digests = None
+        self.changes = 0
+        self.listeners = []
+        if path is None:
+            self.filter = BitField(self.size)
+        else:
+            self.create_mapped(path)
 
     def add(self, element):
         """BloomFilter.add() - Add an element to the filter.
@@ -30,9 +211,29 @@ class BloomFilter(object):
         Returns:
             Nothing.
         """
-        for seed in range(self.hashcount):
-            result = mmh3.hash(str(element), seed) % self.size
-            self.filter.setbit(result)
+        # The store no longer lists everything in the filter.
+        if self.digests is not None:
+            self.close_digests()
+        self.changed()
+        if compiled is not None:
+            compiled.add(self.filter.bitfield, self.size, self.hashcount,
+                         element)
+            return
+        for result in self.hashes(element):
+            self.filter.setbit(result % self.size)
+
+    def changed(self):
+        """BloomFilter.changed() - Record that the filter's contents changed.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        self.changes += 1
+        for listener in self.listeners:
+            listener()
 
     def lookup(self, element):
         """BloomFilter.lookup() - Check if element exists in the filter.
@@ -40,44 +241,473 @@ class BloomFilter(object):
         Args:
             element (str) - Element to look up.
 
+        Returns:
+            True if the element is in the filter. Without a digest store
+            this may be a false positive.
+        """
+        if compiled is not None:
+            found = compiled.lookup(self.filter.bitfield, self.size,
+                                    self.hashcount, element)
+        else:
+            found = True
+            for seed in range(self.hashcount):
+                result = mmh3.hash(str(element), seed) % self.size
+                if self.filter.getbit(result) is False:
+                    found = False
+                    break
+        if found and self.digests is not None:
+            return str(element) in self.digests
+        return found
+
+    def add_many(self, elements):
+        """BloomFilter.add_many() - Add several elements to the filter.
+
+        Args:
+            elements (list) - Elements to add.
+
         Returns:
             Nothing.
         """
-        for seed in range(self.hashcount):
-            result = mmh3.hash(str(element), seed) % self.size
-            if self.filter.getbit(result) is False:
-                return False
-        return True
+        self.close_digests()
+        self.changed()
+        # Mapped filters can be larger than memory. Setting a batch's bits
+        # in order makes the writes sequential, touching each page once.
+        ordered = self.mmap is not None
+        if compiled is not None:
+            compiled.add_many(self.filter.bitfield, self.size, self.hashcount,
+                              elements, ordered)
+            return
+        if self.vectorized():
+            byte, mask = self.vector_positions(elements)
+            byte, mask = byte.ravel(), mask.ravel()
+            if ordered:
+                order = numpy.argsort(byte, kind="stable")
+                byte, mask = byte[order], mask[order]
+            bitfield = numpy.frombuffer(self.filter.bitfield, numpy.uint8)
+            numpy.bitwise_or.at(bitfield, byte, mask)
+            return
+
+        bitfield = self.filter.bitfield
+        size = self.size
+        hashes = self.hashes
+        positions = (position % size
+                     for element in elements for position in hashes(element))
+        if ordered:
+            positions = sorted(positions)
+        for position in positions:
+            bitfield[(position - 1) >> 3] |= 1 << (-position & 7)
+
+    def lookup_many(self, elements):
+        """BloomFilter.lookup_many() - Check if several elements exist in the
+                                       filter.
+
+        This is the batch equivalent of lookup(). Bit positions are computed
+        inline rather than through BitField.getbit(), which saves a method
+        call and a namedtuple per probe.
+
+        Args:
+            elements (iterable) - Elements to look up.
+
+        Returns:
+            list of booleans, one per element.
+        """
+        if self.digests is None:
+            return self.probe_many(elements)
+        elements = list(elements)
+        digests = self.digests
+        return [
+            found and str(element) in digests
+            for element, found in zip(elements, self.probe_many(elements))
+        ]
+
+    def probe_many(self, elements):
+        """BloomFilter.probe_many() - Check the bits of several elements,
+                                      ignoring any digest store.
+
+        Args:
+            elements (iterable) - Elements to look up.
+
+        Returns:
+            list of booleans, one per element.
+        """
+        if compiled is not None:
+            return compiled.lookup_many(self.filter.bitfield, self.size,
+                                        self.hashcount, elements)
+        if self.vectorized():
+            elements = list(elements)
+            byte, mask = self.vector_positions(elements)
+            bitfield = numpy.frombuffer(self.filter.bitfield, numpy.uint8)
+            return (bitfield[byte] & mask).all(axis=1).tolist()
+
+        bitfield = self.filter.bitfield
+        size = self.size
+        seeds = range(self.hashcount)
+        hash_func = mmh3.hash
+        results = []
+        append = results.append
+        for element in elements:
+            element = str(element)
+            for seed in seeds:
+                position = hash_func(element, seed) % size
+                # Same byte and bit as BitField.getpos()
+                if not bitfield[(position - 1) >> 3] & (1 << (-position & 7)):
+                    append(False)
+                    break
+            else:
+                append(True)
+        return results
+
+    def hashes(self, element):
+        """BloomFilter.hashes() - Hash an element with every seed.
+
+        Args:
+            element (str) - Element to hash.
+
+        Returns:
+            list of mmh3.hash(element, seed) for each seed.
+        """
+        return element_hashes(element, self.hashcount)
+
+    @staticmethod
+    def vectorized():
+        """BloomFilter.vectorized() - Check if batches should be hashed with
+                                      NumPy instead of one at a time.
+
+        Args:
+            None.
+
+        Returns:
+            True if the mmh3 C extension is missing and NumPy is installed.
+        """
+        return npmmh3 is not None and mmh3 is pymmh3
+
+    def vector_positions(self, elements):
+        """BloomFilter.vector_positions() - Compute the bytes and bit masks
+                                            probed for a batch of elements.
+
+        Args:
+            elements (list) - Elements to hash.
+
+        Returns:
+            tuple of (byte offsets, bit masks) arrays, both shaped
+            (len(elements), hashcount). Same layout as BitField.getpos().
+        """
+        positions = npmmh3.bloom_positions(
+            [str(element) for element in elements], self.hashcount,
+            self.size)
+        # (position - 1) >> 3 is -1 for position 0, which indexes the last
+        # byte, exactly like BitField.getpos().
+        byte = (positions - 1) >> 3
+        mask = (numpy.uint8(1) << ((-positions) & 7).astype(numpy.uint8))
+        return byte, mask
+
+    def chunks(self, compression=None):
+        """BloomFilter.chunks() - Read the filter's bits in chunks.
+
+        Args:
+            compression (str) - None for the raw bits, or a method from
+                                compressions() to compress them.
+
+        Returns:
+            Generator yielding chunks of bytes.
+        """
+        bits = memoryview(self.filter.bitfield)
+        stream = None
+        if compression not in (None, "none"):
+            stream = compressor(compression)
+        for start in range(0, len(bits), READ_SIZE):
+            chunk = bits[start:start + READ_SIZE]
+            yield chunk if stream is None else stream.compress(chunk)
+        if stream is not None:
+            yield stream.flush()
 
-    def save(self, path):
+    def save(self, path, compression=None):
         """BloomFilter.save() - Save the filter's current state to a file.
 
+        The bits are written in chunks, compressing as they go, so saving
+        never needs a second copy of the filter in memory.
+
         Args:
             path (str) - Location to save the file
+            compression (str) - None to save in the original uncompressed
+                                layout, a method from compressions() to save
+                                in a container, or "auto" to use whichever
+                                method produces the smallest file.
 
         Returns:
             Nothing.
 
         TODO: error checking if file cant be written.
         """
-        with open(path, "wb") as filterfile:
-            filterfile.write(self.size.to_bytes(16, byteorder="little"))
-            filterfile.write(self.hashcount.to_bytes(16, byteorder="little"))
-            filterfile.write(self.filter.bitfield)
+        if compression == "auto":
+            compression = None
+            smallest = self.bytesize
+            for method in compressions()[1:]:
+                size = sum(len(chunk) for chunk in self.chunks(method))
+                if size < smallest:
+                    compression = method
+                    smallest = size
+
+        if self.path is not None and compression is None and \
+           os.path.abspath(path) == self.path:
+            # The mapping is the file.
+            self.mmap.flush()
+            return
+
+        # Write beside the destination, which may be the file this filter
+        # is mapped from.
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as filterfile:
+            filterfile.write(self.header(compression))
+            for chunk in self.chunks(compression):
+                filterfile.write(chunk)
+        os.replace(temp_path, path)
 
-    def load(self, path):
+    def load(self, path, mapped=False):
         """BloomFilter.load() - Load a saved filter.
 
+        The bits are decompressed straight into the filter's bytearray in
+        chunks, so loading never holds more than one extra chunk in memory.
+        The filter's digest store is opened too, if it has one.
+
         Args:
             path (str) - Location of filter to load.
+            mapped (bool) - Map uncompressed filters read only instead of
+                            reading them into memory. Pages are read as
+                            lookups touch them, so the filter can be larger
+                            than memory.
+
+        Raises:
+            ValueError if the filter is truncated or its compression method
+            is unavailable.
 
         TODO: error check if this exists + is readable!
         """
+        self.close()
+        self.changed()
+        self.digests = DigestStore.open_for(path)
+        with open(path, "rb") as filterfile:
+            header = self.read_header(filterfile)
+            self.size = header["size"]
+            self.hashcount = header["hashcount"]
+            self.policy = header.get("policy", "memory")
+            if mapped and header["compression"] == "none":
+                self.map(path, filterfile.tell(), mmap.ACCESS_READ)
+                return
+            self.filter = BitField(self.size)
+            buffer = memoryview(self.filter.bitfield)
+
+            if header["compression"] == "none":
+                filled = filterfile.readinto(buffer)
+            else:
+                stream = decompressor(header["compression"])
+                filled = 0
+                for chunk in iter(lambda: filterfile.read(READ_SIZE), b""):
+                    data = stream.decompress(chunk)
+                    if filled + len(data) > len(buffer):
+                        raise ValueError("%s: too much filter data" % path)
+                    buffer[filled:filled + len(data)] = data
+                    filled += len(data)
+
+            if filled != len(buffer):
+                raise ValueError("%s: filter is truncated" % path)
+
+    def create_mapped(self, path):
+        """BloomFilter.create_mapped() - Back the filter with a sparse file
+                                         instead of memory.
+
+        The file is written in the original uncompressed layout, so it is
+        already saved once the filter is built. Only pages that bits are set
+        in take up disk space. Any existing contents of the filter are
+        discarded.
+
+        Args:
+            path (str) - File to create.
+
+        Returns:
+            Nothing.
+        """
+        self.close()
+        header = self.header()
+        with open(path, "wb") as filterfile:
+            filterfile.write(header)
+            filterfile.truncate(len(header) + self.bytesize)
+        self.map(path, len(header), mmap.ACCESS_WRITE)
+
+    def map(self, path, offset, access):
+        """BloomFilter.map() - Map a filter's bits from a file.
+
+        Args:
+            path (str) - File containing the filter.
+            offset (int) - Where the bits start in the file.
+            access (int) - mmap.ACCESS_READ or mmap.ACCESS_WRITE.
+
+        Raises:
+            ValueError if the file is truncated.
+        """
+        with open(path, "rb" if access == mmap.ACCESS_READ else "r+b") \
+                as filterfile:
+            if os.fstat(filterfile.fileno()).st_size < offset + self.bytesize:
+                raise ValueError("%s: filter is truncated" % path)
+            self.mmap = mmap.mmap(filterfile.fileno(), 0, access=access)
+        self.path = os.path.abspath(path)
+        self.filter = BitField(0)
+        self.filter.size = self.size
+        self.filter.bitfield = \
+            memoryview(self.mmap)[offset:offset + self.bytesize]
+
+    def close_digests(self):
+        """BloomFilter.close_digests() - Close the filter's digest store, if
+                                         it has one.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        if self.digests is not None:
+            self.digests.close()
+            self.digests = None
+
+    def close(self):
+        """BloomFilter.close() - Close the filter's digest store, and flush
+                                 and unmap a mapped filter.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        self.close_digests()
+        if self.mmap is None:
+            return
+        bits = self.filter.bitfield
+        self.filter = BitField(0)
+        bits.release()
+        self.mmap.flush()
+        self.mmap.close()
+        self.mmap = None
+        self.path = None
+
+    def header(self, compression=None):
+        """BloomFilter.header() - Build the header a saved filter starts
+                                  with.
+
+        The original layout is used for uncompressed filters built with the
+        default policy, so older versions can read them. Anything else gets
+        a container, which records the compression method and policy.
+
+        Args:
+            compression (str) - None for uncompressed bits, or the method
+                                from compressions() they're compressed with.
+
+        Returns:
+            bytes containing the header.
+        """
+        if compression in (None, "none") and self.policy == "memory":
+            return self.size.to_bytes(16, byteorder="little") + \
+                self.hashcount.to_bytes(16, byteorder="little")
+        header = json.dumps(dict(
+            size=self.size,
+            hashcount=self.hashcount,
+            compression=compression or "none",
+            policy=self.policy,
+        ), sort_keys=True).encode("utf-8")
+        return MAGIC + len(header).to_bytes(4, byteorder="little") + header
+
+    @staticmethod
+    def read_header(filterfile):
+        """BloomFilter.read_header() - Read a saved filter's header.
+
+        Args:
+            filterfile (file) - Filter opened in binary mode. It is left
+                                positioned at the start of the filter's bits.
+
+        Returns:
+            dict containing size, hashcount and compression.
+        """
+        start = filterfile.read(16)
+        if start != MAGIC:
+            return dict(
+                size=int.from_bytes(start, byteorder="little"),
+                hashcount=int.from_bytes(filterfile.read(16),
+                                         byteorder="little"),
+                compression="none",
+            )
+        length = int.from_bytes(filterfile.read(4), byteorder="little")
+        return json.loads(filterfile.read(length).decode("utf-8"))
+
+    def stats(self):
+        """BloomFilter.stats() - Measure how full the filter is.
+
+        Args:
+            None.
+
+        Returns:
+            dict, see estimate().
+        """
+        bits_set = sum(popcount(chunk) for chunk in self.chunks())
+        return self.estimate(self.size, self.hashcount, bits_set)
+
+    @classmethod
+    def file_stats(cls, path):
+        """BloomFilter.file_stats() - Measure how full a saved filter is
+                                      without loading it.
+
+        Args:
+            path (str) - Location of the filter.
+
+        Returns:
+            dict, see estimate().
+
+        Raises:
+            ValueError if the filter is truncated.
+        """
         with open(path, "rb") as filterfile:
-            self.size = int.from_bytes(filterfile.read(16), byteorder="little")
-            self.hashcount = \
-                int.from_bytes(filterfile.read(16), byteorder="little")
-            self.filter.bitfield = filterfile.read()
+            header = cls.read_header(filterfile)
+            stream = None
+            if header["compression"] != "none":
+                stream = decompressor(header["compression"])
+            bits_set = length = 0
+            for chunk in iter(lambda: filterfile.read(READ_SIZE), b""):
+                if stream is not None:
+                    chunk = stream.decompress(chunk)
+                bits_set += popcount(chunk)
+                length += len(chunk)
+        if length < (header["size"] + 7) // 8:
+            raise ValueError("%s: filter is truncated" % path)
+        return cls.estimate(header["size"], header["hashcount"], bits_set)
+
+    @staticmethod
+    def estimate(size, hashcount, bits_set):
+        """BloomFilter.estimate() - Estimate a filter's contents and false
+                                    positive rate from the bits it has set.
+
+        The number of elements is estimated as -(size / hashcount) *
+        ln(1 - bits_set / size) (Swamidass and Baldi), and the false
+        positive rate as the chance all hashcount probes hit set bits.
+
+        Args:
+            size (int) - Size of the filter in bits.
+            hashcount (int) - Number of hashes per element.
+            bits_set (int) - Number of bits set.
+
+        Returns:
+            dict containing size, hashcount, bits_set, fill (share of bits
+            set), items (estimated elements, None if every bit is set),
+            fp_rate (estimated false positive rate) and saturated (True if
+            fill is above SATURATION).
+        """
+        # Padding bits in the last byte are only set by BitField.one().
+        fill = min(1.0, bits_set / size) if size else 0.0
+        items = None
+        if fill < 1:
+            items = int(round(-(size / hashcount) * log(1 - fill)))
+        return dict(size=size, hashcount=hashcount, bits_set=bits_set,
+                    fill=fill, items=items, fp_rate=fill ** hashcount,
+                    saturated=fill > SATURATION)
 
     @staticmethod
     def accuracy(size, hashcount, elements):
@@ -97,7 +727,6 @@ class BloomFilter(object):
         false_positive = \
             (1 - (1 - 1 / size) ** (hashcount * int(elements))) \
             ** hashcount
-        print('FALSE: ', false_positive)
         return round(100 - false_positive * 100, 4)
 
     @staticmethod
@@ -116,9 +745,86 @@ class BloomFilter(object):
         """
         return int(-(expected * log(fp_rate)) / (log(2) ** 2))
 
+    @classmethod
+    def geometry(cls, expected, fp_rate, policy="memory", hashcount=None):
+        """BloomFilter.geometry() - Choose the size and number of hashes of
+                                    a filter.
+
+        Args:
+            expected (int) - Expected number of elements in the filter.
+            fp_rate (float) - Acceptable rate of false positives.
+            policy (str) - Sizing policy, a key of POLICIES.
+            hashcount (int) - Number of hashes, or None to let policy
+                              choose.
+
+        Returns:
+            tuple of (size, hashcount, policy). policy is "custom" if
+            hashcount was given.
+
+        Raises:
+            ValueError if policy is unknown or hashcount is below 1.
+        """
+        if policy not in POLICIES:
+            raise ValueError("unknown sizing policy: %s" % policy)
+        if hashcount is not None and hashcount < 1:
+            raise ValueError("hashcount must be at least 1")
+        if hashcount is not None:
+            policy = "custom"
+        elif policy != "memory":
+            hashcount = cls.policy_hashcount(expected, fp_rate,
+                                             POLICIES[policy])
+        if hashcount is None:
+            size = cls.ideal_size(expected, fp_rate)
+            # ideal = (size / expected items) * log(2)
+            hashcount = max(1, int(round((size / int(expected)) * log(2))))
+            return size, hashcount, policy
+        return cls.hashcount_size(expected, fp_rate, hashcount), hashcount, \
+            policy
+
+    @staticmethod
+    def hashcount_size(expected, fp_rate, hashcount):
+        """BloomFilter.hashcount_size() - Calculate the filter size needed to
+                                          reach a false positive rate with a
+                                          given number of hashes.
+
+        Solves fp_rate = (1 - e ^ (-hashcount * expected / size)) ^ hashcount
+        for size.
+
+        Args:
+            expected (int) - Expected number of elements in the filter.
+            fp_rate (float) - Acceptable rate of false positives.
+            hashcount (int) - Number of hashes per element.
+
+        Returns:
+            Size in bits.
+        """
+        return max(1, int(ceil(-hashcount * int(expected) /
+                               log(1 - fp_rate ** (1 / hashcount)))))
+
+    @classmethod
+    def policy_hashcount(cls, expected, fp_rate, ratio):
+        """BloomFilter.policy_hashcount() - Find the fewest hashes that reach
+                                            a false positive rate within a
+                                            memory budget.
+
+        Args:
+            expected (int) - Expected number of elements in the filter.
+            fp_rate (float) - Acceptable rate of false positives.
+            ratio (float) - Most memory to use, relative to ideal_size().
+
+        Returns:
+            Number of hashes.
+        """
+        budget = ratio * cls.ideal_size(expected, fp_rate)
+        optimal = max(1, int(round(-log(fp_rate) / log(2))))
+        for hashcount in range(1, optimal):
+            if cls.hashcount_size(expected, fp_rate, hashcount) <= budget:
+                return hashcount
+        return optimal
+
     def ideal_hashcount(self, expected):
         # ideal = (size / expected items) * log(2)
-        return int((self.size / int(expected)) * log(2))
+        return max(1, int(round((self.size / int(expected)) * log(2))))
 
     @property
     def bytesize(self):
@@ -0,0 +1,229 @@
+"""
+Counting bloom filters.
+
+A counting bloom filter keeps a small counter per position instead of a
+bit, so elements can be removed as well as added. Counters are 4 bits,
+packed two to a byte, so the filter takes 4 times the memory of a plain
+bloom filter of the same geometry. Elements hash to the same positions as
+in BloomFilter, so to_bloomfilter() can export a plain filter for
+distribution that gives exactly the same answers.
+"""
+
+from collections import Counter
+import json
+import os
+
+from .bitfield import BitField
+from .bloomfilter import BloomFilter, element_hashes, numpy
+
+MAGIC = b"MDDCOUNTFILTER\x00\x01"
+
+# Counters stop at this value. Once a counter reaches it, its real count is
+# unknown, so it is never decremented again.
+COUNTER_MAX = 15
+
+
+class CountingBloomFilter(object):
+    """CountingBloomFilter class - A bloom filter that supports removal.
+
+    Attributes:
+        size (int) - Number of counters.
+        hashcount (int) - Number of hashes per element.
+        policy (str) - Sizing policy, see BloomFilter.
+        capacity (int) - Number of elements the filter was sized for.
+        count (int) - Number of elements added and not removed.
+        counters (bytearray) - 4 bit counters, the even position of each
+                               pair in the low nibble.
+    """
+    def __init__(self, expected_items, fp_rate, policy="memory",
+                 hashcount=None):
+        self.size, self.hashcount, self.policy = BloomFilter.geometry(
+            expected_items, fp_rate, policy, hashcount)
+        self.capacity = int(expected_items)
+        self.count = 0
+        self.counters = bytearray((self.size + 1) // 2)
+
+    def positions(self, element):
+        """CountingBloomFilter.positions() - Find an element's counters.
+
+        Args:
+            element (str) - Element to hash.
+
+        Returns:
+            list of hashcount positions, the same bits BloomFilter sets.
+        """
+        return [result % self.size
+                for result in element_hashes(element, self.hashcount)]
+
+    def counter(self, position):
+        """CountingBloomFilter.counter() - Read a counter.
+
+        Args:
+            position (int) - Position of the counter.
+
+        Returns:
+            Value of the counter (int).
+        """
+        return (self.counters[position >> 1] >> ((position & 1) * 4)) & 0xf
+
+    def add(self, element):
+        """CountingBloomFilter.add() - Add an element to the filter.
+
+        Args:
+            element (str) - Element to add.
+
+        Returns:
+            Nothing.
+        """
+        for position in self.positions(element):
+            if self.counter(position) < COUNTER_MAX:
+                self.counters[position >> 1] += 1 << ((position & 1) * 4)
+        self.count += 1
+
+    def remove(self, element):
+        """CountingBloomFilter.remove() - Remove an element from the filter.
+
+        Args:
+            element (str) - Element to remove. It must have been added.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            ValueError if the element isn't in the filter, in which case the
+            filter is left unchanged.
+        """
+        positions = Counter(self.positions(element))
+        for position, times in positions.items():
+            if self.counter(position) < times:
+                raise ValueError("%s is not in the filter" % element)
+        for position, times in positions.items():
+            if self.counter(position) < COUNTER_MAX:
+                self.counters[position >> 1] -= \
+                    times << ((position & 1) * 4)
+        self.count -= 1
+
+    def lookup(self, element):
+        """CountingBloomFilter.lookup() - Check if element exists in the
+                                          filter.
+
+        Args:
+            element (str) - Element to look up.
+
+        Returns:
+            True if the element may be in the filter.
+        """
+        return all(self.counter(position)
+                   for position in self.positions(element))
+
+    def bits(self):
+        """CountingBloomFilter.bits() - Build the bits of the equivalent
+                                        plain bloom filter.
+
+        Args:
+            None.
+
+        Returns:
+            bytearray laid out like BitField, with each bit set whose
+            counter isn't zero.
+        """
+        bytesize = (self.size + 7) // 8
+        if numpy is not None:
+            counters = numpy.frombuffer(self.counters, dtype=numpy.uint8)
+            nonzero = numpy.empty(len(counters) * 2, dtype=bool)
+            nonzero[0::2] = counters & 0xf
+            nonzero[1::2] = counters >> 4
+            positions = numpy.flatnonzero(nonzero[:self.size]).astype(
+                numpy.int64)
+            # Position 0 is in the last byte, like BitField.getpos().
+            byte = (positions - 1) >> 3
+            byte[byte < 0] += bytesize
+            mask = numpy.uint8(1) << ((-positions) & 7).astype(numpy.uint8)
+            bits = numpy.zeros(bytesize, dtype=numpy.uint8)
+            numpy.bitwise_or.at(bits, byte, mask)
+            return bytearray(bits.tobytes())
+
+        bits = bytearray(bytesize)
+        for index, pair in enumerate(self.counters):
+            if not pair:
+                continue
+            for position in (index * 2, index * 2 + 1):
+                if position < self.size and self.counter(position):
+                    byte = (position - 1) >> 3 if position else bytesize - 1
+                    bits[byte] |= 1 << (-position & 7)
+        return bits
+
+    def to_bloomfilter(self):
+        """CountingBloomFilter.to_bloomfilter() - Export a plain filter.
+
+        Args:
+            None.
+
+        Returns:
+            BloomFilter answering lookups exactly like this filter.
+        """
+        bloomfilter = BloomFilter(1, 0.01)
+        bloomfilter.size = self.size
+        bloomfilter.hashcount = self.hashcount
+        bloomfilter.policy = self.policy
+        bloomfilter.filter = BitField(0)
+        bloomfilter.filter.size = self.size
+        bloomfilter.filter.bitfield = self.bits()
+        return bloomfilter
+
+    def save(self, path):
+        """CountingBloomFilter.save() - Save the filter to a file.
+
+        Args:
+            path (str) - Location to save the file.
+
+        Returns:
+            Nothing.
+        """
+        header = json.dumps(dict(
+            size=self.size,
+            hashcount=self.hashcount,
+            policy=self.policy,
+            capacity=self.capacity,
+            count=self.count,
+            counter_bits=4,
+        ), sort_keys=True).encode("utf-8")
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as filterfile:
+            filterfile.write(MAGIC)
+            filterfile.write(len(header).to_bytes(4, byteorder="little"))
+            filterfile.write(header)
+            filterfile.write(self.counters)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """CountingBloomFilter.load() - Load a saved counting filter.
+
+        Args:
+            path (str) - Location of the filter.
+
+        Returns:
+            CountingBloomFilter.
+
+        Raises:
+            ValueError if the file isn't a counting filter or is truncated.
+        """
+        with open(path, "rb") as filterfile:
+            if filterfile.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s: not a counting filter" % path)
+            length = int.from_bytes(filterfile.read(4), byteorder="little")
+            header = json.loads(filterfile.read(length).decode("utf-8"))
+            if header.get("counter_bits") != 4:
+                raise ValueError("%s: unsupported counter size" % path)
+            countingfilter = cls.__new__(cls)
+            countingfilter.size = header["size"]
+            countingfilter.hashcount = header["hashcount"]
+            countingfilter.policy = header["policy"]
+            countingfilter.capacity = header["capacity"]
+            countingfilter.count = header["count"]
+            countingfilter.counters = bytearray((header["size"] + 1) // 2)
+            if filterfile.readinto(countingfilter.counters) != \
+               len(countingfilter.counters):
+                raise ValueError("%s: filter is truncated" % path)
+        return countingfilter
@@ -0,0 +1,152 @@
+"""
+XOR deltas between two versions of a filter file.
+
+A republished filter usually differs from the previous version by a handful
+of bits, so shipping the XOR of the two files is far cheaper than shipping
+the new file. Only the runs of changed bytes are stored and the result is
+zlib compressed.
+
+Delta layout:
+    magic (8 bytes) - b"MDDDELTA"
+    length (8 bytes, little endian) - size of the file being patched
+    body (zlib) - repeated records of:
+        gap (varint) - unchanged bytes since the end of the previous run
+        count (varint) - length of this run
+        run (count bytes) - XOR of old and new bytes
+"""
+
+import re
+import zlib
+
+
+MAGIC = b"MDDDELTA"
+
+# Runs of changed bytes separated by up to three unchanged bytes are merged.
+# Storing the zeros is cheaper than paying for another gap/count pair.
+CHANGED_RUN = re.compile(rb"[^\x00]+(?:\x00{1,3}[^\x00]+)*")
+
+
+def encode_varint(value):
+    """encode_varint() - Encode a non-negative integer as a LEB128 varint.
+
+    Args:
+        value (int) - Integer to encode.
+
+    Returns:
+        bytes containing the encoded integer.
+    """
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def decode_varint(data, offset):
+    """decode_varint() - Decode a LEB128 varint.
+
+    Args:
+        data (bytes) - Buffer containing the varint.
+        offset (int) - Position of the varint within data.
+
+    Returns:
+        tuple of (value, offset of the next byte).
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def xor_bytes(first, second):
+    """xor_bytes() - XOR two equal length byte strings.
+
+    Args:
+        first (bytes) - First operand.
+        second (bytes) - Second operand.
+
+    Returns:
+        bytes containing first ^ second.
+    """
+    length = len(first)
+    value = int.from_bytes(first, byteorder="little") ^ \
+        int.from_bytes(second, byteorder="little")
+    return value.to_bytes(length, byteorder="little")
+
+
+def make_delta(old, new):
+    """make_delta() - Create a delta that turns old into new.
+
+    Args:
+        old (bytes) - Contents of the previous filter file.
+        new (bytes) - Contents of the new filter file.
+
+    Returns:
+        bytes containing the compressed delta.
+
+    Raises:
+        ValueError if the files differ in length. Resized filters have to be
+        downloaded in full.
+    """
+    if len(old) != len(new):
+        raise ValueError("cannot delta files of different lengths")
+
+    changes = xor_bytes(old, new)
+    body = bytearray()
+    last = 0
+    for run in CHANGED_RUN.finditer(changes):
+        body += encode_varint(run.start() - last)
+        body += encode_varint(run.end() - run.start())
+        body += run.group()
+        last = run.end()
+
+    return MAGIC + len(new).to_bytes(8, byteorder="little") + \
+        zlib.compress(bytes(body), 9)
+
+
+def apply_delta(buffer, delta):
+    """apply_delta() - Apply a delta in place.
+
+    Args:
+        buffer (bytearray or mmap) - Writable contents of the old file.
+        delta (bytes) - Delta created by make_delta().
+
+    Returns:
+        Nothing.
+
+    Raises:
+        ValueError if the delta is malformed or made for a different length.
+    """
+    if delta[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a filter delta")
+    length = int.from_bytes(delta[8:16], byteorder="little")
+    if length != len(buffer):
+        raise ValueError("delta is for a %d byte file, not %d bytes" %
+                         (length, len(buffer)))
+    try:
+        body = zlib.decompress(delta[16:])
+    except zlib.error as exc:
+        raise ValueError("corrupt delta: %s" % exc)
+
+    offset = 0
+    position = 0
+    try:
+        while offset < len(body):
+            gap, offset = decode_varint(body, offset)
+            count, offset = decode_varint(body, offset)
+            run = body[offset:offset + count]
+            offset += count
+            position += gap
+            if len(run) != count or position + count > length:
+                raise ValueError("corrupt delta: run out of bounds")
+            buffer[position:position + count] = \
+                xor_bytes(buffer[position:position + count], run)
+            position += count
+    except IndexError:
+        raise ValueError("corrupt delta: truncated record")
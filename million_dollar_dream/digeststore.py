@@ -0,0 +1,327 @@
+"""
+Exact digest stores.
+
+A bloom filter wrongly reports about 1 in 100 unknown digests as present.
+A digest store is the exact list of digests in a filter, saved beside it as
+"<filter>.digests": a header followed by fixed width binary digests in
+sorted order. It's mapped into memory and searched with interpolation
+search, which takes a handful of probes on uniformly distributed digests.
+Filters only consult their store when the bloom filter says yes, so exact
+answers cost one or two page reads per positive.
+"""
+
+import heapq
+import mmap
+import os
+import tempfile
+
+MAGIC = b"MDDDIGESTS\x00\x01"
+
+# Magic followed by the width of each digest, 4 bytes little endian.
+HEADER_SIZE = 16
+
+# Stores are named after their filter plus this suffix.
+SUFFIX = ".digests"
+
+# Number of digests sorted in memory at a time while building a store.
+RUN_SIZE = 4 * 1024 * 1024
+
+# Probes guessed by interpolation before falling back to bisection, which
+# bounds lookups on badly distributed data.
+INTERPOLATION_STEPS = 16
+
+
+def store_path(filterfile):
+    """store_path() - Get the path of a filter's digest store.
+
+    Args:
+        filterfile (str) - Path to the filter.
+
+    Returns:
+        str containing the path of the store.
+    """
+    return filterfile + SUFFIX
+
+
+def remove_store(filterfile):
+    """remove_store() - Remove a filter's digest store, if it has one.
+
+    A store only matches the filter it was built with. Left beside a filter
+    whose bits have changed, it would hide the new digests from lookups.
+
+    Args:
+        filterfile (str) - Path to the filter.
+
+    Returns:
+        True if a store was removed.
+    """
+    try:
+        os.remove(store_path(filterfile))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def read_run(path, width):
+    """read_run() - Stream digests from a sorted run written by
+                    DigestStoreWriter.
+
+    Args:
+        path (str) - Run file.
+        width (int) - Width of each digest in bytes.
+
+    Returns:
+        Generator yielding digests as bytes.
+    """
+    with open(path, "rb") as runfile:
+        for chunk in iter(lambda: runfile.read(width * 65536), b""):
+            for offset in range(0, len(chunk), width):
+                yield chunk[offset:offset + width]
+
+
+class DigestStoreWriter(object):
+    """DigestStoreWriter class - Builds a digest store.
+
+    Digests may be added in any order and more than once. They are sorted in
+    runs of run_size, spilled to temporary files beside the store, and
+    merged by close(), so stores larger than memory can be built.
+
+    Attributes:
+        path (str) - File to write.
+        width (int) - Width of each digest in bytes.
+        run_size (int) - Number of digests sorted in memory at a time.
+        buffer (list) - Digests waiting to be sorted.
+        runs (list) - Paths of sorted runs spilled to disk.
+        count (int) - Number of unique digests written by close().
+    """
+    def __init__(self, path, width=16, run_size=RUN_SIZE):
+        self.path = path
+        self.width = width
+        self.run_size = run_size
+        self.buffer = []
+        self.runs = []
+        self.count = 0
+
+    def add(self, digest):
+        """DigestStoreWriter.add() - Add a digest to the store.
+
+        Args:
+            digest (str) - Hex digest.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            ValueError if digest isn't hex of the store's width.
+        """
+        binary = bytes.fromhex(digest)
+        if len(binary) != self.width:
+            raise ValueError("%s is not a %d byte digest"
+                             % (digest, self.width))
+        self.buffer.append(binary)
+        if len(self.buffer) >= self.run_size:
+            self.spill()
+
+    def add_many(self, digests):
+        """DigestStoreWriter.add_many() - Add several digests to the store.
+
+        Args:
+            digests (iterable) - Hex digests.
+
+        Returns:
+            Nothing.
+        """
+        for digest in digests:
+            self.add(digest)
+
+    def spill(self):
+        """DigestStoreWriter.spill() - Sort the buffered digests and write
+                                       them to a temporary run.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        self.buffer.sort()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, path = tempfile.mkstemp(prefix=".run-", dir=directory)
+        self.runs.append(path)
+        with os.fdopen(handle, "wb") as runfile:
+            runfile.write(b"".join(self.buffer))
+        self.buffer = []
+
+    def close(self):
+        """DigestStoreWriter.close() - Merge everything added and write the
+                                       store.
+
+        Args:
+            None.
+
+        Returns:
+            Number of unique digests in the store.
+        """
+        if self.runs:
+            self.spill()
+            digests = heapq.merge(*[read_run(path, self.width)
+                                    for path in self.runs])
+        else:
+            self.buffer.sort()
+            digests = iter(self.buffer)
+
+        temp_path = self.path + ".tmp"
+        self.count = 0
+        try:
+            with open(temp_path, "wb") as storefile:
+                storefile.write(MAGIC)
+                storefile.write(self.width.to_bytes(4, byteorder="little"))
+                previous = None
+                chunk = []
+                for digest in digests:
+                    if digest == previous:
+                        continue
+                    previous = digest
+                    chunk.append(digest)
+                    if len(chunk) >= 65536:
+                        storefile.write(b"".join(chunk))
+                        self.count += len(chunk)
+                        chunk = []
+                storefile.write(b"".join(chunk))
+                self.count += len(chunk)
+            os.replace(temp_path, self.path)
+        finally:
+            for path in self.runs:
+                os.remove(path)
+            self.runs = []
+            self.buffer = []
+        return self.count
+
+
+class DigestStore(object):
+    """DigestStore class - Exact membership tests against a saved digest
+                           store.
+
+    Attributes:
+        path (str) - File the store was opened from.
+        width (int) - Width of each digest in bytes.
+        count (int) - Number of digests in the store.
+        mmap (mmap.mmap) - Read only mapping of the store, or None if it is
+                           empty.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.mmap = None
+        with open(path, "rb") as storefile:
+            header = storefile.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE or header[:12] != MAGIC:
+                raise ValueError("%s: not a digest store" % path)
+            self.width = int.from_bytes(header[12:], byteorder="little")
+            length = os.fstat(storefile.fileno()).st_size - HEADER_SIZE
+            if not self.width or length % self.width:
+                raise ValueError("%s: digest store is truncated" % path)
+            self.count = length // self.width
+            if self.count:
+                self.mmap = mmap.mmap(storefile.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+
+    @classmethod
+    def open_for(cls, filterfile):
+        """DigestStore.open_for() - Open a filter's digest store if it has
+                                    one.
+
+        Args:
+            filterfile (str) - Path to the filter.
+
+        Returns:
+            DigestStore, or None if the filter has no store.
+        """
+        path = store_path(filterfile)
+        if not os.path.isfile(path):
+            return None
+        return cls(path)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # Lower case hex sorts like the binary digests, so this is in order.
+        for index in range(self.count):
+            yield self.digest(index).hex()
+
+    def __contains__(self, digest):
+        try:
+            key = bytes.fromhex(digest)
+        except (TypeError, ValueError):
+            return False
+        return len(key) == self.width and self.find(key) >= 0
+
+    def digest(self, index):
+        """DigestStore.digest() - Get a digest by position.
+
+        Args:
+            index (int) - Position in the store.
+
+        Returns:
+            bytes containing the digest.
+        """
+        offset = HEADER_SIZE + index * self.width
+        return self.mmap[offset:offset + self.width]
+
+    def find(self, key):
+        """DigestStore.find() - Search for a binary digest.
+
+        Interpolates on the first 8 bytes of digests, which are uniformly
+        distributed for cryptographic hashes, then falls back to bisection
+        if that hasn't found it after INTERPOLATION_STEPS probes.
+
+        Args:
+            key (bytes) - Digest to find.
+
+        Returns:
+            Position of the digest, or -1 if it isn't in the store.
+        """
+        low, high = 0, self.count - 1
+        if high < 0:
+            return -1
+        target = int.from_bytes(key[:8], byteorder="big")
+        low_value = int.from_bytes(self.digest(low)[:8], byteorder="big")
+        high_value = int.from_bytes(self.digest(high)[:8], byteorder="big")
+        steps = 0
+        while low <= high:
+            if target < low_value or target > high_value:
+                return -1
+            if steps < INTERPOLATION_STEPS and high_value > low_value:
+                middle = low + (target - low_value) * (high - low) // \
+                    (high_value - low_value)
+            else:
+                middle = (low + high) // 2
+            steps += 1
+
+            candidate = self.digest(middle)
+            if candidate == key:
+                return middle
+            if candidate < key:
+                low = middle + 1
+                if low <= high:
+                    low_value = int.from_bytes(self.digest(low)[:8],
+                                               byteorder="big")
+            else:
+                high = middle - 1
+                if low <= high:
+                    high_value = int.from_bytes(self.digest(high)[:8],
+                                                byteorder="big")
+        return -1
+
+    def close(self):
+        """DigestStore.close() - Unmap the store.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
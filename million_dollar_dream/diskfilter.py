@@ -0,0 +1,245 @@
+import mmap
+import os
+from collections import OrderedDict
+
+from . import bloomfilter as bloomfilter_module
+from .bloomfilter import BloomFilter, element_hashes
+from .digeststore import DigestStore
+
+PAGE_SIZE = mmap.PAGESIZE
+
+# Pages cached by default, ex: 256KB with 4KB pages.
+CACHE_PAGES = 64
+
+# Most pages read by one pread() when probes fall on consecutive pages.
+MAX_RUN = 32
+
+
+class DiskBloomFilter(object):
+    """DiskBloomFilter class - Looks elements up in a saved filter without
+                               loading it into memory.
+
+    Only the pages holding the bits being probed are read, with os.pread().
+    Lookups are done in rounds, one seed at a time: each round's probes are
+    sorted by offset so reads are sequential, consecutive pages are read
+    together, and elements drop out as soon as a probe misses. Recently
+    used pages are kept in a small LRU, so memory use doesn't depend on the
+    size of the filter. Only uncompressed filters can be read this way.
+
+    Attributes:
+        path (str) - Location of the filter.
+        size (int) - size of the filter in bits.
+        hashcount (int) - number of hashes per element.
+        offset (int) - Where the filter's bits start in the file.
+        digests (DigestStore) - The filter's digest store, or None.
+        cache (OrderedDict) - Page numbers mapped to their contents, least
+                              recently used first.
+        cache_pages (int) - Most pages kept in cache.
+        reads (int) - Number of pread() calls made.
+        pages_read (int) - Number of pages read from disk.
+        cache_hits (int) - Number of pages found in cache.
+    """
+    def __init__(self, path, cache_pages=CACHE_PAGES):
+        with open(path, "rb") as filterfile:
+            header = BloomFilter.read_header(filterfile)
+            self.offset = filterfile.tell()
+        if header["compression"] != "none":
+            raise ValueError("%s: compressed filters must be loaded into "
+                             "memory" % path)
+        self.path = path
+        self.size = header["size"]
+        self.hashcount = header["hashcount"]
+        self.bytesize = (self.size + 7) // 8
+        self.cache = OrderedDict()
+        self.cache_pages = cache_pages
+        self.reads = 0
+        self.pages_read = 0
+        self.cache_hits = 0
+
+        self.fd = os.open(path, os.O_RDONLY)
+        if os.fstat(self.fd).st_size < self.offset + self.bytesize:
+            os.close(self.fd)
+            raise ValueError("%s: filter is truncated" % path)
+        # Probes are scattered, so readahead would only waste memory.
+        self.advise("POSIX_FADV_RANDOM")
+        self.digests = DigestStore.open_for(path)
+
+    def advise(self, advice, offset=0, length=0):
+        """DiskBloomFilter.advise() - Give the kernel a hint about how the
+                                      filter will be read. Does nothing where
+                                      posix_fadvise() isn't available.
+
+        Args:
+            advice (str) - Name of the os.POSIX_FADV_* constant.
+            offset (int) - Start of the range the hint applies to.
+            length (int) - Length of the range. 0 means to the end.
+
+        Returns:
+            Nothing.
+        """
+        if not hasattr(os, "posix_fadvise") or not hasattr(os, advice):
+            return
+        try:
+            os.posix_fadvise(self.fd, offset, length, getattr(os, advice))
+        except OSError:
+            pass
+
+    def positions(self, elements):
+        """DiskBloomFilter.positions() - Compute the bits probed for several
+                                         elements.
+
+        Args:
+            elements (list) - Elements to hash.
+
+        Returns:
+            list containing a list of hashcount bit positions per element.
+        """
+        if BloomFilter.vectorized():
+            return bloomfilter_module.npmmh3.bloom_positions(
+                [str(element) for element in elements], self.hashcount,
+                self.size).tolist()
+        return [[result % self.size
+                 for result in element_hashes(element, self.hashcount)]
+                for element in elements]
+
+    def locate(self, position):
+        """DiskBloomFilter.locate() - Find a bit in the file.
+
+        Args:
+            position (int) - Bit position.
+
+        Returns:
+            tuple of (file offset of the byte holding the bit, bit mask).
+            Same layout as BitField.getpos().
+        """
+        byte = (position - 1) >> 3 if position else self.bytesize - 1
+        return self.offset + byte, 1 << (-position & 7)
+
+    def remember(self, number, data):
+        """DiskBloomFilter.remember() - Cache a page, evicting the least
+                                        recently used if the cache is full.
+
+        Args:
+            number (int) - Page number.
+            data (bytes) - Contents of the page.
+
+        Returns:
+            Nothing.
+        """
+        self.cache[number] = data
+        if len(self.cache) > self.cache_pages:
+            self.cache.popitem(last=False)
+
+    def pages(self, numbers):
+        """DiskBloomFilter.pages() - Fetch pages from cache or disk.
+
+        Runs of consecutive pages that aren't cached are each read with one
+        pread(). The kernel is told about every run before the first is
+        read, so it can fetch them in parallel.
+
+        Args:
+            numbers (list) - Sorted, unique page numbers.
+
+        Returns:
+            Generator yielding (page number, contents) in order.
+        """
+        hits = dict()
+        runs = []
+        for number in numbers:
+            data = self.cache.get(number)
+            if data is not None:
+                hits[number] = data
+            elif runs and number == sum(runs[-1]) and runs[-1][1] < MAX_RUN:
+                runs[-1][1] += 1
+            else:
+                runs.append([number, 1])
+        for start, count in runs:
+            self.advise("POSIX_FADV_WILLNEED", start * PAGE_SIZE,
+                        count * PAGE_SIZE)
+
+        runs = iter(runs)
+        start, count, buffer = 0, 0, b""
+        for number in numbers:
+            if number in hits:
+                self.cache_hits += 1
+                if number in self.cache:
+                    self.cache.move_to_end(number)
+                yield number, hits[number]
+                continue
+            if not start <= number < start + count:
+                start, count = next(runs)
+                buffer = os.pread(self.fd, count * PAGE_SIZE,
+                                  start * PAGE_SIZE)
+                self.reads += 1
+                self.pages_read += count
+            index = (number - start) * PAGE_SIZE
+            data = buffer[index:index + PAGE_SIZE]
+            self.remember(number, data)
+            yield number, data
+
+    def lookup_many(self, elements):
+        """DiskBloomFilter.lookup_many() - Check if several elements exist
+                                           in the filter.
+
+        Args:
+            elements (iterable) - Elements to look up.
+
+        Returns:
+            list of booleans, one per element.
+        """
+        elements = list(elements)
+        positions = self.positions(elements)
+        found = [True] * len(elements)
+        candidates = range(len(elements))
+        for seed in range(self.hashcount):
+            if not candidates:
+                break
+            probes = sorted(
+                self.locate(positions[index][seed]) + (index,)
+                for index in candidates
+            )
+            numbers = sorted(set(offset // PAGE_SIZE
+                                 for offset, _, _ in probes))
+            pages = self.pages(numbers)
+            number, data = None, b""
+            survivors = []
+            for offset, mask, index in probes:
+                while number != offset // PAGE_SIZE:
+                    number, data = next(pages)
+                if data[offset % PAGE_SIZE] & mask:
+                    survivors.append(index)
+                else:
+                    found[index] = False
+            candidates = survivors
+
+        if self.digests is not None:
+            for index in candidates:
+                found[index] = str(elements[index]) in self.digests
+        return found
+
+    def lookup(self, element):
+        """DiskBloomFilter.lookup() - Check if element exists in the filter.
+
+        Args:
+            element (str) - Element to look up.
+
+        Returns:
+            True if the element is in the filter.
+        """
+        return self.lookup_many([element])[0]
+
+    def close(self):
+        """DiskBloomFilter.close() - Close the filter and drop cached pages.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.cache.clear()
+        if self.digests is not None:
+            self.digests.close()
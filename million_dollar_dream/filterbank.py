@@ -0,0 +1,529 @@
+"""
+Filter banks.
+
+A bank of many filters (ex: one per NSRL OS release) can have a union
+filter, saved in its directory as UNION, that holds every element of every
+filter. Lookups check the union first and only check each filter for
+elements the union says are present, so elements in none of the filters
+cost one filter's probes instead of one per filter. The union's members are
+recorded in UNION + ".json" so a union that no longer matches the directory
+is ignored.
+
+LookupMemo remembers the result of recent lookups, so content that appears
+many times in a scan (ex: the same shared library in every container) is
+looked up once.
+"""
+
+from collections import OrderedDict
+from itertools import islice
+import heapq
+import json
+import os
+import sys
+import threading
+
+from .bloomfilter import BloomFilter, numpy
+from .digeststore import SUFFIX, DigestStore
+from .diskfilter import DiskBloomFilter
+
+UNION = ".union"
+
+# Digests added to a rebuilt union at a time.
+BATCH_SIZE = 65536
+
+# Lookups LookupMemo remembers by default.
+MEMO_ENTRIES = 65536
+
+# Estimated bytes a LookupMemo entry costs besides its digest string: the
+# dict slot, the linked list node keeping LRU order and the result tuple.
+ENTRY_OVERHEAD = 160
+
+
+def is_union(filename):
+    """is_union() - Check if a file in a filter directory belongs to its
+                    union filter rather than being a filter.
+
+    Args:
+        filename (str) - Name of the file.
+
+    Returns:
+        True if the file is the union, its member list or a temporary file
+        written while saving it.
+    """
+    return filename == UNION or filename.startswith(UNION + ".")
+
+
+def filter_paths(path):
+    """filter_paths() - Find the filters in a directory.
+
+    Args:
+        path (str) - Directory to search.
+
+    Returns:
+        list of (name, path) tuples in name order. Names are paths relative
+        to the directory.
+    """
+    paths = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(SUFFIX) or is_union(filename):
+                # Digest stores are loaded with their filters.
+                continue
+            fullpath = os.path.join(root, filename)
+            paths.append((os.path.relpath(fullpath, path), fullpath))
+    return paths
+
+
+def members(paths):
+    """members() - Describe filters well enough to tell when they change.
+
+    Args:
+        paths (list) - (name, path) tuples, as from filter_paths().
+
+    Returns:
+        dict mapping names to the size and modification time of each filter.
+    """
+    result = dict()
+    for name, path in paths:
+        stat = os.stat(path)
+        result[name] = dict(bytes=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    return result
+
+
+def build_union(path, fp_rate=None, policy="memory", hashcount=None):
+    """build_union() - Build the union filter of a directory of filters.
+
+    If every filter has a digest store, the union is rebuilt from them at
+    fp_rate, sized by policy and hashcount. Otherwise filters of identical
+    size and hash count are ORed together, which is faster but gives a union
+    with more false positives than any of its members. Filters that can't be
+    combined either way are refused.
+
+    Args:
+        path (str) - Directory of filters.
+        fp_rate (float) - False positive rate of a rebuilt union. Defaults
+                          to 0.01.
+        policy (str) - Sizing policy of a rebuilt union. See BloomFilter.
+        hashcount (int) - Number of hashes of a rebuilt union, or None to
+                          let policy choose.
+
+    Returns:
+        tuple of (BloomFilter, method), where method is "rebuild" or "or".
+
+    Raises:
+        ValueError if the directory has no filters or they can't be
+        combined.
+    """
+    paths = filter_paths(path)
+    if not paths:
+        raise ValueError("%s: no filters to combine" % path)
+    stores = [DigestStore.open_for(fullpath) for _, fullpath in paths]
+    try:
+        if all(store is not None for store in stores):
+            union = rebuild_union(stores, fp_rate or 0.01, policy,
+                                  hashcount)
+            method = "rebuild"
+        else:
+            union = or_union([fullpath for _, fullpath in paths])
+            method = "or"
+    finally:
+        for store in stores:
+            if store is not None:
+                store.close()
+
+    temp_path = os.path.join(path, UNION + ".json.tmp")
+    union.save(os.path.join(path, UNION))
+    with open(temp_path, "w") as memberfile:
+        memberfile.write(json.dumps(
+            dict(method=method, size=union.size, hashcount=union.hashcount,
+                 members=members(paths)),
+            sort_keys=True, indent=4))
+    os.replace(temp_path, os.path.join(path, UNION + ".json"))
+    return union, method
+
+
+def rebuild_union(stores, fp_rate, policy="memory", hashcount=None):
+    """rebuild_union() - Build a filter from the contents of digest stores.
+
+    Stores are sorted, so they're merged to count digests shared between
+    filters once.
+
+    Args:
+        stores (list) - DigestStore objects.
+        fp_rate (float) - False positive rate of the new filter.
+        policy (str) - Sizing policy of the new filter.
+        hashcount (int) - Number of hashes, or None to let policy choose.
+
+    Returns:
+        BloomFilter containing every digest.
+    """
+    def unique():
+        previous = None
+        for digest in heapq.merge(*stores):
+            if digest != previous:
+                previous = digest
+                yield digest
+
+    count = sum(1 for _ in unique())
+    union = BloomFilter(max(count, 1), fp_rate, policy=policy,
+                        hashcount=hashcount)
+    digests = unique()
+    while True:
+        batch = list(islice(digests, BATCH_SIZE))
+        if not batch:
+            break
+        union.add_many(batch)
+    return union
+
+
+def or_bytes(target, chunk):
+    """or_bytes() - OR a chunk of bits into a buffer in place.
+
+    Args:
+        target (memoryview) - Writable bytes, ex: a slice of a filter's
+                              bitfield.
+        chunk (bytes) - Bits to OR in, as long as target.
+
+    Returns:
+        Nothing.
+    """
+    if numpy is not None:
+        bits = numpy.frombuffer(target, numpy.uint8)
+        numpy.bitwise_or(bits, numpy.frombuffer(chunk, numpy.uint8), out=bits)
+        return
+    target[:] = (int.from_bytes(target, "little") |
+                 int.from_bytes(chunk, "little")).to_bytes(len(target),
+                                                            "little")
+
+
+def or_union(paths):
+    """or_union() - OR together filters of identical geometry.
+
+    Args:
+        paths (list) - Paths of the filters.
+
+    Returns:
+        BloomFilter with every bit set in any of the filters.
+
+    Raises:
+        ValueError if the filters differ in size or hash count.
+    """
+    union = BloomFilter(1, 0.01)
+    union.load(paths[0])
+    union.close_digests()
+    bits = memoryview(union.filter.bitfield)
+    for path in paths[1:]:
+        with open(path, "rb") as filterfile:
+            header = BloomFilter.read_header(filterfile)
+        if (header["size"], header["hashcount"]) != \
+           (union.size, union.hashcount):
+            raise ValueError("%s: filters differ in size and have no digest "
+                             "stores to rebuild from" % path)
+        # Uncompressed filters are mapped and ORed in a chunk at a time,
+        # so the union is the only filter held in memory.
+        bloomfilter = BloomFilter(1, 0.01)
+        bloomfilter.load(path, mapped=True)
+        start = 0
+        for chunk in bloomfilter.chunks():
+            or_bytes(bits[start:start + len(chunk)], chunk)
+            start += len(chunk)
+        chunk = None
+        bloomfilter.close()
+    bits.release()
+    return union
+
+
+class FilterBank(object):
+    """FilterBank class - A named collection of bloom filters that are checked
+                          together, such as one filter per OS release.
+
+    Attributes:
+        filters (dict) - Filter names mapped to BloomFilter or
+                         DiskBloomFilter objects.
+        union (BloomFilter) - Filter containing the elements of all the
+                              filters, checked before them, or None.
+        changes (int) - Bumped whenever a filter is added to the bank, or a
+                        filter in it is added to or loaded, so cached
+                        lookups can tell when the bank changed.
+    """
+    def __init__(self, filters=None, union=None):
+        self.filters = dict()
+        self.union = union
+        self.changes = 0
+        for name, bloomfilter in dict(filters or {}).items():
+            self.watch(name, bloomfilter)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def changed(self):
+        """FilterBank.changed() - Record that the bank's contents changed.
+                                   Filters in the bank call this when they
+                                   change.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        self.changes += 1
+
+    def watch(self, name, bloomfilter):
+        """FilterBank.watch() - Store a filter under a name, and have it
+                                 report its changes to the bank.
+
+        Args:
+            name (str) - Name of the filter.
+            bloomfilter (BloomFilter) - Filter to store. DiskBloomFilters
+                                        are read only, so never change.
+
+        Returns:
+            Nothing.
+        """
+        replaced = self.filters.get(name)
+        if self.changed in getattr(replaced, "listeners", ()):
+            replaced.listeners.remove(self.changed)
+        if hasattr(bloomfilter, "listeners"):
+            bloomfilter.listeners.append(self.changed)
+        self.filters[name] = bloomfilter
+
+    def add(self, name, bloomfilter):
+        """FilterBank.add() - Add a filter to the bank.
+
+        Args:
+            name (str) - Name reported when an element is in this filter.
+            bloomfilter (BloomFilter) - Filter to add.
+
+        Returns:
+            Nothing.
+        """
+        self.watch(name, bloomfilter)
+        self.changed()
+        # The union doesn't know about the new filter.
+        self.union = None
+
+    def load(self, path, mapped=False, on_disk=False):
+        """FilterBank.load() - Load saved filters into the bank.
+
+        Args:
+            path (str) - A filter, or a directory of filters. Filters in a
+                         directory are named by their path relative to it,
+                         and its union is used if it's up to date.
+            mapped (bool) - Map uncompressed filters instead of reading them.
+                            See BloomFilter.load().
+            on_disk (bool) - Leave filters on disk and read only the pages
+                             lookups need. See DiskBloomFilter.
+
+        Returns:
+            Nothing.
+        """
+        if os.path.isfile(path):
+            self.add(os.path.basename(path),
+                     self.open_filter(path, mapped, on_disk))
+            return
+
+        paths = filter_paths(path)
+        for name, fullpath in paths:
+            self.add(name, self.open_filter(fullpath, mapped, on_disk))
+        self.load_union(path, paths, mapped, on_disk)
+
+    def load_union(self, path, paths, mapped=False, on_disk=False):
+        """FilterBank.load_union() - Load a directory's union filter if its
+                                     members match the directory.
+
+        Args:
+            path (str) - Directory of filters.
+            paths (list) - (name, path) tuples of the filters in the
+                           directory, as from filter_paths().
+            mapped (bool) - See load().
+            on_disk (bool) - See load().
+
+        Returns:
+            True if the union was loaded.
+        """
+        try:
+            with open(os.path.join(path, UNION + ".json")) as memberfile:
+                recorded = json.load(memberfile)["members"]
+        except (OSError, ValueError, KeyError):
+            return False
+        if len(self.filters) < 2 or recorded != members(paths):
+            return False
+        self.union = self.open_filter(os.path.join(path, UNION), mapped,
+                                      on_disk)
+        return True
+
+    @staticmethod
+    def open_filter(path, mapped=False, on_disk=False):
+        """FilterBank.open_filter() - Open a saved filter.
+
+        Args:
+            path (str) - Location of the filter.
+            mapped (bool) - See load().
+            on_disk (bool) - See load().
+
+        Returns:
+            BloomFilter, or DiskBloomFilter if on_disk is True.
+        """
+        if on_disk:
+            return DiskBloomFilter(path)
+        bloomfilter = BloomFilter(1, 0.01)
+        bloomfilter.load(path, mapped)
+        return bloomfilter
+
+    def lookup(self, element):
+        """FilterBank.lookup() - Find the filters containing an element.
+
+        Args:
+            element (str) - Element to look up.
+
+        Returns:
+            list of names of filters containing the element.
+        """
+        if self.union is not None and not self.union.lookup(element):
+            return []
+        return [
+            name for name, bloomfilter in self.filters.items()
+            if bloomfilter.lookup(element)
+        ]
+
+    def lookup_many(self, elements):
+        """FilterBank.lookup_many() - Find the filters containing each of
+                                      several elements.
+
+        Args:
+            elements (list) - Elements to look up.
+
+        Returns:
+            list containing a list of filter names for each element.
+        """
+        matches = [[] for _ in elements]
+        candidates = list(range(len(elements)))
+        if self.union is not None:
+            found = self.union.lookup_many(elements)
+            candidates = [index for index in candidates if found[index]]
+            elements = [elements[index] for index in candidates]
+        if not candidates:
+            return matches
+        for name, bloomfilter in self.filters.items():
+            found = bloomfilter.lookup_many(elements)
+            for index, candidate in enumerate(candidates):
+                if found[index]:
+                    matches[candidate].append(name)
+        return matches
+
+
+def entry_size(digest, names):
+    """entry_size() - Estimate the memory a LookupMemo entry uses.
+
+    Args:
+        digest (str) - Digest looked up.
+        names (tuple) - Names of the filters containing it. The names
+                        themselves are shared with the bank.
+
+    Returns:
+        Estimated size in bytes (int).
+    """
+    return ENTRY_OVERHEAD + sys.getsizeof(digest) + 8 * len(names)
+
+
+class LookupMemo(object):
+    """LookupMemo class - Remembers recent FilterBank lookups, evicting the
+                          least recently used once full.
+
+    Shared by a scan's workers. Remembered results are dropped when the
+    bank's changes counter moves, so they never outlive the filters they
+    came from.
+
+    Attributes:
+        max_entries (int) - Most lookups remembered, or None for no limit.
+        max_bytes (int) - Most estimated memory used, or None for no limit.
+        entries (OrderedDict) - Digests mapped to tuples of filter names,
+                                least recently used first.
+        bytes (int) - Estimated memory used by entries.
+        version (int) - FilterBank.changes the entries came from.
+        hits (int) - Lookups answered from memory.
+        misses (int) - Lookups passed on to the bank.
+    """
+    def __init__(self, max_entries=MEMO_ENTRIES, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """LookupMemo.clear() - Forget every remembered lookup.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def lookup(self, bank, digest):
+        """LookupMemo.lookup() - Find the filters containing a digest,
+                                 remembering the answer.
+
+        Args:
+            bank (FilterBank) - Bank to look the digest up in.
+            digest (str) - Digest to look up.
+
+        Returns:
+            tuple of (list of names of filters containing the digest, True
+            if it was remembered).
+        """
+        version = bank.changes
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.bytes = 0
+                self.version = version
+            names = self.entries.get(digest)
+            if names is not None:
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return list(names), True
+            self.misses += 1
+
+        # Other workers carry on while this one probes the filters.
+        found = bank.lookup(digest)
+        self.put(digest, tuple(found), version)
+        return found, False
+
+    def put(self, digest, names, version):
+        """LookupMemo.put() - Remember a lookup, evicting the least recently
+                              used ones over the limits.
+
+        Args:
+            digest (str) - Digest looked up.
+            names (tuple) - Names of the filters containing it.
+            version (int) - FilterBank.changes when it was looked up.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            # The filters changed while the digest was looked up.
+            if version != self.version or digest in self.entries:
+                return
+            self.entries[digest] = names
+            self.bytes += entry_size(digest, names)
+            while self.entries and (
+                    (self.max_entries is not None and
+                     len(self.entries) > self.max_entries) or
+                    (self.max_bytes is not None and
+                     self.bytes > self.max_bytes)):
+                evicted, evicted_names = self.entries.popitem(last=False)
+                self.bytes -= entry_size(evicted, evicted_names)
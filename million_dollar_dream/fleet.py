@@ -0,0 +1,687 @@
+"""
+Collecting unknown files from many hosts.
+
+Agents run lookups as usual and stream the files that were in no filter to
+a collector over TCP, in zlib compressed batches of binary records: the raw
+16 byte digest followed by the path. Agents can skip digests they've
+already sent. The collector remembers every digest reported with a bloom
+filter of its own, appends the first report of each to an NDJSON file and
+acknowledges each batch, so an unknown file shared by a thousand hosts is
+recorded once.
+
+Every message is a frame: a type byte and a payload length, then the
+payload. An agent sends HELLO with its hostname, any number of BATCHes,
+each answered with an ACK, and END.
+
+An agent that loses its collector sets aside the batch it was sending and
+reconnects when it next has one, backing off between attempts. Batches
+queued before it's time to try again are set aside too, so a scan never
+waits on a collector that's down. Batches set aside are appended to the
+agent's spool file, if it has one, and sent once it reconnects, even on a
+later run. Without a spool file they are dropped and counted.
+
+The collector's filter is saved beside its NDJSON file along with how much
+of the file it covers. On startup, anything written after that is added
+back to the filter, so nothing is reported twice after a crash.
+"""
+
+from datetime import datetime, timezone
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import zlib
+
+from .bloomfilter import BloomFilter
+
+# Frame header: message type, payload length.
+FRAME = struct.Struct("!BI")
+
+# Message types.
+HELLO = 1
+BATCH = 2
+ACK = 3
+END = 4
+
+# Start of a HELLO payload, followed by the agent's hostname.
+MAGIC = b"MDD1"
+
+# A record in a batch: MD5 digest, length of the path that follows.
+RECORD = struct.Struct("!16sH")
+
+# ACK payload: records in the batch, how many were new to the collector.
+ACKNOWLEDGE = struct.Struct("!II")
+
+# Records an agent sends at a time.
+BATCH_SIZE = 4096
+
+# Largest payload accepted, compressed or not.
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+# Seconds an agent waits for the collector.
+TIMEOUT = 60.0
+
+# Seconds an agent waits before reconnecting after a failure, doubled
+# after each failure in a row up to the maximum.
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 300.0
+
+# Files kept in the collector's directory: unknown files reported, and the
+# filter of digests seen with the state it was saved in.
+UNKNOWN = "unknown.ndjson"
+SEEN = "seen.bloom"
+
+# Digests the collector's filter is sized for, and its false positive
+# rate. A false positive drops the first report of an unknown file.
+SEEN_ITEMS = 10000000
+SEEN_FP_RATE = 0.0001
+
+# Seconds between saves of the collector's filter.
+SAVE_INTERVAL = 300.0
+
+
+def parse_address(text, default_host="localhost"):
+    """parse_address() - Parse a TCP address.
+
+    Args:
+        text (str) - "host:port", "[v6 address]:port" or just "port".
+        default_host (str) - Host used when text is just a port.
+
+    Returns:
+        tuple of (host, port).
+
+    Raises:
+        ValueError if the port isn't a number from 0 to 65535.
+    """
+    host, _, port = str(text).rpartition(":")
+    port = int(port)
+    if not 0 <= port <= 65535:
+        raise ValueError("port out of range: %d" % port)
+    return host.strip("[]") or default_host, port
+
+
+def write_frame(sock, kind, payload=b""):
+    """write_frame() - Send a message.
+
+    Args:
+        sock (socket.socket) - Connected socket.
+        kind (int) - Message type, ex: BATCH.
+        payload (bytes) - Message contents.
+
+    Returns:
+        Nothing.
+    """
+    sock.sendall(FRAME.pack(kind, len(payload)) + payload)
+
+
+def read_frame(stream):
+    """read_frame() - Receive a message.
+
+    Args:
+        stream (file) - Binary file made from a socket with makefile().
+
+    Returns:
+        tuple of (message type, payload).
+
+    Raises:
+        ConnectionError if the connection closed part way through.
+        ValueError if the payload is too large.
+    """
+    header = stream.read(FRAME.size)
+    if len(header) < FRAME.size:
+        raise ConnectionError("connection closed")
+    kind, length = FRAME.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise ValueError("message too large: %d bytes" % length)
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise ConnectionError("connection closed")
+    return kind, payload
+
+
+def encode_record(digest, path):
+    """encode_record() - Pack an unknown file for a batch.
+
+    Args:
+        digest (str) - Hex MD5 digest.
+        path (str) - Path to the file, or None.
+
+    Returns:
+        bytes.
+
+    Raises:
+        ValueError if digest isn't an MD5 digest.
+    """
+    raw = bytes.fromhex(digest)
+    if len(raw) != 16:
+        raise ValueError("not an MD5 digest: %s" % digest)
+    path = os.fsencode(path or "")[:0xFFFF]
+    return RECORD.pack(raw, len(path)) + path
+
+
+def split_records(data):
+    """split_records() - Split concatenated records, ex: from an agent's
+                         spool file.
+
+    Args:
+        data (bytes) - Records from encode_record(), one after another.
+
+    Returns:
+        list of bytes, one per record. A truncated record at the end, ex:
+        left by a crash while spooling, is left out.
+    """
+    records = []
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        end = offset + RECORD.size + RECORD.unpack_from(data, offset)[1]
+        if end > len(data):
+            break
+        records.append(data[offset:end])
+        offset = end
+    return records
+
+
+def decode_batch(payload):
+    """decode_batch() - Unpack the records in a batch.
+
+    Args:
+        payload (bytes) - Payload of a BATCH message.
+
+    Returns:
+        list of (hex digest, path) tuples.
+
+    Raises:
+        ValueError if the batch is damaged.
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(payload, MAX_PAYLOAD)
+    except zlib.error as exc:
+        raise ValueError("damaged batch: %s" % exc)
+    if decompressor.unconsumed_tail:
+        raise ValueError("batch too large")
+    records = []
+    offset = 0
+    while offset < len(data):
+        if offset + RECORD.size > len(data):
+            raise ValueError("truncated record")
+        digest, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        path = data[offset:offset + length]
+        if len(path) < length:
+            raise ValueError("truncated record")
+        offset += length
+        records.append((digest.hex(), os.fsdecode(path)))
+    return records
+
+
+class Agent(object):
+    """Agent class - Streams results that were in no filter to a collector.
+
+    Used like a ResultWriter: write() each result, flush() to send what's
+    waiting, close() when done.
+
+    Attributes:
+        address (tuple) - (host, port) of the collector.
+        hostname (str) - Name the agent reports itself as.
+        batch_size (int) - Records sent at a time.
+        unique (bool) - Send each digest once, however many files have it.
+        records (list) - Encoded records waiting to be sent.
+        sent (int) - Records sent.
+        new (int) - Records the collector hadn't seen before.
+        dropped (int) - Records lost because the collector couldn't be
+                        reached and they couldn't be spooled.
+        spool (str) - File records the collector didn't receive are kept
+                      in until they can be sent, or None to drop them.
+        spooled (int) - Records in the spool file.
+        digests (set) - Digests sent, when unique is set.
+        delay (float) - Seconds the next failure will back off for.
+        retry_at (float) - time.monotonic() after which a lost connection
+                           is retried.
+    """
+    def __init__(self, address, hostname=None, batch_size=BATCH_SIZE,
+                 unique=False, timeout=TIMEOUT, spool=None):
+        self.address = address
+        self.hostname = hostname or socket.gethostname()
+        self.batch_size = batch_size
+        self.unique = unique
+        self.timeout = timeout
+        self.records = []
+        self.sent = 0
+        self.new = 0
+        self.dropped = 0
+        self.spool = spool
+        self.spooled = 0
+        self.digests = set()
+        self.delay = RETRY_DELAY
+        self.retry_at = 0.0
+        self.sock = None
+        self.stream = None
+
+    def connect(self):
+        """Agent.connect() - Connect to the collector, introduce the agent
+                             and send any spooled records.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            OSError if the collector can't be reached.
+            ValueError if the collector's reply isn't an ACK.
+        """
+        self.sock = socket.create_connection(self.address, self.timeout)
+        self.stream = self.sock.makefile("rb")
+        write_frame(self.sock, HELLO, MAGIC + self.hostname.encode())
+        self.resend()
+
+    def send(self, records):
+        """Agent.send() - Send a batch and wait for the collector to
+                          acknowledge it.
+
+        Args:
+            records (list) - Encoded records.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            OSError if the connection fails.
+            ValueError if the collector's reply isn't an ACK.
+        """
+        write_frame(self.sock, BATCH, zlib.compress(b"".join(records), 1))
+        kind, payload = read_frame(self.stream)
+        if kind != ACK or len(payload) != ACKNOWLEDGE.size:
+            raise ValueError("unexpected reply from collector")
+        count, new = ACKNOWLEDGE.unpack(payload)
+        self.sent += count
+        self.new += new
+
+    def resend(self):
+        """Agent.resend() - Send the records in the spool file, and remove
+                            it once they've all been acknowledged.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            OSError or ValueError if sending fails. See send(). The records
+            not yet acknowledged are left in the spool file.
+        """
+        if self.spool is None or not os.path.isfile(self.spool):
+            return
+        with open(self.spool, "rb") as spoolfile:
+            records = split_records(spoolfile.read())
+        for start in range(0, len(records), self.batch_size):
+            try:
+                self.send(records[start:start + self.batch_size])
+            except (OSError, ValueError):
+                with open(self.spool, "wb") as spoolfile:
+                    spoolfile.write(b"".join(records[start:]))
+                self.spooled = len(records) - start
+                raise
+        os.remove(self.spool)
+        self.spooled = 0
+
+    def set_aside(self):
+        """Agent.set_aside() - Move the waiting records to the spool file,
+                               or drop them if there isn't one.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        records, self.records = self.records, []
+        if not records:
+            return
+        if self.spool is not None:
+            try:
+                with open(self.spool, "ab") as spoolfile:
+                    spoolfile.write(b"".join(records))
+                self.spooled += len(records)
+                return
+            except OSError:
+                pass
+        self.dropped += len(records)
+
+    def disconnect(self):
+        """Agent.disconnect() - Close the connection without sending
+                                anything.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def fail(self):
+        """Agent.fail() - Set aside the waiting records and drop the
+                          connection after an error, and back off before
+                          retrying.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        self.set_aside()
+        self.disconnect()
+        self.retry_at = time.monotonic() + self.delay
+        self.delay = min(self.delay * 2, MAX_RETRY_DELAY)
+
+    def write(self, result):
+        """Agent.write() - Queue a result for the collector if it was in
+                           no filter.
+
+        Args:
+            result (Result) - Result of a lookup.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            OSError or ValueError if a full batch couldn't be sent. See
+            flush().
+        """
+        if not result.digest or result.filters is None or result.filters:
+            return
+        if self.unique:
+            digest = bytes.fromhex(result.digest)
+            if digest in self.digests:
+                return
+            self.digests.add(digest)
+        self.records.append(encode_record(result.digest, result.path))
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Agent.flush() - Send waiting records and wait for the collector
+                           to acknowledge them, reconnecting first if the
+                           connection was lost.
+
+        The records are set aside if sending fails, or if the connection
+        was lost and it's too soon to retry, so the caller can carry on.
+        See set_aside().
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            OSError if the connection fails.
+            ValueError if the collector's reply isn't an ACK.
+        """
+        if not self.records:
+            return
+        if self.sock is None and time.monotonic() < self.retry_at:
+            self.set_aside()
+            return
+        try:
+            if self.sock is None:
+                self.connect()
+            self.send(self.records)
+        except (OSError, ValueError):
+            self.fail()
+            raise
+        self.delay = RETRY_DELAY
+        self.records = []
+
+    def close(self):
+        """Agent.close() - Send waiting records and disconnect.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            OSError or ValueError if the records couldn't be sent. See
+            flush().
+        """
+        try:
+            self.flush()
+            if self.sock is not None:
+                write_frame(self.sock, END)
+        finally:
+            self.disconnect()
+
+
+class Collector(object):
+    """Collector class - Records the unknown files agents report, each
+                         digest once.
+
+    Safe to share between the threads handling each agent.
+
+    Attributes:
+        directory (str) - Where UNKNOWN and SEEN are kept.
+        capacity (int) - Digests a new filter is sized for.
+        fp_rate (float) - False positive rate of a new filter.
+        seen (BloomFilter) - Digests already recorded.
+        unknown (file) - The unknown file list, open for appending.
+        reports (dict) - Hostnames mapped to records received from them.
+        new (int) - Records written to UNKNOWN.
+        log (file) - Where to report agents disconnecting, or None.
+    """
+    def __init__(self, directory, capacity=SEEN_ITEMS, fp_rate=SEEN_FP_RATE,
+                 log=None):
+        self.directory = directory
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.log = log
+        self.seen = None
+        self.unknown = None
+        self.reports = dict()
+        self.new = 0
+        self.saved = time.monotonic()
+        self.lock = threading.Lock()
+
+    def open(self):
+        """Collector.open() - Load the saved filter, or start one, and open
+                              the unknown file list.
+
+        Digests written after the filter was last saved are added back to
+        it.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            OSError if the directory can't be written to.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        seen_path = os.path.join(self.directory, SEEN)
+        offset = 0
+        try:
+            with open(seen_path + ".json") as statefile:
+                offset = json.load(statefile)["offset"]
+            self.seen = BloomFilter(1, 0.01)
+            self.seen.load(seen_path)
+        except (OSError, ValueError, KeyError):
+            offset = 0
+            self.seen = BloomFilter(self.capacity, self.fp_rate)
+        self.unknown = open(os.path.join(self.directory, UNKNOWN), "a+b")
+        self.unknown.seek(offset)
+        for line in self.unknown:
+            try:
+                self.seen.add(json.loads(line)["digest"])
+            except (ValueError, KeyError):
+                # Cut short by a crash.
+                continue
+        self.unknown.seek(0, os.SEEK_END)
+        if self.unknown.tell():
+            self.unknown.seek(-1, os.SEEK_END)
+            if self.unknown.read(1) != b"\n":
+                # Keep the next record off the end of a cut short one.
+                self.unknown.write(b"\n")
+
+    def receive(self, hostname, records):
+        """Collector.receive() - Record the digests in a batch not seen
+                                 before.
+
+        Args:
+            hostname (str) - Agent the batch came from.
+            records (list) - (hex digest, path) tuples.
+
+        Returns:
+            Number of records that were new (int).
+        """
+        stamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self.lock:
+            lines = []
+            for digest, path in records:
+                if self.seen.lookup(digest):
+                    continue
+                self.seen.add(digest)
+                lines.append(json.dumps(dict(digest=digest, path=path,
+                                             host=hostname, time=stamp)))
+            if lines:
+                self.unknown.write(("\n".join(lines) + "\n").encode())
+                self.unknown.flush()
+            self.reports[hostname] = \
+                self.reports.get(hostname, 0) + len(records)
+            self.new += len(lines)
+            due = time.monotonic() - self.saved > SAVE_INTERVAL
+        if due:
+            self.save()
+        return len(lines)
+
+    def save(self):
+        """Collector.save() - Save the filter and how much of the unknown
+                              file list it covers.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        seen_path = os.path.join(self.directory, SEEN)
+        with self.lock:
+            self.seen.save(seen_path)
+            with open(seen_path + ".json.tmp", "w") as statefile:
+                statefile.write(json.dumps(dict(offset=self.unknown.tell())))
+            os.replace(seen_path + ".json.tmp", seen_path + ".json")
+            self.saved = time.monotonic()
+
+    def close(self):
+        """Collector.close() - Save the filter and close the unknown file
+                               list.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        if self.unknown is None:
+            return
+        self.save()
+        self.unknown.close()
+        self.unknown = None
+
+
+class AgentHandler(socketserver.BaseRequestHandler):
+    """AgentHandler class - Receives one agent's batches for the server's
+                            Collector.
+    """
+    def setup(self):
+        with self.server.lock:
+            self.server.agents.add(self.request)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.agents.discard(self.request)
+
+    def handle(self):
+        collector = self.server.collector
+        stream = self.request.makefile("rb")
+        hostname = "%s:%d" % self.client_address[:2]
+        received = new = 0
+        try:
+            kind, payload = read_frame(stream)
+            if kind != HELLO or not payload.startswith(MAGIC):
+                raise ValueError("not an agent")
+            hostname = payload[len(MAGIC):].decode(errors="replace")
+            while True:
+                kind, payload = read_frame(stream)
+                if kind == END:
+                    break
+                if kind != BATCH:
+                    raise ValueError("unexpected message %d" % kind)
+                records = decode_batch(payload)
+                added = collector.receive(hostname, records)
+                received += len(records)
+                new += added
+                write_frame(self.request, ACK,
+                            ACKNOWLEDGE.pack(len(records), added))
+        except (OSError, ValueError) as exc:
+            if collector.log is not None:
+                print("[-] %s: %s" % (hostname, exc), file=collector.log)
+        finally:
+            stream.close()
+        if collector.log is not None:
+            print("[+] %s: %d unknown files, %d new"
+                  % (hostname, received, new), file=collector.log)
+            collector.log.flush()
+
+
+class CollectorServer(socketserver.ThreadingTCPServer):
+    """CollectorServer class - Accepts agents, handling each in its own
+                               thread.
+
+    Attributes:
+        collector (Collector) - Where reported files are recorded.
+        agents (set) - Sockets of the agents connected.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, collector):
+        self.collector = collector
+        self.agents = set()
+        self.lock = threading.Lock()
+        super().__init__(address, AgentHandler)
+
+    def server_close(self):
+        """CollectorServer.server_close() - Stop listening and hang up on
+                                            the agents connected, so none
+                                            are left reporting to a closed
+                                            Collector.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        super().server_close()
+        with self.lock:
+            for sock in self.agents:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
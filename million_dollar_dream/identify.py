@@ -0,0 +1,258 @@
+"""
+Identifying which filter a tree of files best matches.
+
+Files are sampled in a stratified random order, so any prefix of the sample
+covers directories and file sizes in proportion to the whole tree. Each
+filter's hit rate is estimated with a Wilson score interval as samples come
+in, and sampling stops once the best filter's interval no longer overlaps
+the runner-up's.
+"""
+
+from collections import defaultdict
+from math import sqrt
+import os
+import random
+
+from .scanner import Scanner
+
+# z score of the confidence intervals, 95%.
+Z = 1.96
+
+# Samples taken before the ranking may be considered settled.
+MIN_SAMPLES = 100
+
+# Default limit on the number of files sampled.
+MAX_SAMPLES = 5000
+
+# Samples between checks for separation.
+CHECK_EVERY = 25
+
+# Directory levels below a root that define a stratum.
+DEPTH = 2
+
+
+def wilson_interval(hits, samples, z=Z):
+    """wilson_interval() - Confidence interval of a proportion.
+
+    Args:
+        hits (int) - Number of successes.
+        samples (int) - Number of trials.
+        z (float) - z score of the confidence level.
+
+    Returns:
+        tuple of (low, high) bounds between 0 and 1.
+    """
+    if not samples:
+        return 0.0, 1.0
+    rate = hits / samples
+    denominator = 1 + z * z / samples
+    centre = (rate + z * z / (2 * samples)) / denominator
+    margin = z * sqrt(rate * (1 - rate) / samples +
+                      z * z / (4 * samples * samples)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def size_class(size):
+    """size_class() - Group file sizes by powers of 16.
+
+    Args:
+        size (int) - Size of a file in bytes.
+
+    Returns:
+        int, 0 for files under 16 bytes, 1 under 256 bytes and so on.
+    """
+    return size.bit_length() // 4
+
+
+class SampledScanner(Scanner):
+    """SampledScanner class - Scanner that visits files in a stratified
+                              random order.
+
+    Files are grouped into strata by their directory, up to DEPTH levels
+    below their root, and size class. Each stratum keeps a random sample of
+    at most limit files as the tree is walked, and the samples are
+    interleaved in proportion to the strata's sizes.
+
+    Attributes:
+        random (random.Random) - Source of randomness.
+        limit (int) - Most files yielded by walk().
+        total (int) - Number of files found, set once walk() has started.
+    """
+    def __init__(self, roots, filters=None, jobs=1, cache=None,
+                 exclude=None, stats=None, seed=None, rules=None,
+                 memo=None, limit=MAX_SAMPLES):
+        super().__init__(roots, filters, jobs, cache, exclude, stats,
+                         rules=rules, memo=memo)
+        self.random = random.Random(seed)
+        self.limit = limit
+        self.total = 0
+
+    def stratum(self, path, size):
+        """SampledScanner.stratum() - Find the stratum a file belongs to.
+
+        Args:
+            path (str) - Path to the file.
+            size (int) - Size of the file in bytes.
+
+        Returns:
+            tuple of (directory, size class).
+        """
+        directory = os.path.dirname(path)
+        for root in self.roots:
+            if directory == root or \
+               directory.startswith(os.path.join(root, "")):
+                parts = os.path.relpath(directory, root).split(os.sep)
+                directory = os.path.join(root, *parts[:DEPTH])
+                break
+        return directory, size_class(size)
+
+    def walk(self):
+        """SampledScanner.walk() - Sample regular files under the roots, in
+                                   stratified random order.
+
+        The whole tree is walked and stat()ed before the first path is
+        yielded, but only a reservoir of up to limit paths per stratum is
+        held in memory, not every path in the tree.
+
+        Args:
+            None.
+
+        Returns:
+            Generator yielding up to limit paths of files.
+        """
+        counts = defaultdict(int)
+        strata = defaultdict(list)
+        for path in super().walk():
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            key = self.stratum(path, size)
+            counts[key] += 1
+            reservoir = strata[key]
+            if len(reservoir) < self.limit:
+                reservoir.append(path)
+            else:
+                index = self.random.randrange(counts[key])
+                if index < self.limit:
+                    reservoir[index] = path
+
+        # Each stratum's sample is spread over the order as if the whole
+        # stratum were, so any prefix up to limit stays in proportion.
+        order = []
+        for key in sorted(strata):
+            paths = strata[key]
+            self.random.shuffle(paths)
+            offset = self.random.random()
+            order.extend(((index + offset) / counts[key], path)
+                         for index, path in enumerate(paths))
+        order.sort()
+        self.total = sum(counts.values())
+        for _, path in order[:self.limit]:
+            yield path
+
+
+class Identifier(object):
+    """Identifier class - Ranks filters by the share of sampled files they
+                          contain.
+
+    Attributes:
+        hits (dict) - Filter names mapped to the number of samples in them.
+        samples (int) - Number of files sampled.
+        z (float) - z score of the confidence intervals.
+        min_samples (int) - Samples taken before stopping early.
+    """
+    def __init__(self, names, z=Z, min_samples=MIN_SAMPLES):
+        self.hits = dict.fromkeys(names, 0)
+        self.samples = 0
+        self.z = z
+        self.min_samples = min_samples
+
+    def add(self, filters):
+        """Identifier.add() - Count a sampled file.
+
+        Args:
+            filters (list) - Names of the filters containing the file.
+
+        Returns:
+            Nothing.
+        """
+        self.samples += 1
+        for name in filters or []:
+            self.hits[name] += 1
+
+    def ranking(self):
+        """Identifier.ranking() - Rank the filters by hit rate.
+
+        Args:
+            None.
+
+        Returns:
+            list of (name, hits, low, high) tuples, best first, where low
+            and high bound the filter's hit rate.
+        """
+        ranked = sorted(self.hits.items(), key=lambda item: (-item[1],
+                                                             item[0]))
+        return [(name, hits) + wilson_interval(hits, self.samples, self.z)
+                for name, hits in ranked]
+
+    def separated(self):
+        """Identifier.separated() - Check if the best filter is known.
+
+        Args:
+            None.
+
+        Returns:
+            True once enough files have been sampled and the best filter's
+            interval is entirely above the runner-up's.
+        """
+        if self.samples < self.min_samples:
+            return False
+        ranking = self.ranking()
+        if len(ranking) < 2:
+            return True
+        return ranking[0][2] > ranking[1][3]
+
+    def consume(self, results, max_samples=MAX_SAMPLES):
+        """Identifier.consume() - Count results until the best filter is
+                                  known or max_samples have been taken.
+
+        Files that couldn't be read aren't counted. The results generator
+        is closed when sampling stops, which stops the scan.
+
+        Args:
+            results (generator) - Results from Scanner.scan().
+            max_samples (int) - Most files to sample.
+
+        Returns:
+            True if sampling stopped because the best filter was known.
+        """
+        try:
+            for result in results:
+                if result.digest is None:
+                    continue
+                self.add(result.filters)
+                if self.samples % CHECK_EVERY == 0 and self.separated():
+                    return True
+                if self.samples >= max_samples:
+                    break
+        finally:
+            results.close()
+        return self.separated()
+
+    def format_text(self, limit=None):
+        """Identifier.format_text() - Format the ranking as a table.
+
+        Args:
+            limit (int) - Most filters to list, or None for all.
+
+        Returns:
+            str containing the table.
+        """
+        lines = ["%-40s %8s %17s %9s"
+                 % ("Filter", "Hit rate", "Interval", "Hits")]
+        for name, hits, low, high in self.ranking()[:limit]:
+            lines.append("%-40s %7.1f%% %7.1f%% - %5.1f%% %9d"
+                         % (name, 100.0 * hits / (self.samples or 1),
+                            100 * low, 100 * high, hits))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,332 @@
+"""
+Scanning without disturbing the rest of a host.
+
+A scan reads every file once, so the page cache gains nothing from keeping
+what it reads, and on a busy server it evicts pages the workload needs.
+LowImpact hashes files telling the kernel they are read sequentially, and
+drops their pages once they're hashed, or bypasses the page cache entirely
+with O_DIRECT. Token buckets cap the bytes and files read per second, and
+lower_priority() drops the process to the lowest CPU and idle I/O priority,
+so the scan only gets what the workload doesn't use.
+"""
+
+import ctypes
+import errno
+import hashlib
+import io
+import mmap
+import os
+import platform
+import threading
+import time
+
+from .instrument import cpu_time
+
+# Bytes read at a time. A multiple of the page size, as O_DIRECT requires.
+CHUNK = 1024 * 1024
+
+# Niceness set by lower_priority().
+NICE = 19
+
+# ioprio_set() classes and who values, see linux/ioprio.h.
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+# ioprio_set() system call numbers. glibc has no wrapper.
+SYS_IOPRIO_SET = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+    "s390x": 282,
+}
+
+
+class TokenBucket(object):
+    """TokenBucket class - Limits the rate of something, ex: bytes read.
+
+    Tokens accumulate at rate per second up to burst. take() waits until
+    there are enough, so the long run rate never exceeds rate. Safe to share
+    between threads.
+
+    Attributes:
+        rate (float) - Tokens added per second.
+        burst (float) - Most tokens held at once.
+        tokens (float) - Tokens available.
+        updated (float) - When tokens was last brought up to date.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount=1):
+        """TokenBucket.take() - Wait until amount tokens are available and
+                                take them.
+
+        Amounts bigger than burst are allowed, and wait for the tokens they
+        need beyond it.
+
+        Args:
+            amount (float) - Tokens needed.
+
+        Returns:
+            Seconds spent waiting (float).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Going into debt makes later callers wait in turn.
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class ThrottledFile(io.FileIO):
+    """ThrottledFile class - A file read within a LowImpact's limits, ex: an
+                            archive whose members are streamed.
+
+    Reads take tokens from the byte bucket, the kernel is told the file is
+    read sequentially, and its pages are dropped when it's closed.
+
+    Attributes:
+        impact (LowImpact) - Limits the file is read within.
+        stats (ScanStats) - Records time spent waiting for tokens, or None.
+        waited (float) - Seconds spent waiting for tokens so far.
+    """
+    def __init__(self, filename, impact, stats=None):
+        super().__init__(filename, "rb")
+        self.impact = impact
+        self.stats = stats
+        self.waited = 0.0
+        impact.advise(self.fileno(), "POSIX_FADV_SEQUENTIAL")
+
+    def throttle(self, count):
+        """ThrottledFile.throttle() - Wait for the tokens a read used.
+
+        Args:
+            count (int) - Bytes read.
+
+        Returns:
+            Nothing.
+        """
+        if count and self.impact.bytes_bucket is not None:
+            self.waited += self.impact.bytes_bucket.take(count)
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if data:
+            self.throttle(len(data))
+        return data
+
+    def readall(self):
+        data = super().readall()
+        self.throttle(len(data))
+        return data
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        if count:
+            self.throttle(count)
+        return count
+
+    def close(self):
+        if not self.closed:
+            self.impact.advise(self.fileno(), "POSIX_FADV_DONTNEED")
+            if self.stats is not None and self.waited:
+                self.stats.add("throttle", self.waited, 0.0)
+        super().close()
+
+
+def lower_priority(niceness=NICE, io_class=IOPRIO_CLASS_IDLE):
+    """lower_priority() - Lower the process's CPU and I/O priority. Threads
+                          started afterwards inherit it.
+
+    Args:
+        niceness (int) - Added to the process's nice value.
+        io_class (int) - IOPRIO_CLASS_IDLE only gets disk time no one else
+                         wants. IOPRIO_CLASS_BE is the default class.
+
+    Returns:
+        True if the I/O priority was changed too. It can only be changed on
+        Linux, and the I/O scheduler must support priorities for it to have
+        an effect.
+    """
+    try:
+        os.nice(niceness)
+    except (AttributeError, OSError):
+        pass
+    number = SYS_IOPRIO_SET.get(platform.machine())
+    if number is None or not platform.system() == "Linux":
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return False
+    return libc.syscall(number, IOPRIO_WHO_PROCESS, 0,
+                        io_class << IOPRIO_CLASS_SHIFT) == 0
+
+
+class LowImpact(object):
+    """LowImpact class - Hashes files while limiting their effect on the
+                         page cache and disk.
+
+    Attributes:
+        fadvise (bool) - Tell the kernel files are read sequentially, and
+                         drop their pages once hashed. This drops pages the
+                         workload had cached too.
+        direct (bool) - Read with O_DIRECT, bypassing the page cache, where
+                        the filesystem supports it.
+        bytes_bucket (TokenBucket) - Limits bytes read per second, or None.
+        files_bucket (TokenBucket) - Limits files read per second, or None.
+    """
+    def __init__(self, fadvise=True, direct=False, bytes_per_sec=None,
+                 files_per_sec=None):
+        self.fadvise = fadvise and hasattr(os, "posix_fadvise")
+        self.direct = direct and hasattr(os, "O_DIRECT")
+        self.bytes_bucket = None
+        if bytes_per_sec:
+            self.bytes_bucket = TokenBucket(bytes_per_sec)
+        self.files_bucket = None
+        if files_per_sec:
+            self.files_bucket = TokenBucket(files_per_sec)
+
+    def advise(self, fd, advice):
+        """LowImpact.advise() - Give the kernel a hint about a file, if
+                                fadvise is set.
+
+        Args:
+            fd (int) - File descriptor.
+            advice (str) - Name of the os.POSIX_FADV_* constant.
+
+        Returns:
+            Nothing.
+        """
+        if not self.fadvise or not hasattr(os, advice):
+            return
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+        except OSError:
+            pass
+
+    def open(self, filename):
+        """LowImpact.open() - Open a file for hashing.
+
+        Args:
+            filename (str) - Path to file.
+
+        Returns:
+            tuple of (file descriptor, True if it was opened with O_DIRECT).
+
+        Raises:
+            OSError if the file can't be opened.
+        """
+        if self.direct:
+            try:
+                return os.open(filename, os.O_RDONLY | os.O_DIRECT), True
+            except OSError as exc:
+                # Filesystems without O_DIRECT support, ex: tmpfs.
+                if exc.errno != errno.EINVAL:
+                    raise
+        return os.open(filename, os.O_RDONLY), False
+
+    def open_file(self, filename, stats=None):
+        """LowImpact.open_file() - Open a file to be read as a stream, ex:
+                                   an archive, within the limits.
+
+        Counts as one file against files_bucket. O_DIRECT isn't used, since
+        archive readers make small reads at any offset.
+
+        Args:
+            filename (str) - Path to file.
+            stats (ScanStats) - Record time spent waiting for tokens, or
+                                None.
+
+        Returns:
+            Buffered binary file, reading CHUNK bytes at a time.
+
+        Raises:
+            OSError if the file can't be opened.
+        """
+        if self.files_bucket is not None:
+            waited = self.files_bucket.take()
+            if stats is not None and waited:
+                stats.add("throttle", waited, 0.0)
+        return io.BufferedReader(ThrottledFile(filename, self, stats), CHUNK)
+
+    def md5_file(self, filename, stats=None):
+        """LowImpact.md5_file() - Calculates MD5 of a file, like
+                                  scanner.md5_file().
+
+        Args:
+            filename (str) - Path to file.
+            stats (ScanStats) - Record time spent reading and hashing, or
+                                None.
+
+        Returns:
+            Hexadecimal string of the hash on success.
+            None if the hash couldn't be calculated.
+        """
+        waited = 0.0
+        if self.files_bucket is not None:
+            waited += self.files_bucket.take()
+        md5hash = hashlib.md5()
+        try:
+            fd, direct = self.open(filename)
+        except PermissionError:
+            return None
+        # Page aligned, as O_DIRECT requires.
+        buffer = mmap.mmap(-1, CHUNK)
+        view = memoryview(buffer)
+        offset = 0
+        read_wall = read_cpu = hash_wall = hash_cpu = 0.0
+        reads = 0
+        try:
+            self.advise(fd, "POSIX_FADV_SEQUENTIAL")
+            while True:
+                wall, cpu = time.perf_counter(), cpu_time()
+                try:
+                    count = os.preadv(fd, [buffer], offset)
+                except OSError as exc:
+                    if not direct or exc.errno != errno.EINVAL:
+                        raise
+                    # O_DIRECT reads must start on a block boundary, which a
+                    # short read can leave us off. Carry on through the
+                    # page cache.
+                    os.close(fd)
+                    fd, direct = os.open(filename, os.O_RDONLY), False
+                    continue
+                wall2, cpu2 = time.perf_counter(), cpu_time()
+                read_wall += wall2 - wall
+                read_cpu += cpu2 - cpu
+                reads += 1
+                if not count:
+                    break
+                if self.bytes_bucket is not None:
+                    waited += self.bytes_bucket.take(count)
+                    wall2, cpu2 = time.perf_counter(), cpu_time()
+                md5hash.update(view[:count])
+                offset += count
+                hash_wall += time.perf_counter() - wall2
+                hash_cpu += cpu_time() - cpu2
+            self.advise(fd, "POSIX_FADV_DONTNEED")
+        finally:
+            view.release()
+            buffer.close()
+            os.close(fd)
+        if stats is not None:
+            stats.add("read", read_wall, read_cpu, reads)
+            stats.add("hash", hash_wall, hash_cpu, reads - 1)
+            if waited:
+                stats.add("throttle", waited, 0.0)
+        return md5hash.hexdigest()
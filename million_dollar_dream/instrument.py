@@ -0,0 +1,246 @@
+import heapq
+import json
+import os
+import threading
+import time
+
+# CPU time of the calling thread, so phases running in worker threads are
+# charged correctly. Falls back to process time on old Pythons.
+cpu_time = getattr(time, "thread_time", time.process_time)
+
+# Order phases are reported in.
+PHASES = ["walk", "read", "hash", "lookup", "add", "output"]
+
+# Descriptions of counters for Prometheus output.
+COUNTER_HELP = {
+    "files": "Files scanned.",
+    "bytes": "Bytes in files scanned.",
+    "errors": "Files that couldn't be read.",
+}
+
+
+class ScanStats(object):
+    """ScanStats class - Collects per-phase timings and throughput for a
+                         scan.
+
+    Instrumented code takes a ScanStats or None. When it is None nothing is
+    measured, so a scan without --stats pays for one comparison per file.
+
+    Attributes:
+        started (float) - perf_counter() when collection started.
+        finished (float) - perf_counter() when stop() was called, or None.
+        phases (dict) - Phase names mapped to [wall seconds, cpu seconds,
+                        calls].
+        counters (dict) - Counter names mapped to values.
+        slowest (list) - Heap of (seconds, path) for the slowest files.
+        keep_slowest (int) - Number of slowest files to remember.
+        lock (threading.Lock) - Protects the above from scan workers.
+    """
+    def __init__(self, keep_slowest=10):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.phases = dict()
+        self.counters = dict(files=0, bytes=0, errors=0)
+        self.slowest = []
+        self.keep_slowest = keep_slowest
+        self.lock = threading.Lock()
+
+    def add(self, phase, wall, cpu, calls=1):
+        """ScanStats.add() - Record time spent in a phase.
+
+        Args:
+            phase (str) - Name of the phase, ex: "hash"
+            wall (float) - Wall clock seconds.
+            cpu (float) - CPU seconds.
+            calls (int) - Number of operations the time covers.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            totals = self.phases.setdefault(phase, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += calls
+
+    def count(self, counter, value=1):
+        """ScanStats.count() - Increment a counter.
+
+        Args:
+            counter (str) - Name of the counter, ex: "cache_hits"
+            value (int) - Amount to add.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def file_done(self, path, seconds, size):
+        """ScanStats.file_done() - Record a scanned file.
+
+        Args:
+            path (str) - Path to the file.
+            seconds (float) - Wall clock time spent on the file.
+            size (int) - Size of the file in bytes, or None if unreadable.
+
+        Returns:
+            Nothing.
+        """
+        with self.lock:
+            self.counters["files"] += 1
+            if size is None:
+                self.counters["errors"] += 1
+            else:
+                self.counters["bytes"] += size
+            entry = (seconds, path)
+            if len(self.slowest) < self.keep_slowest:
+                heapq.heappush(self.slowest, entry)
+            elif entry > self.slowest[0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def stop(self):
+        """ScanStats.stop() - Mark the end of the scan.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        """ScanStats.summary() - Summarize the collected statistics.
+
+        Args:
+            None.
+
+        Returns:
+            dict suitable for JSON.
+        """
+        with self.lock:
+            elapsed = (self.finished or time.perf_counter()) - self.started
+            counters = dict(self.counters)
+            phases = dict(
+                (phase, dict(wall=wall, cpu=cpu, calls=calls))
+                for phase, (wall, cpu, calls) in self.phases.items()
+            )
+            slowest = sorted(self.slowest, reverse=True)
+
+        ratios = dict()
+        for name in set(counter.rsplit("_", 1)[0] for counter in counters
+                        if counter.endswith(("_hits", "_misses"))):
+            hits = counters.get(name + "_hits", 0)
+            misses = counters.get(name + "_misses", 0)
+            if hits + misses:
+                ratios[name] = hits / (hits + misses)
+
+        return dict(
+            elapsed=elapsed,
+            files_per_sec=counters["files"] / elapsed if elapsed else 0.0,
+            bytes_per_sec=counters["bytes"] / elapsed if elapsed else 0.0,
+            counters=counters,
+            phases=phases,
+            hit_ratios=ratios,
+            slowest=[dict(path=path, seconds=seconds)
+                     for seconds, path in slowest],
+        )
+
+    def format_text(self):
+        """ScanStats.format_text() - Format a summary for humans.
+
+        Args:
+            None.
+
+        Returns:
+            str containing the summary.
+        """
+        summary = self.summary()
+        counters = summary["counters"]
+        lines = [
+            "[+] Scanned %d files (%d bytes, %d unreadable) in %.2fs"
+            % (counters["files"], counters["bytes"], counters["errors"],
+               summary["elapsed"]),
+            "    %.1f files/s, %.1f MB/s"
+            % (summary["files_per_sec"], summary["bytes_per_sec"] / 1e6),
+            "    %-8s %10s %10s %10s" % ("phase", "wall", "cpu", "calls"),
+        ]
+        for phase in sorted(summary["phases"], key=phase_order):
+            data = summary["phases"][phase]
+            lines.append("    %-8s %9.3fs %9.3fs %10d"
+                         % (phase, data["wall"], data["cpu"], data["calls"]))
+        for name, ratio in sorted(summary["hit_ratios"].items()):
+            lines.append("    %s hit ratio: %.1f%%" % (name, ratio * 100))
+        if summary["slowest"]:
+            lines.append("    slowest files:")
+            for entry in summary["slowest"]:
+                lines.append("      %8.3fs %s"
+                             % (entry["seconds"], entry["path"]))
+        return "\n".join(lines) + "\n"
+
+    def format_prometheus(self, prefix="mdd_scan"):
+        """ScanStats.format_prometheus() - Format a summary in the Prometheus
+                                           text exposition format, for the
+                                           node exporter's textfile
+                                           collector.
+
+        Args:
+            prefix (str) - Prefix for metric names.
+
+        Returns:
+            str containing the metrics.
+        """
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for labels, value in samples:
+                lines.append("%s_%s%s %r" % (prefix, name, labels, value))
+
+        metric("duration_seconds", "gauge",
+               "Wall clock duration of the scan.", [("", summary["elapsed"])])
+        for counter, value in sorted(summary["counters"].items()):
+            help_text = COUNTER_HELP.get(
+                counter, "Count of %s." % counter.replace("_", " "))
+            metric(counter + "_total", "counter", help_text, [("", value)])
+        phases = sorted(summary["phases"], key=phase_order)
+        metric("phase_wall_seconds", "gauge", "Wall clock time per phase.",
+               [('{phase="%s"}' % phase, summary["phases"][phase]["wall"])
+                for phase in phases])
+        metric("phase_cpu_seconds", "gauge", "CPU time per phase.",
+               [('{phase="%s"}' % phase, summary["phases"][phase]["cpu"])
+                for phase in phases])
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """ScanStats.export() - Write a summary to a file. Files ending in
+                                ".prom" get Prometheus format, anything else
+                                gets JSON.
+
+        The file is replaced atomically, so collectors never see a partial
+        file.
+
+        Args:
+            path (str) - File to write.
+
+        Returns:
+            Nothing.
+        """
+        if path.endswith(".prom"):
+            data = self.format_prometheus()
+        else:
+            data = json.dumps(self.summary(), sort_keys=True, indent=4)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as statsfile:
+            statsfile.write(data)
+        os.replace(temp_path, path)
+
+
+def phase_order(phase):
+    """phase_order() - Sort key putting phases in pipeline order."""
+    if phase in PHASES:
+        return (PHASES.index(phase), phase)
+    return (len(PHASES), phase)
@@ -1,11 +1,37 @@
 from datetime import datetime
 import hashlib
 import json
+import mmap
 import os
+import re
+import shutil
 import sys
+import tempfile
+import time
 import urllib.request
 
-from million_dollar_dream.bloomfilter import BloomFilter
+from million_dollar_dream.baseline import Baseline, read_paths
+from million_dollar_dream.bloomfilter import (
+    POLICIES, BloomFilter, compressions)
+from million_dollar_dream.delta import apply_delta, make_delta
+from million_dollar_dream.digeststore import (
+    SUFFIX, DigestStoreWriter, remove_store, store_path)
+from million_dollar_dream.filterbank import (
+    MEMO_ENTRIES, FilterBank, LookupMemo, build_union, filter_paths,
+    is_union)
+from million_dollar_dream.fleet import (
+    SEEN_FP_RATE, Agent, Collector, CollectorServer, parse_address)
+from million_dollar_dream.identify import (
+    MAX_SAMPLES, Identifier, SampledScanner)
+from million_dollar_dream.impact import LowImpact, lower_priority
+from million_dollar_dream.instrument import ScanStats, cpu_time
+from million_dollar_dream.output import FORMATS, Result, ResultWriter
+from million_dollar_dream.scanner import (
+    FILE_TYPES, HashCache, Scanner, WalkRules)
+from million_dollar_dream.schedule import ORDERS
+from million_dollar_dream.watcher import DEBOUNCE, POLL_INTERVAL, Watcher
+# The hashing functions used to live here.
+from million_dollar_dream.scanner import md5_file, md5_first_8192  # noqa: F401
 
 
 def is_md5(string):
@@ -18,132 +44,277 @@ def is_md5(string):
         return False
 
 
-def md5_first_8192(filename):
-    """md5_first_8192() - Calculates MD5 of first 8kb of a file for great speed.
+def count_files(path):
+    """count_files() - Count all files in a directory and its included sub
+                       directories.
 
     Args:
-        filename (str) - Path to file.
+        path (str) - Path to file or directory to count files.
 
     Returns:
-        Hexadecimal string of the hash on success.
-        None if the hash couldn't be calculated.
+        Number of files counted (int)
     """
-    md5hash = hashlib.md5()
+    if os.path.isfile(path):
+        return 1
 
-    try:
-        with open(filename, "rb") as filep:
-            md5hash.update(filep.read(8192))
-    except PermissionError:
-        return None
-    return md5hash.hexdigest()
+    count = 0
+    for _, _, files in os.walk(path):
+        count += len(files)
+    return count
 
 
-def md5_file(filename):
-    """md5_file() - Calculates MD5 of a file in 4k chunks. Useful for low
-                    memory machines because it doesnt load the entire file in
-                    RAM.
+def calculate_results(path, bloomfilter, rules=None):
+    """calculate_results() - Calculate MD5 hashes of all files within a
+                             directory, adding them to a bloom filter.
 
     Args:
-        filename (str) - Path to file.
+        path (str) - Path to file or directory containing files to hash.
+        bloomfilter (BloomFilter) - Filter to add the hashes to.
+        rules (WalkRules) - Which directories and files to hash, or None for
+                            all.
 
     Returns:
-        Hexadecimal string of the hash on success.
-        None if the hash couldn't be calculated.
+        Generator yielding a Result for each file.
     """
-    md5hash = hashlib.md5()
+    for result in Scanner([path], rules=rules).scan():
+        if result.digest:
+            bloomfilter.add(result.digest)
+        yield result
 
-    try:
-        with open(filename, "rb") as filep:
-            for chunk in iter(lambda: filep.read(4096), b""):
-                md5hash.update(chunk)
-    except PermissionError:
-        return None
-    return md5hash.hexdigest()
 
-
-def count_files(path):
-    """count_files() - Count all files in a directory and its included sub
-                       directories.
+def lookup_results(path, bloomfilters, rules=None):
+    """lookup_results() - Determine if files within a directory have hashes
+                          within bloom filters.
 
     Args:
-        path (str) - Path to file or directory to count files.
+        path (str) - Path to file or directory to check.
+        bloomfilters (dict) - Filter names mapped to BloomFilter objects.
+        rules (WalkRules) - Which directories and files to check, or None
+                            for all.
 
     Returns:
-        Number of files counted (int)
+        Generator yielding a Result for each file. filters lists the names of
+        the filters containing the file's hash.
     """
-    if os.path.isfile(path):
-        return 1
-
-    count = 0
-    for _, _, files in os.walk(path):
-        count += len(files)
-    return count
+    return Scanner([path], bloomfilters, rules=rules).scan()
 
 
-def calculate_hashes(path, bloomfilter):
+def calculate_hashes(path, bloomfilter, writer=None, rules=None):
     """calculate_hashes() - Calculate MD5 hashes of all files within a
                             directory, adding them to a bloom filter.
 
     Args:
         path (str) - Path to directory containing files to hash.
+        bloomfilter (BloomFilter) - Filter to add the hashes to.
+        writer (ResultWriter) - Where to write results. Defaults to text on
+                                stdout.
+        rules (WalkRules) - Which directories and files to hash, or None for
+                            all.
 
     Returns:
         Nothing
     """
-    if os.path.isfile(path):
-        digest = md5_file(path)
-        if digest:
-            print("  ", path, digest)
-            bloomfilter.add(digest)
-        else:
-            return
-    for root, _, files in os.walk(path):
-        for filename in files:
-            fullpath = os.path.join(root, filename)
-
-            # We only care about files.
-            if not os.path.isfile(fullpath):
-                continue
-
-            digest = md5_file(fullpath)
-            if digest:
-                print("  ", fullpath, digest)
-                bloomfilter.add(digest)
-            else:
-                print(fullpath, "Permission Denied")
+    writer = writer or ResultWriter(sys.stdout.buffer)
+    for result in calculate_results(path, bloomfilter, rules):
+        writer.write(result)
+    writer.flush()
 
 
-def lookup_hashes(path, bloomfilter):
+def lookup_hashes(path, bloomfilter, writer=None, name="filter",
+                  rules=None):
     """lookup_hashes() - Determine if files within a directory have hashes
                          within a bloom filter.
 
     Args:
         path (str) - Path to directory to check.
+        bloomfilter (BloomFilter) - Filter to check against.
+        writer (ResultWriter) - Where to write results. Defaults to text on
+                                stdout.
+        name (str) - Name of the filter reported in results.
+        rules (WalkRules) - Which directories and files to check, or None
+                            for all.
 
     Returns:
         Nothing.
     """
-    if os.path.isfile(path):
-        digest = md5_file(path)
-        if digest and bloomfilter.lookup(digest) is False:
-            print("%s is not in filter" % path)
+    writer = writer or ResultWriter(sys.stdout.buffer)
+    for result in lookup_results(path, {name: bloomfilter}, rules):
+        writer.write(result)
+    writer.flush()
+
+
+# Number of digests looked up at a time by lookup-hashes, and added at a
+# time by calculate.
+BATCH_SIZE = 65536
+
+# Bytes in a binary MD5 digest.
+DIGEST_SIZE = 16
+
+# Filters listed by identify.
+IDENTIFY_ROWS = 20
+
+# A line of a hash list holding only an MD5 digest, matched against a
+# whole batch of lowercased lines at once.
+MD5_LINE = re.compile(rb"^[ \t\r\f\v]*([0-9a-f]{32})[ \t\r\f\v]*$",
+                      re.MULTILINE)
+
+# Characters bytes.translate() deletes from a batch that is only digests,
+# one per line, leaving nothing.
+DIGEST_CHARS = b"0123456789abcdef\n"
+
+# Bytes read from a hash list per batch, about BATCH_SIZE lines.
+BATCH_BYTES = BATCH_SIZE * 33
+
+
+def read_digest_batches(paths):
+    """read_digest_batches() - Stream MD5 digests from hash lists in
+                               batches.
+
+    Hash lists are read as bytes, and each batch of lines is lowercased
+    and checked as a whole rather than line by line. Blank lines, comments
+    and anything that isn't an MD5 digest are skipped.
+
+    Args:
+        paths (list) - Paths to files containing one hex digest per line.
+                       "-" reads from stdin.
+
+    Returns:
+        Generator yielding non-empty lists of lowercase hex digests.
+    """
+    for path in paths:
+        if path == "-":
+            hashlist = sys.stdin.buffer
         else:
-            # TODO: logic to print these
-            pass
-        return
-    for root, _, files in os.walk(path):
-        for filename in files:
-            fullpath = os.path.join(root, filename)
+            hashlist = open(path, "rb")
+        try:
+            while True:
+                lines = hashlist.readlines(BATCH_BYTES)
+                if not lines:
+                    break
+                data = b"".join(lines).lower()
+                if not data.endswith(b"\n"):
+                    data += b"\n"
+                count = len(data) // 33
+                # Most hash lists are just digests. Checking that every 33rd
+                # byte is the only newline, and the rest are hex digits, is
+                # quicker than the regular expression.
+                if len(data) == count * 33 and \
+                   not data.translate(None, DIGEST_CHARS) and \
+                   data.count(b"\n") == count and \
+                   data[32::33] == b"\n" * count:
+                    yield data[:-1].decode().split("\n")
+                    continue
+                batch = MD5_LINE.findall(data)
+                if batch:
+                    yield b"\n".join(batch).decode().split("\n")
+        finally:
+            if hashlist is not sys.stdin.buffer:
+                hashlist.close()
+
+
+def read_digests(paths):
+    """read_digests() - Stream MD5 digests from hash lists.
 
-            # We only care about files.
-            if not os.path.isfile(fullpath):
-                continue
+    Args:
+        paths (list) - See read_digest_batches().
+
+    Returns:
+        Generator yielding lowercase hex digests.
+    """
+    for batch in read_digest_batches(paths):
+        yield from batch
 
-            digest = md5_file(fullpath)
-            if digest and bloomfilter.lookup(digest) is False:
-                print("%s is not in filter" % fullpath)
-            else:
-                print("%s is in filter" % fullpath)
+
+def digest_results(paths, bloomfilter, name="filter"):
+    """digest_results() - Check digests from hash lists against a bloom
+                          filter.
+
+    Digests are looked up in batches with BloomFilter.lookup_many().
+
+    Args:
+        paths (list) - Hash lists to read. "-" reads from stdin.
+        bloomfilter (BloomFilter) - Filter to check against.
+        name (str) - Name of the filter reported in results.
+
+    Returns:
+        Generator yielding a Result with no path for each digest.
+    """
+    found_in = [name]
+    for batch in read_digest_batches(paths):
+        for digest, found in zip(batch, bloomfilter.lookup_many(batch)):
+            yield Result(None, None, digest, found_in if found else [])
+
+
+def lookup_digests(paths, bloomfilter, writer, name="filter"):
+    """lookup_digests() - Check digests from hash lists against a bloom
+                          filter and write the results.
+
+    Each batch goes straight from BloomFilter.lookup_many() to
+    ResultWriter.write_digests(), without a Result per digest.
+
+    Args:
+        paths (list) - Hash lists to read. "-" reads from stdin.
+        bloomfilter (BloomFilter) - Filter to check against.
+        writer (ResultWriter) - Where to write results.
+        name (str) - Name of the filter reported in results.
+
+    Returns:
+        tuple of (number of digests checked, number not in filter)
+    """
+    checked = 0
+    misses = 0
+    for batch in read_digest_batches(paths):
+        found = bloomfilter.lookup_many(batch)
+        checked += len(batch)
+        misses += found.count(False)
+        writer.write_digests(batch, found, name)
+    writer.flush()
+    return checked, misses
+
+
+# Options accepted on the command line. Options with a boolean default are
+# flags, the rest take a value.
+OPTIONS = {
+    "compress": None,
+    "format": None,
+    "only-misses": False,
+    "output": None,
+    "jobs": None,
+    "cache": None,
+    "exclude": [],
+    "stats": False,
+    "stats-file": None,
+    "mmap": False,
+    "digests": False,
+    "low-memory": False,
+    "fp-rate": None,
+    "samples": None,
+    "optimize": None,
+    "hashes": None,
+    "export": None,
+    "debounce": None,
+    "archives": False,
+    "interval": None,
+    "include": [],
+    "min-size": None,
+    "max-size": None,
+    "type": [],
+    "one-file-system": False,
+    "profile": None,
+    "order": None,
+    "low-impact": False,
+    "direct": False,
+    "max-rate": None,
+    "max-files": None,
+    "memo": None,
+    "collector": None,
+    "unique": False,
+    "spool": None,
+}
+
+# Options a profile in config.json may set, see apply_profile().
+PROFILE_OPTIONS = ["exclude", "include", "min-size", "max-size", "type",
+                   "one-file-system"]
 
 
 def usage(progname):
@@ -156,13 +327,259 @@ def usage(progname):
         Nothing.
     """
     message = (
-        "usage: %s <calculate|lookup|fromfile|filters> "
-        "<filterfile> <file1> [file2 ...]\n"
-    ) % progname
+        "usage: %s [options] "
+        "<calculate|lookup|lookup-hashes|identify|stats|fromfile|"
+        "update-baseline|watch|collect|filters> <filterfile> "
+        "<file1> [file2 ...]\n"
+        "\n"
+        "lookup-hashes reads hash lists (- for stdin) instead of files.\n"
+        "\n"
+        "options:\n"
+        "  --compress <%s|auto>  compress filters written by calculate and\n"
+        "                        fromfile\n"
+        "  --format <text|ndjson|csv>  output format for results. text\n"
+        "                              output of lookup-hashes lists only\n"
+        "                              digests not in the filter\n"
+        "  --only-misses  only output files not in the filter\n"
+        "  --output <file>  write results to a file instead of stdout\n"
+        "  --jobs <n>  number of files to hash at once\n"
+        "  --cache <file>  remember digests of unchanged files between "
+        "scans\n"
+        "  --exclude <glob>  skip matching files and directories. May be\n"
+        "                    repeated\n"
+        "  --stats  print per-phase timings and throughput of scans\n"
+        "  --stats-file <file>  save scan statistics as JSON, or in\n"
+        "                       Prometheus format if <file> ends in .prom\n"
+        "  --mmap  build filters in a sparse file mapped into memory, and\n"
+        "          map uncompressed filters for lookups instead of reading\n"
+        "          them. For filters larger than RAM\n"
+        "  --digests  also write <filterfile>.digests, the exact list of\n"
+        "             digests in the filter. Lookups check it to rule out\n"
+        "             false positives\n"
+        "  --low-memory  leave uncompressed filters on disk for lookup and\n"
+        "                lookup-hashes, reading only the pages each lookup\n"
+        "                needs\n"
+        "  --fp-rate <rate>  false positive rate of a union rebuilt from\n"
+        "                    digest stores. Default 0.01\n"
+        "  --samples <n>  most files identify samples. Default %d\n"
+        "  --optimize <%s>  sizing of filters built by\n"
+        "      calculate, fromfile and filters union. memory (default) is\n"
+        "      smallest; balanced and lookup are bigger but use fewer\n"
+        "      hashes, so lookups probe fewer bits\n"
+        "  --hashes <k>  build filters with k hashes, sized to keep their\n"
+        "                false positive rate\n"
+        "  --export <file>  save update-baseline's baseline as a plain\n"
+        "                   filter for distribution\n"
+        "  --debounce <s>  seconds a changed file must be left alone before\n"
+        "                  watch checks it. Default %g\n"
+        "  --interval <s>  seconds between watch's scans of directories it\n"
+        "                  can't watch. Default %g\n"
+        "  --archives  also check the files inside tar, zip, gzip, deb and\n"
+        "              rpm archives, as <archive>!<member>, without\n"
+        "              extracting them\n"
+        "  --include <glob>  only check files matching. May be repeated\n"
+        "  --min-size <size>  skip files smaller than size, ex: 4K\n"
+        "  --max-size <size>  skip files larger than size, ex: 2G\n"
+        "  --type <%s>  only check regular files, links to them\n"
+        "                          or executables. May be repeated\n"
+        "  --one-file-system  don't descend into other filesystems, ex:\n"
+        "                     /proc under /\n"
+        "  --profile <name>  use the walk options saved as a profile in\n"
+        "                    config.json\n"
+        "  --order <%s>  order files are read in.\n"
+        "      Except for walk (default), each device gets its own --jobs\n"
+        "      workers; inode and extent then sort each device's files by\n"
+        "      inode or location on disk to cut seeking on hard disks\n"
+        "  --low-impact  run at the lowest CPU and idle I/O priority, and\n"
+        "                drop files from the page cache once hashed\n"
+        "  --direct  read files with O_DIRECT, bypassing the page cache\n"
+        "  --max-rate <size>  most bytes read per second, ex: 20M\n"
+        "  --max-files <n>  most files read per second\n"
+        "  --memo <n|size>  remember the last n lookups, or as many as fit\n"
+        "                   in size (ex: 64M), so content seen before isn't\n"
+        "                   looked up again. 0 turns it off. Default %d\n"
+        "  --collector <host:port>  also send files lookup and watch find\n"
+        "                           in no filter to a collector\n"
+        "  --unique  send each digest to the collector once\n"
+        "  --spool <file>  keep files the collector didn't receive in\n"
+        "                  <file>, and send them once it's back, even on a\n"
+        "                  later run. Without it they are dropped\n"
+        "\n"
+        "lookup accepts a directory of filters as <filterfile>.\n"
+        "identify samples files and ranks a directory of filters by the\n"
+        "share of files in each, stopping once the best is clear.\n"
+        "stats <filterfile> reports how full a filter, or each filter in a\n"
+        "directory, is and flags saturated ones.\n"
+        "update-baseline <baseline> <list1> [list2 ...] rehashes the paths\n"
+        "listed (- for stdin) and updates a counting filter of a host's\n"
+        "files, creating it if needed. Listed paths that no longer exist\n"
+        "are removed from it.\n"
+        "watch <filterfile> <dir1> [dir2 ...] checks files as they are\n"
+        "created or modified until interrupted.\n"
+        "collect <directory> <[host:]port> records the unknown files agents\n"
+        "send with --collector in <directory>/unknown.ndjson, each digest\n"
+        "once, until interrupted.\n"
+        "filters union [directory] combines a directory of filters\n"
+        "(default: the installed filters) into one filter that lookup\n"
+        "checks first, so files in none of them are rejected quickly.\n"
+    ) % (progname, "|".join(compressions()), MAX_SAMPLES,
+         "|".join(sorted(POLICIES)), DEBOUNCE, POLL_INTERVAL,
+         "|".join(FILE_TYPES), "|".join(ORDERS), MEMO_ENTRIES)
     sys.stderr.write(message)
     exit(os.EX_USAGE)
 
 
+def parse_options(args, defaults):
+    """parse_options() - Separate --options from positional arguments.
+
+    Args:
+        args (list) - Command line arguments, excluding the program name.
+        defaults (dict) - Option names mapped to their default values.
+                          Options with a boolean default are flags, the rest
+                          take a value as "--name value" or "--name=value".
+                          Options with a list default may be repeated.
+
+    Returns:
+        tuple of (options (dict), positional arguments (list)).
+
+    Raises:
+        ValueError if an option is unknown or missing its value.
+    """
+    options = dict(defaults)
+    positional = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == "--":
+            positional += args
+            break
+        if not arg.startswith("--"):
+            positional.append(arg)
+            continue
+
+        name, equals, value = arg[2:].partition("=")
+        if name not in defaults:
+            raise ValueError("unknown option --%s" % name)
+        if isinstance(defaults[name], bool):
+            if equals:
+                raise ValueError("--%s does not take a value" % name)
+            options[name] = True
+            continue
+        if not equals:
+            if not args:
+                raise ValueError("--%s requires a value" % name)
+            value = args.pop(0)
+        if isinstance(defaults[name], list):
+            options[name] = options[name] + [value]
+        else:
+            options[name] = value
+    return options, positional
+
+
+def human_size(count):
+    """human_size() - Format a number of bytes for display.
+
+    Args:
+        count (int) - Number of bytes.
+
+    Returns:
+        str containing the size, ex: "1.5Mb"
+    """
+    suffix = ['bytes', 'Kb', 'Mb', 'Gb', 'Tb', 'Pb', 'Eb', 'Zb', 'Yb']
+    order = 0
+    while count >= 1024 and order < len(suffix) - 1:
+        count /= 1024
+        order += 1
+    return str(round(count, 1)) + suffix[order]
+
+
+def parse_size(text):
+    """parse_size() - Parse a number of bytes.
+
+    Args:
+        text (str) - Size with an optional binary suffix, ex: "512", "4K",
+                     "1.5GB"
+
+    Returns:
+        Number of bytes (int).
+
+    Raises:
+        ValueError if the size can't be parsed.
+    """
+    units = "KMGTP"
+    text = str(text).strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    scale = 1
+    if text and text[-1] in units:
+        scale = 1024 ** (units.index(text[-1]) + 1)
+        text = text[:-1]
+    size = int(float(text) * scale)
+    if size < 0:
+        raise ValueError("negative size: %s" % text)
+    return size
+
+
+def make_memo(text):
+    """make_memo() - Create the lookup memo asked for by --memo.
+
+    Args:
+        text (str) - Number of lookups to remember, a size they may use
+                     (ex: "64M"), or None for the default.
+
+    Returns:
+        LookupMemo, or None if text is 0.
+
+    Raises:
+        ValueError if text can't be parsed.
+    """
+    if text is None:
+        return LookupMemo()
+    text = str(text).strip()
+    if text.isdigit():
+        entries = int(text)
+        return LookupMemo(entries) if entries else None
+    size = parse_size(text)
+    return LookupMemo(None, size) if size else None
+
+
+def print_stats(path):
+    """print_stats() - Print how full a filter or directory of filters is.
+
+    Each filter is streamed from disk once, so this is quick even for large
+    banks.
+
+    Args:
+        path (str) - A filter, or a directory of filters.
+
+    Returns:
+        Number of saturated filters (int).
+    """
+    if os.path.isfile(path):
+        paths = [(os.path.basename(path), path)]
+    else:
+        paths = filter_paths(path)
+    print("%-30s %10s %6s %7s %12s %9s" % (
+        "Filter", "Size", "Hashes", "Fill", "Est. items", "Est. FP"))
+    print("-" * 88)
+    saturated = 0
+    for name, filter_path in paths:
+        try:
+            stats = BloomFilter.file_stats(filter_path)
+        except (OSError, ValueError) as exc:
+            sys.stderr.write("[-] %s\n" % exc)
+            continue
+        items = "-" if stats["items"] is None else str(stats["items"])
+        line = "%-30s %10s %6d %6.1f%% %12s %9.2g %s" % (
+            name, human_size((stats["size"] + 7) // 8), stats["hashcount"],
+            100 * stats["fill"], items, stats["fp_rate"],
+            "SATURATED" if stats["saturated"] else "")
+        print(line.rstrip())
+        saturated += stats["saturated"]
+    print("[+] %d filters, %d saturated" % (len(paths), saturated))
+    return saturated
+
+
 def readable_file(path):
     if os.path.isfile(path) and os.access(path, os.R_OK):
         return True
@@ -194,6 +611,42 @@ def get_config():
     return config
 
 
+def apply_profile(options, name):
+    """apply_profile() - Merge a profile from config.json into the options.
+
+    Profiles are saved under "profiles" in config.json, ex:
+        "profiles": {"system": {"exclude": ["/proc", "/sys"],
+                                "one-file-system": true}}
+    Options given on the command line override the profile's, except those
+    that may be repeated, which are combined.
+
+    Args:
+        options (dict) - Options from parse_options().
+        name (str) - Name of the profile.
+
+    Returns:
+        dict of options.
+
+    Raises:
+        ValueError if the profile doesn't exist or sets an option that isn't
+        in PROFILE_OPTIONS.
+    """
+    profiles = get_config().get("profiles", {})
+    if name not in profiles:
+        raise ValueError("no profile named %s in config.json" % name)
+    merged = dict(options)
+    for option, value in profiles[name].items():
+        if option not in PROFILE_OPTIONS:
+            raise ValueError("profile %s can't set --%s" % (name, option))
+        if isinstance(OPTIONS[option], list):
+            if not isinstance(value, list):
+                value = [value]
+            merged[option] = value + options[option]
+        elif options[option] in (None, False):
+            merged[option] = value
+    return merged
+
+
 def update_metadata(repo_url=None):
     if not repo_url:
         config = get_config()
@@ -247,6 +700,8 @@ def get_installed(hash_alg=None):
             config = get_config()
             hash_alg = config["hash_alg"]
         for file_name in os.listdir(filters):
+            if file_name.endswith(SUFFIX) or is_union(file_name):
+                continue
             filter_path = os.path.join(filters, file_name)
             hash_func = hasher(hash_alg)
             with open(filter_path, "rb") as f:
@@ -264,25 +719,61 @@ def get_installed(hash_alg=None):
     return installed
 
 
-def print_filters(data):
-    print(
+def filter_sizes(path):
+    """filter_sizes() - Get the size of a filter on disk and in memory.
+
+    Args:
+        path (str) - Path to filter.
+
+    Returns:
+        tuple of (bytes on disk, bytes in memory, compression method)
+    """
+    with open(path, "rb") as f:
+        header = BloomFilter.read_header(f)
+    in_memory = (header["size"] + 7) // 8
+    return os.path.getsize(path), in_memory, header["compression"]
+
+
+def print_filters(data, sizes=None):
+    columns = [
         "{0: <{width}}".format("Filter", width=20),
         "{0: <{width}}".format("Description", width=40),
         "{0: <{width}}".format("Last modified", width=20),
-    )
-    print("-" * 90)
+    ]
+    if sizes is not None:
+        columns += [
+            "{0: >{width}}".format("On disk", width=10),
+            "{0: >{width}}".format("In memory", width=10),
+            "{0: <{width}}".format("Compression", width=11),
+        ]
+    print(*columns)
+    print("-" * (90 if sizes is None else 116))
     for filter_name in data.keys():
         filter_data = data[filter_name]
-        print(
+        columns = [
             "{0: <{width}}".format(filter_name, width=20),
             "{0: <{width}}".format(filter_data["description"], width=40),
             "{0: <{width}}".format(filter_data["last_modified"], width=20),
-        )
+        ]
+        if sizes is not None and filter_name in sizes:
+            on_disk, in_memory, compression = sizes[filter_name]
+            columns += [
+                "{0: >{width}}".format(human_size(on_disk), width=10),
+                "{0: >{width}}".format(human_size(in_memory), width=10),
+                "{0: <{width}}".format(compression, width=11),
+            ]
+        print(*columns)
 
 
 def list_local(hash_alg=None):
     installed = get_installed(hash_alg)
-    print_filters(installed)
+    dirname = os.path.dirname(__file__)
+    sizes = dict()
+    for filter_name in installed.keys():
+        path = os.path.join(dirname, "filters", filter_name)
+        if os.path.isfile(path):
+            sizes[filter_name] = filter_sizes(path)
+    print_filters(installed, sizes)
 
 
 def list_remote(repo):
@@ -310,6 +801,7 @@ def download_filter(target):
         path = os.path.join(filter_path, target)
         with open(path, "wb") as f:
             f.write(filter_data)
+        remove_store(path)
         print("Done.")
     except urllib.error.HTTPError:
         print("%s filter not found!" %  target)
@@ -342,6 +834,101 @@ def fetch_filter(target):
         update_installed(target)
 
 
+def patch_filter(target, delta_name, hash_alg, digest):
+    """patch_filter() - Update an installed filter by applying a delta
+                        published in the repo rather than downloading the
+                        whole filter again.
+
+    Args:
+        target (str) - Name of the installed filter.
+        delta_name (str) - Path of the delta relative to the repo.
+        hash_alg (str) - Hash algorithm used to verify the result.
+        digest (str) - Expected digest of the patched filter.
+
+    Returns:
+        True if the filter was patched and verified.
+        False if the delta couldn't be fetched, applied or verified. The
+        installed filter is left untouched in this case.
+    """
+    config = get_config()
+    url = config["repo"] + delta_name
+    try:
+        with urllib.request.urlopen(url) as f:
+            delta = f.read()
+    except urllib.error.URLError:
+        return False
+
+    dirname = os.path.dirname(__file__)
+    path = os.path.join(dirname, "filters", target)
+    patched_path = path + ".patched"
+    shutil.copyfile(path, patched_path)
+    try:
+        with open(patched_path, "r+b") as f:
+            with mmap.mmap(f.fileno(), 0) as buffer:
+                apply_delta(buffer, delta)
+                hash_func = hasher(hash_alg)
+                hash_func.update(buffer)
+    except ValueError:
+        os.remove(patched_path)
+        return False
+
+    if hash_func.hexdigest() != digest:
+        os.remove(patched_path)
+        return False
+    os.replace(patched_path, path)
+    remove_store(path)
+    return True
+
+
+def write_delta(old_path, new_path, delta_path):
+    """write_delta() - Create a delta between two versions of a filter for
+                       publishing in a repo.
+
+    Args:
+        old_path (str) - Previous version of the filter.
+        new_path (str) - New version of the filter.
+        delta_path (str) - Where to write the delta.
+
+    Returns:
+        Nothing.
+    """
+    with open(old_path, "rb") as f:
+        old = f.read()
+    with open(new_path, "rb") as f:
+        new = f.read()
+    try:
+        delta = make_delta(old, new)
+    except ValueError as exc:
+        sys.stderr.write("[-] %s\n" % exc)
+        exit(os.EX_DATAERR)
+    with open(delta_path, "wb") as f:
+        f.write(delta)
+    print("[+] Wrote %d byte delta (%d byte filter) to %s"
+          % (len(delta), len(new), delta_path))
+
+
+def write_union(path, fp_rate=None, policy="memory", hashcount=None):
+    """write_union() - Build the union filter of a directory of filters.
+
+    Args:
+        path (str) - Directory of filters.
+        fp_rate (float) - False positive rate if the union is rebuilt from
+                          digest stores.
+        policy (str) - Sizing policy if the union is rebuilt.
+        hashcount (int) - Number of hashes if the union is rebuilt, or None.
+
+    Returns:
+        Nothing.
+    """
+    try:
+        union, method = build_union(path, fp_rate, policy, hashcount)
+    except ValueError as exc:
+        sys.stderr.write("[-] %s\n" % exc)
+        exit(os.EX_DATAERR)
+    how = "Rebuilt" if method == "rebuild" else "ORed"
+    print("[+] %s %s union filter of %s" % (how, union.bytesize_human, path))
+
+
 def update_filters():
     config = get_config()
     hash_alg = config["hash_alg"]
@@ -361,43 +948,332 @@ def update_filters():
             hash_there = there_data[hash_alg]
             if (modified_there > modified_here) and (hash_there != hash_here):
                 print("Updating %s..." % target)
-                download_filter(target)
+                # Deltas are keyed by the digest of the version they apply
+                # to. Fall back to a full download if there is no delta for
+                # our version or the patched filter doesn't verify.
+                deltas = there_data.get("deltas", {})
+                if hash_here in deltas and \
+                   patch_filter(target, deltas[hash_here], hash_alg,
+                                hash_there):
+                    print("Patched %s." % target)
+                else:
+                    download_filter(target)
                 update_installed(target)
                 print("Done.")
 
 
+def digest_writer(filterfile, enabled):
+    """digest_writer() - Start the digest store for a filter being built.
+
+    A store left over from an earlier build no longer matches the filter
+    and would hide its contents from lookups, so it's removed if a new one
+    isn't wanted.
+
+    Args:
+        filterfile (str) - Path of the filter being built.
+        enabled (bool) - Whether to build a store.
+
+    Returns:
+        DigestStoreWriter, or None if enabled is False.
+    """
+    if enabled:
+        return DigestStoreWriter(store_path(filterfile))
+    remove_store(filterfile)
+    return None
+
+
+def send_unknown(agent, method, *args):
+    """send_unknown() - Call one of an Agent's methods, reporting failures
+                        instead of stopping the scan. The agent spools or
+                        drops what it couldn't send and reconnects later by
+                        itself.
+
+    Args:
+        agent (Agent) - Agent sending to a collector.
+        method (str) - Name of the method, ex: "write".
+        *args - Arguments to the method.
+
+    Returns:
+        Nothing.
+    """
+    try:
+        getattr(agent, method)(*args)
+    except (OSError, ValueError) as exc:
+        sys.stderr.write("[-] Unable to send to collector %s:%d: %s\n"
+                         % (agent.address[0], agent.address[1], exc))
+
+
+def finish_agent(agent, status):
+    """finish_agent() - Disconnect an agent and report what it sent, and
+                        what never reached the collector.
+
+    Args:
+        agent (Agent) - Agent sending to a collector.
+        status (file) - Where progress messages go.
+
+    Returns:
+        True if every unknown file reached the collector.
+    """
+    send_unknown(agent, "close")
+    print("[+] Sent %d unknown files to the collector, %d new to it"
+          % (agent.sent, agent.new), file=status)
+    if agent.spooled:
+        sys.stderr.write("[-] %d unknown files the collector didn't receive "
+                         "are spooled in %s\n" % (agent.spooled, agent.spool))
+    if agent.dropped:
+        sys.stderr.write("[-] Dropped %d unknown files the collector didn't "
+                         "receive\n" % agent.dropped)
+    return not agent.spooled and not agent.dropped
+
+
 def main():
 
     try:
-        command = sys.argv[1]
+        options, argv = parse_options(sys.argv[1:], OPTIONS)
+    except ValueError as exc:
+        sys.stderr.write("[-] %s\n" % exc)
+        usage(sys.argv[0])
+    if options["profile"]:
+        try:
+            options = apply_profile(options, options["profile"])
+        except ValueError as exc:
+            sys.stderr.write("[-] %s\n" % exc)
+            usage(sys.argv[0])
+    argv = sys.argv[:1] + argv
+
+    try:
+        command = argv[1]
         if command == "filters":
-            filter_command = sys.argv[2]
-            if len(sys.argv) > 3:
-                target = sys.argv[3]
+            filter_command = argv[2]
+            if len(argv) > 3:
+                target = argv[3]
             else:
                 target = None
+            filter_args = argv[3:]
         else:
-            filterfile = sys.argv[2]
-            files = sys.argv[3:]
+            filterfile = argv[2]
+            files = argv[3:]
     except IndexError:
         usage(sys.argv[0])
 
-    if sys.argv[1] not in ["calculate", "lookup", "fromfile", "filters"]:
+    if argv[1] not in ["calculate", "lookup", "lookup-hashes", "identify",
+                       "stats", "fromfile", "update-baseline", "watch",
+                       "collect", "filters"]:
+        usage(sys.argv[0])
+    if argv[1] not in ["filters", "stats"] and not files:
         usage(sys.argv[0])
-    if sys.argv[1] != "filters" and not files:
+    if options["compress"] not in compressions() + ["auto", None]:
+        usage(sys.argv[0])
+    if options["format"] not in FORMATS + [None]:
+        usage(sys.argv[0])
+    output_format = options["format"] or "text"
+    try:
+        jobs = int(options["jobs"] or 1)
+        samples = int(options["samples"] or MAX_SAMPLES)
+        hashcount = int(options["hashes"]) if options["hashes"] else None
+        debounce = float(options["debounce"] or DEBOUNCE)
+        interval = float(options["interval"] or POLL_INTERVAL)
+        rules = WalkRules(
+            options["exclude"], options["include"],
+            parse_size(options["min-size"])
+            if options["min-size"] is not None else None,
+            parse_size(options["max-size"])
+            if options["max-size"] is not None else None,
+            options["type"], options["one-file-system"])
+        memo = make_memo(options["memo"])
+    except ValueError:
+        usage(sys.argv[0])
+    policy = options["optimize"] or "memory"
+    if policy not in POLICIES or (hashcount is not None and hashcount < 1):
+        usage(sys.argv[0])
+    if debounce < 0 or interval <= 0:
+        usage(sys.argv[0])
+    order = options["order"] or "walk"
+    if order not in ORDERS:
         usage(sys.argv[0])
 
+    impact = None
+    if options["low-impact"] or options["direct"] or options["max-rate"] or \
+       options["max-files"]:
+        try:
+            max_rate = parse_size(options["max-rate"] or 0)
+            max_files = float(options["max-files"] or 0)
+        except ValueError:
+            usage(sys.argv[0])
+        if max_files < 0:
+            usage(sys.argv[0])
+        impact = LowImpact(options["low-impact"], options["direct"],
+                           max_rate, max_files)
+    if options["low-impact"]:
+        lower_priority()
+
+    stats = None
+    if options["stats"] or options["stats-file"]:
+        stats = ScanStats()
+
+    cache = None
+    if options["cache"]:
+        cache = HashCache(options["cache"])
+        cache.load()
+
+    if options["output"]:
+        outfile = open(options["output"], "wb")
+    else:
+        outfile = sys.stdout.buffer
+    # Keep progress messages out of machine readable results.
+    status = sys.stdout
+    if output_format != "text" and outfile is sys.stdout.buffer:
+        status = sys.stderr
+
+    agent = None
+    # Set when unknown files didn't reach the collector, to exit non-zero.
+    undelivered = False
+    if options["collector"]:
+        if command not in ["lookup", "watch"]:
+            usage(sys.argv[0])
+        try:
+            address = parse_address(options["collector"])
+        except ValueError:
+            usage(sys.argv[0])
+        agent = Agent(address, unique=options["unique"],
+                      spool=options["spool"])
+        try:
+            agent.connect()
+        except (OSError, ValueError) as exc:
+            sys.stderr.write("[-] Unable to connect to collector %s: %s\n"
+                             % (options["collector"], exc))
+            exit(os.EX_UNAVAILABLE)
+
     if command == "lookup":
+        if not readable_file(filterfile) and not os.path.isdir(filterfile):
+            message = "[-] Unable to open %s for reading\n" % filterfile
+            sys.stdout.write(message)
+            usage(sys.argv[0])
+
+        bank = FilterBank()
+        bank.load(filterfile, options["mmap"], options["low-memory"])
+
+        writer = ResultWriter(outfile, output_format, options["only-misses"],
+                              stats)
+        scanner = Scanner(files, bank, jobs, cache, stats=stats,
+                          archives=options["archives"], rules=rules,
+                          order=order, impact=impact, memo=memo)
+        for result in scanner.scan():
+            writer.write(result)
+            if agent is not None:
+                send_unknown(agent, "write", result)
+        writer.flush()
+        if agent is not None:
+            undelivered = not finish_agent(agent, status)
+
+    if command == "identify":
+        if not readable_file(filterfile) and not os.path.isdir(filterfile):
+            message = "[-] Unable to open %s for reading\n" % filterfile
+            sys.stdout.write(message)
+            usage(sys.argv[0])
+
+        bank = FilterBank()
+        bank.load(filterfile, options["mmap"], options["low-memory"])
+        identifier = Identifier(bank.filters)
+        scanner = SampledScanner(files, bank, jobs, cache, stats=stats,
+                                 rules=rules, memo=memo, limit=samples)
+        separated = identifier.consume(scanner.scan(), samples)
+        print("[+] Sampled %d of %d files%s"
+              % (identifier.samples, scanner.total,
+                 ", best match found" if separated else ""), file=status)
+        status.flush()
+        outfile.write(identifier.format_text(IDENTIFY_ROWS).encode())
+
+    if command == "watch":
+        if not readable_file(filterfile) and not os.path.isdir(filterfile):
+            message = "[-] Unable to open %s for reading\n" % filterfile
+            sys.stdout.write(message)
+            usage(sys.argv[0])
+
+        bank = FilterBank()
+        bank.load(filterfile, options["mmap"], options["low-memory"])
+
+        writer = ResultWriter(outfile, output_format, options["only-misses"],
+                              stats)
+        scanner = Scanner([], bank, jobs, cache, stats=stats,
+                          archives=options["archives"], rules=rules,
+                          order=order, impact=impact, memo=memo)
+        watcher = Watcher(files, debounce, interval, scanner.excluded)
+        watcher.start()
+        print("[+] Watching %d directories, polling %d"
+              % (len(watcher.watched), len(watcher.polled)), file=status)
+        status.flush()
+        try:
+            while True:
+                scanner.roots = watcher.wait()
+                for result in scanner.scan():
+                    writer.write(result)
+                    if agent is not None:
+                        send_unknown(agent, "write", result)
+                # Results are written as each batch of changes is checked.
+                writer.flush()
+                if agent is not None:
+                    send_unknown(agent, "flush")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+            if agent is not None:
+                undelivered = not finish_agent(agent, status)
+
+    if command == "collect":
+        try:
+            address = parse_address(files[0], "")
+            fp_rate = float(options["fp-rate"] or SEEN_FP_RATE)
+        except ValueError:
+            usage(sys.argv[0])
+        if len(files) != 1 or not 0 < fp_rate < 1:
+            usage(sys.argv[0])
+
+        collector = Collector(filterfile, fp_rate=fp_rate, log=status)
+        try:
+            collector.open()
+            server = CollectorServer(address, collector)
+        except OSError as exc:
+            sys.stderr.write("[-] Unable to collect in %s on %s: %s\n"
+                             % (filterfile, files[0], exc))
+            collector.close()
+            exit(os.EX_CANTCREAT)
+        print("[+] Collecting unknown files in %s on port %d"
+              % (filterfile, server.server_address[1]), file=status)
+        status.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            collector.close()
+        print("[+] %d hosts reported, %d new unknown files"
+              % (len(collector.reports), collector.new), file=status)
+
+    if command == "stats":
+        if files or (not readable_file(filterfile) and
+                     not os.path.isdir(filterfile)):
+            usage(sys.argv[0])
+        print_stats(filterfile)
+
+    if command == "lookup-hashes":
         if not readable_file(filterfile):
             message = "[-] Unable to open %s for reading\n" % filterfile
             sys.stdout.write(message)
             usage(sys.argv[0])
 
-        bloomfilter = BloomFilter(1, 0.01)
-        bloomfilter.load(filterfile)
+        bloomfilter = FilterBank.open_filter(filterfile, options["mmap"],
+                                             options["low-memory"])
 
-        for item in files:
-            lookup_hashes(item, bloomfilter)
+        # Text output of digests without paths is only useful for misses.
+        writer = ResultWriter(outfile, output_format,
+                              options["only-misses"] or
+                              output_format == "text")
+        checked, misses = lookup_digests(files, bloomfilter, writer)
+        sys.stderr.write("[+] Checked %d digests, %d not in filter\n"
+                         % (checked, misses))
 
     if command == "calculate":
         if not writeable_file(filterfile):
@@ -405,24 +1281,59 @@ def main():
             sys.stdout.write(message)
             usage(sys.argv[0])
 
-        print("[+] Counting files. This may take a while")
+        scanner = Scanner(files, None, jobs, cache, stats=stats,
+                          archives=options["archives"], rules=rules,
+                          order=order, impact=impact)
+        store = digest_writer(filterfile, options["digests"])
+        # The filter is sized once the scan is done, from the digests kept
+        # here, so files aren't walked twice and archives aren't read again
+        # to count their members.
+        pending = tempfile.TemporaryFile(
+            dir=os.path.dirname(os.path.abspath(filterfile)))
+
+        print("[+] Calculating hashes.", file=status)
+        status.flush()
         size = 0
-        for item in files:
-            size += count_files(item)
-        print("    Counted %d files." % size)
-
-        bloomfilter = BloomFilter(size, 0.01)
-
-        print("[+] Calculating hashes.")
-        for item in files:
-            calculate_hashes(item, bloomfilter)
+        writer = ResultWriter(outfile, output_format, stats=stats)
+        for result in scanner.scan():
+            if result.digest:
+                pending.write(bytes.fromhex(result.digest))
+                size += 1
+                if store is not None:
+                    store.add(result.digest)
+            writer.write(result)
+        writer.flush()
+        print("    Hashed %d files." % size, file=status)
+
+        bloomfilter = BloomFilter(max(size, 1), 0.01,
+                                  filterfile if options["mmap"] else None,
+                                  policy, hashcount)
+        pending.seek(0)
+        while True:
+            data = pending.read(BATCH_SIZE * DIGEST_SIZE)
+            if not data:
+                break
+            batch = [data[start:start + DIGEST_SIZE].hex()
+                     for start in range(0, len(data), DIGEST_SIZE)]
+            if stats is None:
+                bloomfilter.add_many(batch)
+                continue
+            wall, cpu = time.perf_counter(), cpu_time()
+            bloomfilter.add_many(batch)
+            stats.add("add", time.perf_counter() - wall, cpu_time() - cpu,
+                      len(batch))
+        pending.close()
 
         print(
             "[+] Saving %s filter to outfile: %s"
-            % (bloomfilter.bytesize_human, filterfile)
+            % (bloomfilter.bytesize_human, filterfile), file=status
         )
-        bloomfilter.save(filterfile)
-        print("[+] Done.")
+        bloomfilter.save(filterfile, options["compress"])
+        bloomfilter.close()
+        if store is not None:
+            print("[+] Saving %d digests to %s"
+                  % (store.close(), store.path), file=status)
+        print("[+] Done.", file=status)
 
     if command == "fromfile":
         if not writeable_file(filterfile):
@@ -434,37 +1345,74 @@ def main():
         count = 0
         for hashfile in files:
             print(hashfile)
-            with open(hashfile, "r") as hashlist:
-                for line in hashlist:
-                    # skip comments and lines containing invalid hashes
-                    if line.startswith("#") or not is_md5(line.rstrip()):
-                        # print("invalid hash: ", line.rstrip())
-                        continue
-                    count += 1
+            # skip comments and lines containing invalid hashes
+            count += sum(len(batch)
+                         for batch in read_digest_batches([hashfile]))
 
         print("    Counted %d files." % count)
 
-        bloomfilter = BloomFilter(count, 0.01)
+        bloomfilter = BloomFilter(count, 0.01,
+                                  filterfile if options["mmap"] else None,
+                                  policy, hashcount)
+        store = digest_writer(filterfile, options["digests"])
 
         print("[+] Adding hashes from %s" % files)
         # TODO make sure i can open these files
-        for hashfile in files:
-            with open(hashfile, "r") as hashlist:
-                for line in hashlist:
-                    # skip comments and invalid hashes
-                    if line.startswith("#") or not is_md5(line.rstrip()):
-                        continue
-                    bloomfilter.add(line.rstrip().lower())
+        for batch in read_digest_batches(files):
+            bloomfilter.add_many(batch)
+            if store is not None:
+                store.add_many(batch)
         print(
             "[+] Saving %s filter to outfile: %s"
             % (bloomfilter.bytesize_human, filterfile)
         )
-        bloomfilter.save(filterfile)
+        bloomfilter.save(filterfile, options["compress"])
+        bloomfilter.close()
+        if store is not None:
+            print("[+] Saving %d digests to %s" % (store.close(), store.path))
         print("[+] Done.")
 
+    if command == "update-baseline":
+        # writeable_file() would truncate an existing baseline.
+        if os.path.exists(filterfile) and not os.access(filterfile, os.W_OK):
+            message = "[-] Unable to open %s for writing\n" % filterfile
+            sys.stdout.write(message)
+            usage(sys.argv[0])
+
+        try:
+            baseline = Baseline(filterfile)
+        except ValueError as exc:
+            sys.stderr.write("[-] %s\n" % exc)
+            exit(os.EX_DATAERR)
+        roots = sorted(set(read_paths(files)))
+        print("[+] Rehashing %d changed paths" % len(roots), file=status)
+        scanner = Scanner(roots, None, jobs, cache, stats=stats,
+                          rules=rules, order=order, impact=impact)
+        baseline.update(roots, scanner.scan(), 0.01, policy, hashcount)
+        baseline.save()
+        print("[+] Added %d, removed %d, unchanged %d. Baseline holds %d "
+              "digests" % (baseline.added, baseline.removed,
+                           baseline.unchanged, baseline.filter.count),
+              file=status)
+        if baseline.errors:
+            print("[-] %d old digests weren't in the baseline"
+                  % baseline.errors, file=status)
+        if baseline.filter.count > baseline.filter.capacity:
+            print("[-] Baseline is over its capacity of %d, rebuild it to "
+                  "keep its false positive rate" % baseline.filter.capacity,
+                  file=status)
+        if options["export"]:
+            bloomfilter = baseline.filter.to_bloomfilter()
+            bloomfilter.save(options["export"], options["compress"])
+            remove_store(options["export"])
+            print("[+] Exported %s filter to %s"
+                  % (bloomfilter.bytesize_human, options["export"]),
+                  file=status)
+
     if command == "filters":
         config = get_config()
-        if filter_command not in ["fetch", "list", "update"]:
+        if filter_command not in ["fetch", "list", "update", "delta",
+                                  "union"]:
             usage(sys.argv[0])
         if filter_command == "fetch":
             if not target:
@@ -480,3 +1428,32 @@ def main():
                 list_remote(target)
         if filter_command == "update":
             update_filters()
+        if filter_command == "delta":
+            if len(filter_args) != 3:
+                usage(sys.argv[0])
+            write_delta(*filter_args)
+        if filter_command == "union":
+            if len(filter_args) > 1:
+                usage(sys.argv[0])
+            try:
+                fp_rate = float(options["fp-rate"] or 0.01)
+            except ValueError:
+                usage(sys.argv[0])
+            if not 0 < fp_rate < 1:
+                usage(sys.argv[0])
+            write_union(target or os.path.join(os.path.dirname(__file__),
+                                               "filters"),
+                        fp_rate, policy, hashcount)
+
+    if cache is not None:
+        cache.save()
+    if stats is not None:
+        stats.stop()
+        if options["stats"]:
+            sys.stderr.write(stats.format_text())
+        if options["stats-file"]:
+            stats.export(options["stats-file"])
+    if outfile is not sys.stdout.buffer:
+        outfile.close()
+    if undelivered:
+        exit(os.EX_TEMPFAIL)
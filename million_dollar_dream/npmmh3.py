@@ -0,0 +1,240 @@
+"""
+Vectorized murmur3 hashes using NumPy.
+
+pymmh3 hashes one key at a time in pure Python. When the mmh3 C extension
+isn't available, hashing a whole batch of keys at once with NumPy array
+arithmetic is orders of magnitude faster. Every key in a batch goes through
+the same rounds, with one array element per key. Keys of different lengths
+are grouped and hashed separately.
+
+The results are bit-for-bit identical to mmh3.hash() and mmh3.hash128(), so
+filters built with either can be used with the other.
+
+Raises ImportError on import if NumPy isn't installed.
+"""
+
+import numpy as np
+
+
+def as_bytes(key):
+    """as_bytes() - Encode a key the same way mmh3 does."""
+    if isinstance(key, str):
+        return key.encode("utf-8")
+    return bytes(key)
+
+
+def group_by_length(keys):
+    """group_by_length() - Pack keys into one 2-D uint8 array per key length.
+
+    Args:
+        keys (list) - Keys to hash.
+
+    Returns:
+        list of (indices (list or slice), keys (ndarray of shape
+        (n, length)))
+    """
+    keys = [as_bytes(key) for key in keys]
+    lengths = set(map(len, keys))
+    if len(lengths) == 1:
+        # Common case, ex: a batch of hex digests.
+        length = lengths.pop()
+        data = np.frombuffer(b"".join(keys), dtype=np.uint8)
+        return [(slice(None), data.reshape(len(keys), length))]
+
+    groups = dict()
+    for index, key in enumerate(keys):
+        group = groups.setdefault(len(key), ([], []))
+        group[0].append(index)
+        group[1].append(key)
+    packed = []
+    for length, (indices, members) in groups.items():
+        data = np.frombuffer(b"".join(members), dtype=np.uint8)
+        packed.append((indices, data.reshape(len(members), length)))
+    return packed
+
+
+def words(data, start, stop, dtype):
+    """words() - View columns start:stop of packed keys as little endian
+                 words, zero padding the last word.
+
+    Args:
+        data (ndarray) - Keys from group_by_length().
+        start (int) - First byte column.
+        stop (int) - Byte column to stop at.
+        dtype (numpy.dtype) - np.uint32 or np.uint64.
+
+    Returns:
+        ndarray of shape (n, words) with the native dtype.
+    """
+    width = np.dtype(dtype).itemsize
+    columns = data[:, start:stop]
+    padding = -columns.shape[1] % width
+    if padding:
+        columns = np.concatenate(
+            [columns, np.zeros((columns.shape[0], padding), np.uint8)],
+            axis=1)
+    little = np.dtype(dtype).newbyteorder("<")
+    return np.ascontiguousarray(columns).view(little).astype(dtype)
+
+
+def rotl32(value, shift):
+    return (value << np.uint32(shift)) | (value >> np.uint32(32 - shift))
+
+
+def rotl64(value, shift):
+    return (value << np.uint64(shift)) | (value >> np.uint64(64 - shift))
+
+
+def fmix32(h):
+    h ^= h >> np.uint32(16)
+    h *= np.uint32(0x85ebca6b)
+    h ^= h >> np.uint32(13)
+    h *= np.uint32(0xc2b2ae35)
+    h ^= h >> np.uint32(16)
+    return h
+
+
+def fmix64(k):
+    k ^= k >> np.uint64(33)
+    k *= np.uint64(0xff51afd7ed558ccd)
+    k ^= k >> np.uint64(33)
+    k *= np.uint64(0xc4ceb9fe1a85ec53)
+    k ^= k >> np.uint64(33)
+    return k
+
+
+def hash32_packed(data, seed):
+    """hash32_packed() - murmur3 x86_32 of equal length keys.
+
+    Args:
+        data (ndarray) - uint8 array of shape (n, length).
+        seed (int) - Hash seed.
+
+    Returns:
+        ndarray of n uint32 hashes.
+    """
+    c1 = np.uint32(0xcc9e2d51)
+    c2 = np.uint32(0x1b873593)
+    count, length = data.shape
+    nblocks = length // 4
+
+    h1 = np.full(count, seed & 0xFFFFFFFF, dtype=np.uint32)
+    blocks = words(data, 0, nblocks * 4, np.uint32)
+    for block in range(nblocks):
+        k1 = blocks[:, block] * c1
+        k1 = rotl32(k1, 15) * c2
+        h1 ^= k1
+        h1 = rotl32(h1, 13) * np.uint32(5) + np.uint32(0xe6546b64)
+
+    if length & 3:
+        k1 = words(data, nblocks * 4, length, np.uint32)[:, 0] * c1
+        h1 ^= rotl32(k1, 15) * c2
+
+    h1 ^= np.uint32(length & 0xFFFFFFFF)
+    return fmix32(h1)
+
+
+def hash128_packed(data, seed):
+    """hash128_packed() - murmur3 x64_128 of equal length keys.
+
+    Args:
+        data (ndarray) - uint8 array of shape (n, length).
+        seed (int) - Hash seed.
+
+    Returns:
+        tuple of (h1, h2) uint64 arrays. The 128 bit hash is h2 << 64 | h1.
+    """
+    c1 = np.uint64(0x87c37b91114253d5)
+    c2 = np.uint64(0x4cf5ad432745937f)
+    count, length = data.shape
+    nblocks = length // 16
+
+    h1 = np.full(count, seed & 0xFFFFFFFF, dtype=np.uint64)
+    h2 = h1.copy()
+    blocks = words(data, 0, nblocks * 16, np.uint64)
+    for block in range(nblocks):
+        k1 = blocks[:, block * 2] * c1
+        k1 = rotl64(k1, 31) * c2
+        h1 ^= k1
+        h1 = rotl64(h1, 27) + h2
+        h1 = h1 * np.uint64(5) + np.uint64(0x52dce729)
+
+        k2 = blocks[:, block * 2 + 1] * c2
+        k2 = rotl64(k2, 33) * c1
+        h2 ^= k2
+        h2 = rotl64(h2, 31) + h1
+        h2 = h2 * np.uint64(5) + np.uint64(0x38495ab5)
+
+    tail_size = length & 15
+    if tail_size:
+        tail = words(data, nblocks * 16, length, np.uint64)
+        if tail_size > 8:
+            k2 = tail[:, 1] * c2
+            h2 ^= rotl64(k2, 33) * c1
+        k1 = tail[:, 0] * c1
+        h1 ^= rotl64(k1, 31) * c2
+
+    h1 ^= np.uint64(length)
+    h2 ^= np.uint64(length)
+    h1 += h2
+    h2 += h1
+    h1 = fmix64(h1)
+    h2 = fmix64(h2)
+    h1 += h2
+    h2 += h1
+    return h1, h2
+
+
+def hash_batch(keys, seed=0):
+    """hash_batch() - Vectorized equivalent of mmh3.hash().
+
+    Args:
+        keys (list) - Keys to hash, str or bytes.
+        seed (int) - Hash seed.
+
+    Returns:
+        ndarray of signed 32 bit hashes, one per key.
+    """
+    result = np.empty(len(keys), dtype=np.int32)
+    for indices, data in group_by_length(keys):
+        result[indices] = hash32_packed(data, seed).view(np.int32)
+    return result
+
+
+def hash128_batch(keys, seed=0):
+    """hash128_batch() - Vectorized equivalent of mmh3.hash128() (x64).
+
+    Args:
+        keys (list) - Keys to hash, str or bytes.
+        seed (int) - Hash seed.
+
+    Returns:
+        tuple of (low, high) uint64 arrays. Each key's 128 bit hash is
+        high << 64 | low.
+    """
+    low = np.empty(len(keys), dtype=np.uint64)
+    high = np.empty(len(keys), dtype=np.uint64)
+    for indices, data in group_by_length(keys):
+        low[indices], high[indices] = hash128_packed(data, seed)
+    return low, high
+
+
+def bloom_positions(keys, hashcount, size):
+    """bloom_positions() - Compute the bit positions BloomFilter uses for a
+                           batch of keys: mmh3.hash(key, seed) % size for
+                           each seed in range(hashcount).
+
+    Args:
+        keys (list) - Keys to hash, str or bytes.
+        hashcount (int) - Number of hashes per key.
+        size (int) - Size of the filter in bits.
+
+    Returns:
+        int64 ndarray of shape (len(keys), hashcount).
+    """
+    positions = np.empty((len(keys), hashcount), dtype=np.int64)
+    for indices, data in group_by_length(keys):
+        for seed in range(hashcount):
+            hashes = hash32_packed(data, seed).view(np.int32)
+            positions[indices, seed] = hashes.astype(np.int64) % size
+    return positions
@@ -0,0 +1,209 @@
+import csv
+import io
+import json
+import time
+from collections import namedtuple
+from itertools import compress
+from operator import not_
+
+from .instrument import cpu_time
+
+
+# Result of hashing or looking up a single file.
+#   path (str) - Path to the file, or None for digests read from hash lists.
+#   size (int) - Size of the file in bytes, or None if unknown.
+#   digest (str) - Hex digest of the file, or None if it couldn't be read.
+#   filters (list) - Names of the filters containing the digest. None when
+#                    the file was hashed but not looked up.
+Result = namedtuple("Result", ["path", "size", "digest", "filters"])
+
+FORMATS = ["text", "ndjson", "csv"]
+
+# Output is collected until it reaches this many characters, then written
+# with a single call.
+BUFFER_SIZE = 1024 * 1024
+
+
+class ResultWriter(object):
+    """ResultWriter class - Writes results in bulk in a chosen format.
+
+    Attributes:
+        outfile (file) - Binary file results are written to.
+        output_format (str) - One of FORMATS.
+        only_misses (bool) - Skip results found in a filter.
+        buffer (list) - Formatted lines waiting to be written.
+        buffered (int) - Number of characters in buffer.
+        stats (ScanStats) - Records time spent on output, or None.
+        csv_line (io.StringIO) - Reused by format_csv() for each row.
+        csv_writer (csv.writer) - Writes rows to csv_line.
+    """
+    def __init__(self, outfile, output_format="text", only_misses=False,
+                 stats=None):
+        if output_format not in FORMATS:
+            raise ValueError("unsupported format: %s" % output_format)
+        self.outfile = outfile
+        self.output_format = output_format
+        self.only_misses = only_misses
+        self.buffer = []
+        self.buffered = 0
+        self.stats = stats
+        self.csv_line = io.StringIO()
+        self.csv_writer = csv.writer(self.csv_line, lineterminator="\n")
+        if output_format == "csv":
+            self.buffer.append(self.format_csv(Result._fields))
+
+    def write(self, result):
+        """ResultWriter.write() - Queue a result for writing.
+
+        Args:
+            result (Result) - Result to write.
+
+        Returns:
+            Nothing.
+        """
+        if self.only_misses and result.filters:
+            return
+        if self.stats is None:
+            self.format(result)
+            return
+        wall, cpu = time.perf_counter(), cpu_time()
+        self.format(result)
+        self.stats.add("output", time.perf_counter() - wall, cpu_time() - cpu)
+
+    def write_digests(self, digests, found, name="filter"):
+        """ResultWriter.write_digests() - Queue the results of looking up a
+                                          batch of digests with no paths.
+
+        Writes the same lines as write() would for each Result(None, None,
+        digest, [name] or []), without building them.
+
+        Args:
+            digests (list) - Hex digests looked up.
+            found (list) - Whether each digest was in the filter, ex: from
+                           BloomFilter.lookup_many().
+            name (str) - Name of the filter reported for digests found.
+
+        Returns:
+            Nothing.
+        """
+        if self.stats is None:
+            self.format_digests(digests, found, name)
+            return
+        wall, cpu = time.perf_counter(), cpu_time()
+        self.format_digests(digests, found, name)
+        self.stats.add("output", time.perf_counter() - wall, cpu_time() - cpu,
+                       len(digests))
+
+    def format_digests(self, digests, found, name):
+        """ResultWriter.format_digests() - Format a batch of digest results
+                                           and add them to the buffer. See
+                                           write_digests().
+
+        Args:
+            digests (list) - Hex digests looked up.
+            found (list) - Whether each digest was in the filter.
+            name (str) - Name of the filter reported for digests found.
+
+        Returns:
+            Nothing.
+        """
+        if self.only_misses:
+            digests = list(compress(digests, map(not_, found)))
+            found = [False] * len(digests)
+        if not digests:
+            return
+        if self.output_format == "text":
+            lines = "\n".join(digests) + "\n"
+        else:
+            if self.output_format == "ndjson":
+                line = ('{"path": null, "size": null, "digest": "%s", '
+                        '"filters": ')
+                miss = line + '[]}\n'
+                hit = line + json.dumps([name]).replace("%", "%%") + '}\n'
+            else:
+                miss = ",,%s,\n"
+                hit = ",,%s," + self.format_csv(["", name])[1:].replace(
+                    "%", "%%")
+            lines = "".join([(hit if is_hit else miss) % digest
+                             for digest, is_hit in zip(digests, found)])
+        self.buffer.append(lines)
+        self.buffered += len(lines)
+        if self.buffered >= BUFFER_SIZE:
+            self.flush()
+
+    def format(self, result):
+        """ResultWriter.format() - Format a result and add it to the buffer,
+                                   writing the buffer out once it is full.
+
+        Args:
+            result (Result) - Result to write.
+
+        Returns:
+            Nothing.
+        """
+        if self.output_format == "ndjson":
+            line = json.dumps(result._asdict()) + "\n"
+        elif self.output_format == "csv":
+            filters = None
+            if result.filters is not None:
+                filters = " ".join(result.filters)
+            line = self.format_csv(
+                [result.path, result.size, result.digest, filters])
+        else:
+            line = self.format_text(result)
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.buffered >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """ResultWriter.flush() - Write out all queued results.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        if self.buffer:
+            data = "".join(self.buffer)
+            # Paths that aren't valid UTF-8 are written back out as the
+            # original bytes.
+            self.outfile.write(data.encode("utf-8", "surrogateescape"))
+            self.buffer = []
+            self.buffered = 0
+        self.outfile.flush()
+
+    @staticmethod
+    def format_text(result):
+        """ResultWriter.format_text() - Format a result for humans.
+
+        Args:
+            result (Result) - Result to format.
+
+        Returns:
+            str containing a line of output.
+        """
+        if result.path is None:
+            return result.digest + "\n"
+        if result.digest is None:
+            return "%s Permission Denied\n" % result.path
+        if result.filters is None:
+            return "   %s %s\n" % (result.path, result.digest)
+        if result.filters:
+            return "%s is in filter\n" % result.path
+        return "%s is not in filter\n" % result.path
+
+    def format_csv(self, row):
+        """ResultWriter.format_csv() - Format a row as CSV.
+
+        Args:
+            row (list) - Fields to format.
+
+        Returns:
+            str containing a line of CSV.
+        """
+        self.csv_line.seek(0)
+        self.csv_line.truncate()
+        self.csv_writer.writerow(row)
+        return self.csv_line.getvalue()
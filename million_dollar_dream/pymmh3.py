@@ -17,6 +17,7 @@ This module is written to have the same format as mmh3 python package found here
 https://pypi.python.org/pypi/mmh3/2.3.1
 '''
 
+import struct
 import sys as _sys
 if (_sys.version_info > (3, 0)):
     def xrange( a, b, c ):
@@ -31,67 +32,110 @@ else:
         return x
 del _sys
 
+# Blocks are unpacked a whole key at a time rather than assembled byte by
+# byte. Unpackers are cached per key length, and built up front for the
+# lengths seen most: 16/20/32 byte digests and 32/40/64 character hex.
+_blocks32 = {}
+_blocks64 = {}
+
+def _unpacker( cache, words, code ):
+    ''' Returns a struct unpacking words little endian words of type code. '''
+    unpacker = cache.get( words )
+    if unpacker is None:
+        unpacker = struct.Struct( '<%d%s' % ( words, code ) )
+        cache[ words ] = unpacker
+    return unpacker
+
+for _length in ( 16, 20, 32, 40, 64 ):
+    _unpacker( _blocks32, _length // 4, 'I' )
+    _unpacker( _blocks64, _length // 16 * 2, 'Q' )
+del _length
+
+
+def _blocks( key ):
+    ''' Returns the whole blocks of key for the 32bit hash, followed by its
+    tail as one more block. The tail is 0 when there is none, which leaves
+    the hash unchanged. '''
+
+    length = len( key )
+    tail_size = length & 3
+    blocks = list( _unpacker( _blocks32, length // 4, 'I' ).unpack_from( key ) )
+    if tail_size:
+        blocks.append( int.from_bytes( key[ length - tail_size: ], 'little' ) )
+    else:
+        blocks.append( 0 )
+    return blocks
+
+
 def hash( key, seed = 0x0 ):
     ''' Implements 32bit murmur3 hash. '''
 
-    key = bytearray( xencode(key) )
+    key = xencode( key )
+    length = len( key )
+    blocks = _blocks( key )
+    tail = blocks.pop()
 
-    def fmix( h ):
-        h ^= h >> 16
-        h  = ( h * 0x85ebca6b ) & 0xFFFFFFFF
-        h ^= h >> 13
-        h  = ( h * 0xc2b2ae35 ) & 0xFFFFFFFF
-        h ^= h >> 16
-        return h
+    h1 = seed & 0xFFFFFFFF
 
-    length = len( key )
-    nblocks = int( length / 4 )
-
-    h1 = seed
-
-    c1 = 0xcc9e2d51
-    c2 = 0x1b873593
-
-    # body
-    for block_start in xrange( 0, nblocks * 4, 4 ):
-        # ??? big endian?
-        k1 = key[ block_start + 3 ] << 24 | \
-             key[ block_start + 2 ] << 16 | \
-             key[ block_start + 1 ] <<  8 | \
-             key[ block_start + 0 ]
-             
-        k1 = ( c1 * k1 ) & 0xFFFFFFFF
-        k1 = ( k1 << 15 | k1 >> 17 ) & 0xFFFFFFFF # inlined ROTL32
-        k1 = ( c2 * k1 ) & 0xFFFFFFFF
-        
-        h1 ^= k1
-        h1  = ( h1 << 13 | h1 >> 19 ) & 0xFFFFFFFF # inlined ROTL32
-        h1  = ( h1 * 5 + 0xe6546b64 ) & 0xFFFFFFFF
+    # body. Reducing mod 2**32 once per step is enough: the bits a shift
+    # pushes past bit 31 can't reach the low 32 bits of a sum or product.
+    for k1 in blocks:
+        k1  = ( k1 * 0xcc9e2d51 ) & 0xFFFFFFFF
+        h1 ^= ( ( k1 << 15 | k1 >> 17 ) * 0x1b873593 ) & 0xFFFFFFFF
+        h1  = ( ( h1 << 13 | h1 >> 19 ) * 5 + 0xe6546b64 ) & 0xFFFFFFFF
 
     # tail
-    tail_index = nblocks * 4
-    k1 = 0
-    tail_size = length & 3
-
-    if tail_size >= 3:
-        k1 ^= key[ tail_index + 2 ] << 16
-    if tail_size >= 2:
-        k1 ^= key[ tail_index + 1 ] << 8
-    if tail_size >= 1:
-        k1 ^= key[ tail_index + 0 ]
-    
-    if tail_size > 0:
-        k1  = ( k1 * c1 ) & 0xFFFFFFFF
-        k1  = ( k1 << 15 | k1 >> 17 ) & 0xFFFFFFFF # inlined ROTL32
-        k1  = ( k1 * c2 ) & 0xFFFFFFFF
-        h1 ^= k1
+    if tail:
+        tail = ( tail * 0xcc9e2d51 ) & 0xFFFFFFFF
+        h1 ^= ( ( tail << 15 | tail >> 17 ) * 0x1b873593 ) & 0xFFFFFFFF
 
     #finalization
-    unsigned_val = fmix( h1 ^ length )
-    if unsigned_val & 0x80000000 == 0:
-        return unsigned_val
-    else:
-        return -( (unsigned_val ^ 0xFFFFFFFF) + 1 )
+    h1 ^= length
+    h1 ^= h1 >> 16
+    h1  = ( h1 * 0x85ebca6b ) & 0xFFFFFFFF
+    h1 ^= h1 >> 13
+    h1  = ( h1 * 0xc2b2ae35 ) & 0xFFFFFFFF
+    h1 ^= h1 >> 16
+
+    if h1 & 0x80000000:
+        return h1 - 0x100000000
+    return h1
+
+
+def hash_seeds( key, seeds ):
+    ''' Implements 32bit murmur3 hash for several seeds at once. Returns a list.
+
+    Equivalent to [ hash( key, seed ) for seed in seeds ]. Mixing a block
+    doesn't depend on the seed, so the key is unpacked and its blocks mixed
+    only once. Bloom filters hash each key with seeds 0 to k - 1. '''
+
+    key = xencode( key )
+    length = len( key )
+
+    mixed = []
+    for k1 in _blocks( key ):
+        k1  = ( k1 * 0xcc9e2d51 ) & 0xFFFFFFFF
+        mixed.append( ( ( k1 << 15 | k1 >> 17 ) * 0x1b873593 ) & 0xFFFFFFFF )
+    tail = mixed.pop() ^ length
+
+    hashes = []
+    for seed in seeds:
+        h1 = seed & 0xFFFFFFFF
+        for k1 in mixed:
+            h1 ^= k1
+            h1  = ( ( h1 << 13 | h1 >> 19 ) * 5 + 0xe6546b64 ) & 0xFFFFFFFF
+
+        h1 ^= tail
+        h1 ^= h1 >> 16
+        h1  = ( h1 * 0x85ebca6b ) & 0xFFFFFFFF
+        h1 ^= h1 >> 13
+        h1  = ( h1 * 0xc2b2ae35 ) & 0xFFFFFFFF
+        h1 ^= h1 >> 16
+
+        if h1 & 0x80000000:
+            h1 -= 0x100000000
+        hashes.append( h1 )
+    return hashes
 
 
 def hash128( key, seed = 0x0, x64arch = True ):
@@ -108,7 +152,7 @@ def hash128( key, seed = 0x0, x64arch = True ):
             return k
 
         length = len( key )
-        nblocks = int( length / 16 )
+        nblocks = length // 16
 
         h1 = seed
         h2 = seed
@@ -117,93 +161,32 @@ def hash128( key, seed = 0x0, x64arch = True ):
         c2 = 0x4cf5ad432745937f
 
         #body
-        for block_start in xrange( 0, nblocks * 8, 8 ):
-            # ??? big endian?
-            k1 = key[ 2 * block_start + 7 ] << 56 | \
-                 key[ 2 * block_start + 6 ] << 48 | \
-                 key[ 2 * block_start + 5 ] << 40 | \
-                 key[ 2 * block_start + 4 ] << 32 | \
-                 key[ 2 * block_start + 3 ] << 24 | \
-                 key[ 2 * block_start + 2 ] << 16 | \
-                 key[ 2 * block_start + 1 ] <<  8 | \
-                 key[ 2 * block_start + 0 ]
-
-            k2 = key[ 2 * block_start + 15 ] << 56 | \
-                 key[ 2 * block_start + 14 ] << 48 | \
-                 key[ 2 * block_start + 13 ] << 40 | \
-                 key[ 2 * block_start + 12 ] << 32 | \
-                 key[ 2 * block_start + 11 ] << 24 | \
-                 key[ 2 * block_start + 10 ] << 16 | \
-                 key[ 2 * block_start + 9 ] <<  8 | \
-                 key[ 2 * block_start + 8 ]
+        blocks = _unpacker( _blocks64, nblocks * 2, 'Q' ).unpack_from( key )
+        for block_start in range( 0, nblocks * 2, 2 ):
+            k1 = blocks[ block_start ]
+            k2 = blocks[ block_start + 1 ]
 
             k1  = ( c1 * k1 ) & 0xFFFFFFFFFFFFFFFF
-            k1  = ( k1 << 31 | k1 >> 33 ) & 0xFFFFFFFFFFFFFFFF # inlined ROTL64
-            k1  = ( c2 * k1 ) & 0xFFFFFFFFFFFFFFFF
-            h1 ^= k1
-
-            h1 = ( h1 << 27 | h1 >> 37 ) & 0xFFFFFFFFFFFFFFFF # inlined ROTL64
-            h1 = ( h1 + h2 ) & 0xFFFFFFFFFFFFFFFF
-            h1 = ( h1 * 5 + 0x52dce729 ) & 0xFFFFFFFFFFFFFFFF
+            h1 ^= ( ( k1 << 31 | k1 >> 33 ) * c2 ) & 0xFFFFFFFFFFFFFFFF
+            h1  = ( ( ( h1 << 27 | h1 >> 37 ) + h2 ) * 5 + 0x52dce729 ) & 0xFFFFFFFFFFFFFFFF
 
             k2  = ( c2 * k2 ) & 0xFFFFFFFFFFFFFFFF
-            k2  = ( k2 << 33 | k2 >> 31 ) & 0xFFFFFFFFFFFFFFFF # inlined ROTL64
-            k2  = ( c1 * k2 ) & 0xFFFFFFFFFFFFFFFF
-            h2 ^= k2
-
-            h2 = ( h2 << 31 | h2 >> 33 ) & 0xFFFFFFFFFFFFFFFF # inlined ROTL64
-            h2 = ( h1 + h2 ) & 0xFFFFFFFFFFFFFFFF
-            h2 = ( h2 * 5 + 0x38495ab5 ) & 0xFFFFFFFFFFFFFFFF
+            h2 ^= ( ( k2 << 33 | k2 >> 31 ) * c1 ) & 0xFFFFFFFFFFFFFFFF
+            h2  = ( ( ( h2 << 31 | h2 >> 33 ) + h1 ) * 5 + 0x38495ab5 ) & 0xFFFFFFFFFFFFFFFF
 
         #tail
         tail_index = nblocks * 16
-        k1 = 0
-        k2 = 0
         tail_size = length & 15
 
-        if tail_size >= 15:
-            k2 ^= key[ tail_index + 14 ] << 48
-        if tail_size >= 14:
-            k2 ^= key[ tail_index + 13 ] << 40
-        if tail_size >= 13:
-            k2 ^= key[ tail_index + 12 ] << 32
-        if tail_size >= 12:
-            k2 ^= key[ tail_index + 11 ] << 24
-        if tail_size >= 11:
-            k2 ^= key[ tail_index + 10 ] << 16
-        if tail_size >= 10:
-            k2 ^= key[ tail_index +  9 ] << 8
-        if tail_size >=  9:
-            k2 ^= key[ tail_index +  8 ]
-
         if tail_size > 8:
+            k2  = int.from_bytes( key[ tail_index + 8:length ], 'little' )
             k2  = ( k2 * c2 ) & 0xFFFFFFFFFFFFFFFF
-            k2  = ( k2 << 33 | k2 >> 31 ) & 0xFFFFFFFFFFFFFFFF # inlined ROTL64
-            k2  = ( k2 * c1 ) & 0xFFFFFFFFFFFFFFFF
-            h2 ^= k2
-
-        if tail_size >=  8:
-            k1 ^= key[ tail_index +  7 ] << 56
-        if tail_size >=  7:
-            k1 ^= key[ tail_index +  6 ] << 48
-        if tail_size >=  6:
-            k1 ^= key[ tail_index +  5 ] << 40
-        if tail_size >=  5:
-            k1 ^= key[ tail_index +  4 ] << 32
-        if tail_size >=  4:
-            k1 ^= key[ tail_index +  3 ] << 24
-        if tail_size >=  3:
-            k1 ^= key[ tail_index +  2 ] << 16
-        if tail_size >=  2:
-            k1 ^= key[ tail_index +  1 ] << 8
-        if tail_size >=  1:
-            k1 ^= key[ tail_index +  0 ]
+            h2 ^= ( ( k2 << 33 | k2 >> 31 ) * c1 ) & 0xFFFFFFFFFFFFFFFF
 
         if tail_size > 0:
+            k1  = int.from_bytes( key[ tail_index:tail_index + 8 ], 'little' )
             k1  = ( k1 * c1 ) & 0xFFFFFFFFFFFFFFFF
-            k1  = ( k1 << 31 | k1 >> 33 ) & 0xFFFFFFFFFFFFFFFF # inlined ROTL64
-            k1  = ( k1 * c2 ) & 0xFFFFFFFFFFFFFFFF
-            h1 ^= k1
+            h1 ^= ( ( k1 << 31 | k1 >> 33 ) * c2 ) & 0xFFFFFFFFFFFFFFFF
 
         #finalization
         h1 ^= length
@@ -232,7 +215,7 @@ def hash128( key, seed = 0x0, x64arch = True ):
             return h
 
         length = len( key )
-        nblocks = int( length / 16 )
+        nblocks = length // 16
 
         h1 = seed
         h2 = seed
@@ -245,128 +228,52 @@ def hash128( key, seed = 0x0, x64arch = True ):
         c4 = 0xa1e38b93
 
         #body
-        for block_start in xrange( 0, nblocks * 16, 16 ):
-            k1 = key[ block_start +  3 ] << 24 | \
-                 key[ block_start +  2 ] << 16 | \
-                 key[ block_start +  1 ] <<  8 | \
-                 key[ block_start +  0 ]
-
-            k2 = key[ block_start +  7 ] << 24 | \
-                 key[ block_start +  6 ] << 16 | \
-                 key[ block_start +  5 ] <<  8 | \
-                 key[ block_start +  4 ]
-
-            k3 = key[ block_start + 11 ] << 24 | \
-                 key[ block_start + 10 ] << 16 | \
-                 key[ block_start +  9 ] <<  8 | \
-                 key[ block_start +  8 ]
-
-            k4 = key[ block_start + 15 ] << 24 | \
-                 key[ block_start + 14 ] << 16 | \
-                 key[ block_start + 13 ] <<  8 | \
-                 key[ block_start + 12 ]
+        blocks = _unpacker( _blocks32, nblocks * 4, 'I' ).unpack_from( key )
+        for block_start in range( 0, nblocks * 4, 4 ):
+            k1 = blocks[ block_start ]
+            k2 = blocks[ block_start + 1 ]
+            k3 = blocks[ block_start + 2 ]
+            k4 = blocks[ block_start + 3 ]
 
             k1  = ( c1 * k1 ) & 0xFFFFFFFF
-            k1  = ( k1 << 15 | k1 >> 17 ) & 0xFFFFFFFF # inlined ROTL32
-            k1  = ( c2 * k1 ) & 0xFFFFFFFF
-            h1 ^= k1
-
-            h1 = ( h1 << 19 | h1 >> 13 ) & 0xFFFFFFFF # inlined ROTL32
-            h1 = ( h1 + h2 ) & 0xFFFFFFFF
-            h1 = ( h1 * 5 + 0x561ccd1b ) & 0xFFFFFFFF
+            h1 ^= ( ( k1 << 15 | k1 >> 17 ) * c2 ) & 0xFFFFFFFF
+            h1  = ( ( ( h1 << 19 | h1 >> 13 ) + h2 ) * 5 + 0x561ccd1b ) & 0xFFFFFFFF
 
             k2  = ( c2 * k2 ) & 0xFFFFFFFF
-            k2  = ( k2 << 16 | k2 >> 16 ) & 0xFFFFFFFF # inlined ROTL32
-            k2  = ( c3 * k2 ) & 0xFFFFFFFF
-            h2 ^= k2
-
-            h2 = ( h2 << 17 | h2 >> 15 ) & 0xFFFFFFFF # inlined ROTL32
-            h2 = ( h2 + h3 ) & 0xFFFFFFFF
-            h2 = ( h2 * 5 + 0x0bcaa747 ) & 0xFFFFFFFF
+            h2 ^= ( ( k2 << 16 | k2 >> 16 ) * c3 ) & 0xFFFFFFFF
+            h2  = ( ( ( h2 << 17 | h2 >> 15 ) + h3 ) * 5 + 0x0bcaa747 ) & 0xFFFFFFFF
 
             k3  = ( c3 * k3 ) & 0xFFFFFFFF
-            k3  = ( k3 << 17 | k3 >> 15 ) & 0xFFFFFFFF # inlined ROTL32
-            k3  = ( c4 * k3 ) & 0xFFFFFFFF
-            h3 ^= k3
-
-            h3 = ( h3 << 15 | h3 >> 17 ) & 0xFFFFFFFF # inlined ROTL32
-            h3 = ( h3 + h4 ) & 0xFFFFFFFF
-            h3 = ( h3 * 5 + 0x96cd1c35 ) & 0xFFFFFFFF
+            h3 ^= ( ( k3 << 17 | k3 >> 15 ) * c4 ) & 0xFFFFFFFF
+            h3  = ( ( ( h3 << 15 | h3 >> 17 ) + h4 ) * 5 + 0x96cd1c35 ) & 0xFFFFFFFF
 
             k4  = ( c4 * k4 ) & 0xFFFFFFFF
-            k4  = ( k4 << 18 | k4 >> 14 ) & 0xFFFFFFFF # inlined ROTL32
-            k4  = ( c1 * k4 ) & 0xFFFFFFFF
-            h4 ^= k4
-
-            h4 = ( h4 << 13 | h4 >> 19 ) & 0xFFFFFFFF # inlined ROTL32
-            h4 = ( h1 + h4 ) & 0xFFFFFFFF
-            h4 = ( h4 * 5 + 0x32ac3b17 ) & 0xFFFFFFFF
+            h4 ^= ( ( k4 << 18 | k4 >> 14 ) * c1 ) & 0xFFFFFFFF
+            h4  = ( ( ( h4 << 13 | h4 >> 19 ) + h1 ) * 5 + 0x32ac3b17 ) & 0xFFFFFFFF
 
         #tail
         tail_index = nblocks * 16
-        k1 = 0
-        k2 = 0
-        k3 = 0
-        k4 = 0
         tail_size = length & 15
 
-        if tail_size >= 15:
-            k4 ^= key[ tail_index + 14 ] << 16
-        if tail_size >= 14:
-            k4 ^= key[ tail_index + 13 ] << 8
-        if tail_size >= 13:
-            k4 ^= key[ tail_index + 12 ]
-
         if tail_size > 12:
+            k4  = int.from_bytes( key[ tail_index + 12:length ], 'little' )
             k4  = ( k4 * c4 ) & 0xFFFFFFFF
-            k4  = ( k4 << 18 | k4 >> 14 ) & 0xFFFFFFFF # inlined ROTL32
-            k4  = ( k4 * c1 ) & 0xFFFFFFFF
-            h4 ^= k4
-
-        if tail_size >= 12:
-            k3 ^= key[ tail_index + 11 ] << 24
-        if tail_size >= 11:
-            k3 ^= key[ tail_index + 10 ] << 16
-        if tail_size >= 10:
-            k3 ^= key[ tail_index +  9 ] << 8
-        if tail_size >=  9:
-            k3 ^= key[ tail_index +  8 ]
+            h4 ^= ( ( k4 << 18 | k4 >> 14 ) * c1 ) & 0xFFFFFFFF
 
         if tail_size > 8:
+            k3  = int.from_bytes( key[ tail_index + 8:tail_index + 12 ], 'little' )
             k3  = ( k3 * c3 ) & 0xFFFFFFFF
-            k3  = ( k3 << 17 | k3 >> 15 ) & 0xFFFFFFFF # inlined ROTL32
-            k3  = ( k3 * c4 ) & 0xFFFFFFFF
-            h3 ^= k3
-
-        if tail_size >= 8:
-            k2 ^= key[ tail_index + 7 ] << 24
-        if tail_size >= 7:
-            k2 ^= key[ tail_index + 6 ] << 16
-        if tail_size >= 6:
-            k2 ^= key[ tail_index + 5 ] << 8
-        if tail_size >= 5:
-            k2 ^= key[ tail_index + 4 ]
+            h3 ^= ( ( k3 << 17 | k3 >> 15 ) * c4 ) & 0xFFFFFFFF
 
         if tail_size > 4:
+            k2  = int.from_bytes( key[ tail_index + 4:tail_index + 8 ], 'little' )
             k2  = ( k2 * c2 ) & 0xFFFFFFFF
-            k2  = ( k2 << 16 | k2 >> 16 ) & 0xFFFFFFFF # inlined ROTL32
-            k2  = ( k2 * c3 ) & 0xFFFFFFFF
-            h2 ^= k2
-
-        if tail_size >= 4:
-            k1 ^= key[ tail_index + 3 ] << 24
-        if tail_size >= 3:
-            k1 ^= key[ tail_index + 2 ] << 16
-        if tail_size >= 2:
-            k1 ^= key[ tail_index + 1 ] << 8
-        if tail_size >= 1:
-            k1 ^= key[ tail_index + 0 ]
+            h2 ^= ( ( k2 << 16 | k2 >> 16 ) * c3 ) & 0xFFFFFFFF
 
         if tail_size > 0:
+            k1  = int.from_bytes( key[ tail_index:tail_index + 4 ], 'little' )
             k1  = ( k1 * c1 ) & 0xFFFFFFFF
-            k1  = ( k1 << 15 | k1 >> 17 ) & 0xFFFFFFFF # inlined ROTL32
-            k1  = ( k1 * c2 ) & 0xFFFFFFFF
-            h1 ^= k1
+            h1 ^= ( ( k1 << 15 | k1 >> 17 ) * c2 ) & 0xFFFFFFFF
 
         #finalization
         h1 ^= length
@@ -395,12 +302,12 @@ def hash128( key, seed = 0x0, x64arch = True ):
 
         return ( h4 << 96 | h3 << 64 | h2 << 32 | h1 )
 
-    key = bytearray( xencode(key) )
+    key = xencode( key )
 
     if x64arch:
-        return hash128_x64( key, seed )
+        return hash128_x64( key, seed & 0xFFFFFFFF )
     else:
-        return hash128_x86( key, seed )
+        return hash128_x86( key, seed & 0xFFFFFFFF )
 
 
 def hash64( key, seed = 0x0, x64arch = True ):
@@ -440,6 +347,7 @@ def hash_bytes( key, seed = 0x0, x64arch = True ):
 
 if __name__ == "__main__":
     import argparse
+    import sys
     
     parser = argparse.ArgumentParser( 'pymurmur3', 'pymurmur [options] "string to hash"' )
     parser.add_argument( '--seed', type = int, default = 0 )
@@ -0,0 +1,658 @@
+import asyncio
+import copy
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import stat as stat_module
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .archive import ArchiveHasher, is_archive
+from .bloomfilter import BloomFilter
+from .filterbank import FilterBank
+from .instrument import cpu_time
+from .output import Result
+from .schedule import DeviceScheduler
+
+# Kinds of file WalkRules can select. "file" is a regular file, "link" a
+# symbolic link to one and "exec" either, if it is executable.
+FILE_TYPES = ["file", "link", "exec"]
+
+
+def md5_first_8192(filename):
+    """md5_first_8192() - Calculates MD5 of the first 8kb of a file, for
+                         great speed.
+
+    Args:
+        filename (str) - Path to file.
+
+    Returns:
+        Hexadecimal string of the hash on success.
+        None if the hash couldn't be calculated.
+    """
+    md5hash = hashlib.md5()
+
+    try:
+        with open(filename, "rb") as filep:
+            md5hash.update(filep.read(8192))
+    except PermissionError:
+        return None
+    return md5hash.hexdigest()
+
+
+def md5_file(filename, stats=None):
+    """md5_file() - Calculates MD5 of a file in 4k chunks. Useful for low
+                    memory machines because it doesnt load the entire file in
+                    RAM.
+
+    Args:
+        filename (str) - Path to file.
+        stats (ScanStats) - Record time spent reading and hashing, or None.
+
+    Returns:
+        Hexadecimal string of the hash on success.
+        None if the hash couldn't be calculated.
+    """
+    md5hash = hashlib.md5()
+
+    try:
+        with open(filename, "rb") as filep:
+            if stats is None:
+                for chunk in iter(lambda: filep.read(4096), b""):
+                    md5hash.update(chunk)
+            else:
+                timed_md5(filep, md5hash, stats)
+    except PermissionError:
+        return None
+    return md5hash.hexdigest()
+
+
+def timed_md5(filep, md5hash, stats):
+    """timed_md5() - Hash a file like md5_file(), timing reads and hash
+                     updates separately.
+
+    Args:
+        filep (file) - File opened in binary mode.
+        md5hash (hashlib.md5) - Hash to update.
+        stats (ScanStats) - Where to record the timings.
+
+    Returns:
+        Nothing.
+    """
+    read_wall = read_cpu = hash_wall = hash_cpu = 0.0
+    reads = 0
+    while True:
+        wall, cpu = time.perf_counter(), cpu_time()
+        chunk = filep.read(4096)
+        wall2, cpu2 = time.perf_counter(), cpu_time()
+        read_wall += wall2 - wall
+        read_cpu += cpu2 - cpu
+        reads += 1
+        if not chunk:
+            break
+        md5hash.update(chunk)
+        hash_wall += time.perf_counter() - wall2
+        hash_cpu += cpu_time() - cpu2
+    stats.add("read", read_wall, read_cpu, reads)
+    stats.add("hash", hash_wall, hash_cpu, reads - 1)
+
+
+def compile_patterns(patterns):
+    """compile_patterns() - Compile glob patterns into a single regex.
+
+    Patterns containing a "/" are matched against the whole path, the rest
+    against the file or directory name.
+
+    Args:
+        patterns (list) - Glob patterns, ex: ["/proc", "*.log"]
+
+    Returns:
+        Compiled regex matching "<name>\\0<path>", or None if there are no
+        patterns.
+    """
+    if not patterns:
+        return None
+    expressions = []
+    for pattern in patterns:
+        pattern = pattern.rstrip("/") or "/"
+        if "/" in pattern:
+            expressions.append(r"[^\x00]*\x00" + fnmatch.translate(pattern))
+        else:
+            expressions.append(
+                fnmatch.translate(pattern).replace(r"\Z", r"\x00", 1))
+    return re.compile("|".join("(?:%s)" % exp for exp in expressions))
+
+
+def matches(pattern, path):
+    """matches() - Match a path against patterns from compile_patterns().
+
+    Args:
+        pattern (regex) - Compiled patterns.
+        path (str) - Path to file or directory.
+
+    Returns:
+        True if any pattern matches the path or its name.
+    """
+    name = os.path.basename(path.rstrip("/")) or "/"
+    return bool(pattern.match(name + "\x00" + path))
+
+
+class WalkRules(object):
+    """WalkRules class - Decides which directories a walk enters and which
+                         files it yields.
+
+    Directories are pruned as soon as they are found, so excluded subtrees
+    and other filesystems are never read.
+
+    Attributes:
+        excludes (list) - Glob patterns of files and directories to skip.
+        exclude (regex) - excludes compiled, or None.
+        include (regex) - Compiled patterns files must match, or None to
+                          allow any. Directories are entered regardless.
+        min_size (int) - Smallest file size yielded in bytes, or None.
+        max_size (int) - Largest file size yielded in bytes, or None.
+        types (set) - FILE_TYPES yielded, or None for regular files and
+                      links to them.
+        one_file_system (bool) - Don't enter directories on other
+                                 filesystems than their root, ex: /proc.
+    """
+    def __init__(self, exclude=None, include=None, min_size=None,
+                 max_size=None, types=None, one_file_system=False):
+        self.excludes = list(exclude or [])
+        self.exclude = compile_patterns(self.excludes)
+        self.include = compile_patterns(include)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.types = set(types) if types else None
+        if self.types and not self.types.issubset(FILE_TYPES):
+            raise ValueError("unknown file types: %s"
+                             % ", ".join(sorted(self.types -
+                                                set(FILE_TYPES))))
+        self.one_file_system = one_file_system
+
+    def excluding(self, patterns):
+        """WalkRules.excluding() - Copy the rules with more exclusions.
+
+        Args:
+            patterns (list) - Glob patterns to skip as well, ex: ["*.log"].
+                              Ones already excluded are ignored.
+
+        Returns:
+            WalkRules, or these rules if nothing was added.
+        """
+        added = [pattern for pattern in patterns or []
+                 if pattern not in self.excludes]
+        if not added:
+            return self
+        rules = copy.copy(self)
+        rules.excludes = self.excludes + added
+        rules.exclude = compile_patterns(rules.excludes)
+        return rules
+
+    def excluded(self, path):
+        """WalkRules.excluded() - Check if a path matches the exclusions.
+
+        Args:
+            path (str) - Path to file or directory.
+
+        Returns:
+            True if the path should be skipped.
+        """
+        return self.exclude is not None and matches(self.exclude, path)
+
+    def device(self, root):
+        """WalkRules.device() - Find the filesystem a walk stays on.
+
+        Args:
+            root (str) - Directory the walk starts from.
+
+        Returns:
+            st_dev of root, or None if walks may cross filesystems.
+        """
+        if not self.one_file_system:
+            return None
+        try:
+            return os.stat(root).st_dev
+        except OSError:
+            return None
+
+    def enter(self, path, device=None):
+        """WalkRules.enter() - Check if a walk should enter a directory.
+
+        Args:
+            path (str) - Path to directory.
+            device (int) - st_dev the walk stays on, or None.
+
+        Returns:
+            True if the directory should be walked.
+        """
+        if self.excluded(path):
+            return False
+        if device is not None:
+            try:
+                return os.lstat(path).st_dev == device
+            except OSError:
+                return False
+        return True
+
+    def accept(self, path):
+        """WalkRules.accept() - Check if a walk should yield a file.
+
+        Args:
+            path (str) - Path to file.
+
+        Returns:
+            True if the path is a file that passes every rule.
+        """
+        if self.excluded(path):
+            return False
+        if self.include is not None and not matches(self.include, path):
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        # We only care about files.
+        if not stat_module.S_ISREG(stat.st_mode):
+            return False
+        if self.min_size is not None and stat.st_size < self.min_size:
+            return False
+        if self.max_size is not None and stat.st_size > self.max_size:
+            return False
+        if self.types is not None:
+            kinds = {"link" if os.path.islink(path) else "file"}
+            if stat.st_mode & 0o111:
+                kinds.add("exec")
+            return bool(kinds & self.types)
+        return True
+
+
+class HashCache(object):
+    """HashCache class - Remembers the digests of files so unchanged files
+                         aren't hashed again on the next scan.
+
+    A file is considered unchanged if its size, modification time and inode
+    number are the same.
+
+    Attributes:
+        path (str) - File the cache is saved to. None keeps it in memory.
+        entries (dict) - Paths mapped to [size, mtime_ns, inode, digest].
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = dict()
+
+    def load(self):
+        """HashCache.load() - Load the cache from disk, if it exists.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        try:
+            with open(self.path, "r") as cachefile:
+                self.entries = json.load(cachefile)
+        except FileNotFoundError:
+            self.entries = dict()
+
+    def save(self):
+        """HashCache.save() - Save the cache to disk.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as cachefile:
+            json.dump(self.entries, cachefile)
+        os.replace(temp_path, self.path)
+
+    def get(self, path, stat):
+        """HashCache.get() - Look up a file's cached digest.
+
+        Args:
+            path (str) - Path to file.
+            stat (os.stat_result) - Current status of the file.
+
+        Returns:
+            Hex digest, or None if the file isn't cached or has changed.
+        """
+        entry = self.entries.get(path)
+        if entry and entry[:3] == [stat.st_size, stat.st_mtime_ns,
+                                   stat.st_ino]:
+            return entry[3]
+        return None
+
+    def put(self, path, stat, digest):
+        """HashCache.put() - Cache a file's digest.
+
+        Args:
+            path (str) - Path to file.
+            stat (os.stat_result) - Status of the file when it was hashed.
+            digest (str) - Hex digest of the file.
+
+        Returns:
+            Nothing.
+        """
+        self.entries[path] = [stat.st_size, stat.st_mtime_ns, stat.st_ino,
+                              digest]
+
+
+class Scanner(object):
+    """Scanner class - Hashes files under a set of roots and looks them up in
+                       bloom filters, yielding a Result for each file.
+
+    Attributes:
+        roots (list) - Files and directories to scan.
+        filters (FilterBank) - Filters to check files against. None only
+                               hashes files.
+        jobs (int) - Number of files hashed at once.
+        cache (HashCache) - Cache of digests of unchanged files, or None.
+        rules (WalkRules) - Which directories are entered and files hashed.
+        stats (ScanStats) - Collects timings and throughput, or None.
+        archives (bool) - Also hash the files inside archives, reported as
+                          "<archive>!<member>".
+        order (str) - Order files are read in, one of schedule.ORDERS.
+                      Except for "walk", each device gets its own jobs.
+        impact (LowImpact) - Hashes files with limited effect on the page
+                             cache and disk, or None to hash normally.
+        memo (LookupMemo) - Remembers lookups of digests seen before, or
+                            None to look every digest up.
+    """
+    def __init__(self, roots, filters=None, jobs=1, cache=None,
+                 exclude=None, stats=None, archives=False, rules=None,
+                 order="walk", impact=None, memo=None):
+        self.roots = list(roots)
+        if isinstance(filters, BloomFilter):
+            filters = FilterBank(dict(filter=filters))
+        elif isinstance(filters, dict):
+            filters = FilterBank(filters)
+        self.filters = filters
+        self.jobs = max(1, int(jobs))
+        self.cache = cache
+        # exclude is kept for callers that don't need the other rules, and
+        # folded into them here so the two can't disagree.
+        self.rules = (rules or WalkRules()).excluding(exclude)
+        self.stats = stats
+        self.archives = archives
+        self.order = order
+        self.impact = impact
+        self.memo = memo
+
+    def excluded(self, path):
+        """Scanner.excluded() - Check if a path matches the exclusions.
+
+        Args:
+            path (str) - Path to file or directory.
+
+        Returns:
+            True if the path should be skipped.
+        """
+        return self.rules.excluded(path)
+
+    def walk(self):
+        """Scanner.walk() - Find all regular files under the roots.
+
+        Directories the rules reject are pruned so they are never entered.
+
+        Args:
+            None.
+
+        Returns:
+            Generator yielding paths of files.
+        """
+        rules = self.rules
+        for root in self.roots:
+            if rules.excluded(root):
+                continue
+            if os.path.isfile(root):
+                if rules.accept(root):
+                    yield root
+                continue
+            device = rules.device(root)
+            for dirpath, dirs, files in os.walk(root):
+                dirs[:] = [
+                    directory for directory in dirs
+                    if rules.enter(os.path.join(dirpath, directory), device)
+                ]
+                for filename in files:
+                    fullpath = os.path.join(dirpath, filename)
+                    if rules.accept(fullpath):
+                        yield fullpath
+
+    def check(self, path):
+        """Scanner.check() - Hash a single file and look it up.
+
+        Args:
+            path (str) - Path to file.
+
+        Returns:
+            Result for the file. digest is None if the file couldn't be read.
+        """
+        stats = self.stats
+        if stats is not None:
+            started = time.perf_counter()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if stats is not None:
+                stats.file_done(path, time.perf_counter() - started, None)
+            return Result(path, None, None, None)
+
+        digest = None
+        if self.cache is not None:
+            digest = self.cache.get(path, stat)
+            if stats is not None:
+                stats.count("cache_hits" if digest else "cache_misses")
+        if digest is None:
+            try:
+                if self.impact is None:
+                    digest = md5_file(path, stats)
+                else:
+                    digest = self.impact.md5_file(path, stats)
+            except OSError:
+                digest = None
+            if digest and self.cache is not None:
+                self.cache.put(path, stat, digest)
+
+        filters = self.lookup(digest)
+        if stats is not None:
+            stats.file_done(path, time.perf_counter() - started,
+                            stat.st_size if digest else None)
+        return Result(path, stat.st_size, digest, filters)
+
+    def lookup(self, digest):
+        """Scanner.lookup() - Look a digest up in the filters.
+
+        Args:
+            digest (str) - Hex digest, or None if the file couldn't be read.
+
+        Returns:
+            list of names of filters containing the digest, or None if there
+            are no filters or no digest.
+        """
+        if not digest or self.filters is None:
+            return None
+        if self.memo is None:
+            if self.stats is None:
+                return self.filters.lookup(digest)
+            wall, cpu = time.perf_counter(), cpu_time()
+            filters = self.filters.lookup(digest)
+        else:
+            if self.stats is None:
+                return self.memo.lookup(self.filters, digest)[0]
+            wall, cpu = time.perf_counter(), cpu_time()
+            filters, remembered = self.memo.lookup(self.filters, digest)
+            self.stats.count("memo_hits" if remembered else "memo_misses")
+        self.stats.add("lookup", time.perf_counter() - wall,
+                       cpu_time() - cpu)
+        return filters
+
+    def check_archive(self, path):
+        """Scanner.check_archive() - Hash an archive and the files inside
+                                     it, and look them up.
+
+        Members are streamed from the archive, never extracted to disk, and
+        the archive is hashed with the same read. Archives that turn out to
+        be damaged or unsupported stop yielding members early. Both they and
+        members that can't be read, ex: encrypted zip members, are counted
+        as archive_errors.
+
+        Args:
+            path (str) - Path to an archive.
+
+        Returns:
+            Generator yielding a Result for each member, then one for the
+            archive. A digest is None if the file couldn't be read.
+        """
+        stats = self.stats
+        started = first = time.perf_counter()
+        opener = None
+        if self.impact is not None:
+            def opener(path):
+                return self.impact.open_file(path, stats)
+        hasher = ArchiveHasher(path, opener=opener)
+        try:
+            for name, size, digest in hasher.members():
+                filters = self.lookup(digest)
+                if stats is not None:
+                    finished = time.perf_counter()
+                    stats.file_done(name, finished - started, size)
+                    started = finished
+                    if digest is None:
+                        stats.count("archive_errors")
+                yield Result(name, size, digest, filters)
+        except OSError:
+            hasher.digest = None
+        if hasher.error is not None and stats is not None:
+            stats.count("archive_errors")
+
+        if hasher.digest and self.cache is not None:
+            try:
+                self.cache.put(path, os.stat(path), hasher.digest)
+            except OSError:
+                pass
+        filters = self.lookup(hasher.digest)
+        if stats is not None:
+            stats.file_done(path, time.perf_counter() - first,
+                            hasher.size if hasher.digest else None)
+        yield Result(path, hasher.size if hasher.digest else None,
+                     hasher.digest, filters)
+
+    def check_all(self, path):
+        """Scanner.check_all() - Hash a single file, and the files inside it
+                                 if it is an archive.
+
+        Args:
+            path (str) - Path to file.
+
+        Returns:
+            list of Results, the file's last.
+        """
+        if self.archives and is_archive(path):
+            return list(self.check_archive(path))
+        return [self.check(path)]
+
+    def timed_walk(self):
+        """Scanner.timed_walk() - walk(), recording the time spent walking
+                                  if stats are being collected.
+
+        Args:
+            None.
+
+        Returns:
+            Generator yielding paths of files.
+        """
+        if self.stats is None:
+            yield from self.walk()
+            return
+        paths = self.walk()
+        while True:
+            wall, cpu = time.perf_counter(), cpu_time()
+            path = next(paths, None)
+            self.stats.add("walk", time.perf_counter() - wall,
+                           cpu_time() - cpu)
+            if path is None:
+                return
+            yield path
+
+    def scan(self):
+        """Scanner.scan() - Scan all files under the roots.
+
+        Results are yielded as soon as each file is done. With more than one
+        job they are yielded in the order files finish, not the order they
+        were found. With archives, the results for an archive's members
+        come before the archive's. Closing the generator stops the scan.
+
+        Args:
+            None.
+
+        Returns:
+            Generator yielding a Result for each file.
+        """
+        if self.order != "walk":
+            yield from DeviceScheduler(self, self.order).run()
+            return
+        if self.jobs == 1:
+            for path in self.timed_walk():
+                if self.archives and is_archive(path):
+                    yield from self.check_archive(path)
+                else:
+                    yield self.check(path)
+            return
+
+        executor = ThreadPoolExecutor(self.jobs)
+        pending = set()
+        try:
+            for path in self.timed_walk():
+                pending.add(executor.submit(self.check_all, path))
+                # Don't let the walk get too far ahead of the workers.
+                if len(pending) >= self.jobs * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    async def ascan(self):
+        """Scanner.ascan() - Scan all files under the roots without blocking
+                             the event loop.
+
+        The scan runs in a worker thread. Breaking out of the loop or
+        cancelling the task stops the scan.
+
+        Args:
+            None.
+
+        Returns:
+            Async generator yielding a Result for each file.
+        """
+        # Python 3.6 lacks get_running_loop(), where get_event_loop() in a
+        # coroutine returns the running loop without a warning.
+        loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)()
+        # One thread, so the generator is never resumed from two threads.
+        executor = ThreadPoolExecutor(1)
+        results = self.scan()
+        finished = object()
+        try:
+            while True:
+                result = await loop.run_in_executor(
+                    executor, next, results, finished)
+                if result is finished:
+                    break
+                yield result
+        finally:
+            executor.submit(results.close)
+            executor.shutdown(wait=False)
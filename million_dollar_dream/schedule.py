@@ -0,0 +1,271 @@
+"""
+Scheduling reads by device and disk location.
+
+Hashing files in the order os.walk() finds them makes spinning disks seek
+between every file, and scanning several mounts one after another leaves
+all but one idle. DeviceScheduler gives each device (st_dev) its own queue
+and workers, so devices are read in parallel. Within a device, files are
+read in inode order, which on most filesystems follows where they were
+allocated, or by the physical offset of their first extent from the FIEMAP
+ioctl where the filesystem supports it.
+
+Files are sorted in windows of WINDOW files as the walk finds them, so
+memory use doesn't grow with the size of the tree.
+"""
+
+import fcntl
+import os
+import queue
+import struct
+import threading
+
+# Orders Scanner can read files in. "walk" is the order os.walk() finds
+# them, "device" groups them by device but keeps walk order within each.
+ORDERS = ["walk", "device", "inode", "extent"]
+
+# Files sorted at a time.
+WINDOW = 20000
+
+# Files waiting in each device's queue before the walk pauses.
+QUEUE_SIZE = 4 * WINDOW
+
+# ioctl number of FS_IOC_FIEMAP, _IOWR('f', 11, struct fiemap).
+FS_IOC_FIEMAP = 0xC020660B
+
+# struct fiemap, asking for the first extent only, and struct
+# fiemap_extent. See linux/fiemap.h.
+FIEMAP = struct.Struct("=QQIIII")
+FIEMAP_EXTENT = struct.Struct("=QQQQQIIII")
+
+# Marks the end of a queue.
+DONE = object()
+
+
+def physical_offset(path):
+    """physical_offset() - Find where a file starts on its device.
+
+    Args:
+        path (str) - Path to file.
+
+    Returns:
+        Byte offset of the file's first extent on the device (int), or None
+        if the filesystem doesn't support FIEMAP or the file has no extents,
+        ex: it is empty.
+    """
+    request = bytearray(FIEMAP.pack(0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) +
+                        bytes(FIEMAP_EXTENT.size))
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_NOATIME", 0))
+    except PermissionError:
+        # O_NOATIME is only allowed on files we own.
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request, True)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    if not FIEMAP.unpack_from(request)[3]:
+        return None
+    return FIEMAP_EXTENT.unpack_from(request, FIEMAP.size)[1]
+
+
+def sort_key(path, stat, order):
+    """sort_key() - Find where a file falls in a read order.
+
+    Args:
+        path (str) - Path to file.
+        stat (os.stat_result) - The file's stat.
+        order (str) - One of ORDERS.
+
+    Returns:
+        tuple that sorts files on the same device into the order.
+    """
+    if order == "extent":
+        offset = physical_offset(path)
+        # Files without a location go first, in inode order.
+        return (-1 if offset is None else offset, stat.st_ino)
+    if order == "inode":
+        return (stat.st_ino,)
+    return ()
+
+
+class DeviceScheduler(object):
+    """DeviceScheduler class - Runs a Scanner's checks with a queue and
+                               workers per device.
+
+    A thread walks the scanner's roots, sorts each window of files by
+    device and location, and feeds each device's queue. Each device has
+    scanner.jobs workers, so one job per device gives sequential reads.
+
+    Attributes:
+        scanner (Scanner) - Scanner whose walk() and check_all() are used.
+        order (str) - One of ORDERS other than "walk".
+        window (int) - Files sorted at a time.
+        devices (dict) - st_dev mapped to the device's queue.
+        results (queue.Queue) - Lists of Results from the workers.
+        stopped (threading.Event) - Set when the scan is stopped early.
+    """
+    def __init__(self, scanner, order="inode", window=WINDOW):
+        self.scanner = scanner
+        self.order = order
+        self.window = window
+        self.devices = dict()
+        self.results = queue.Queue()
+        self.stopped = threading.Event()
+        self.workers = []
+
+    def put(self, device_queue, item):
+        """DeviceScheduler.put() - Add to a queue, waiting while it's full.
+
+        Args:
+            device_queue (queue.Queue) - Queue to add to.
+            item (object) - Path or DONE.
+
+        Returns:
+            False if the scan was stopped first.
+        """
+        while not self.stopped.is_set():
+            try:
+                device_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def device_queue(self, device):
+        """DeviceScheduler.device_queue() - Find a device's queue, starting
+                                            its workers if it's new.
+
+        Args:
+            device (int) - st_dev of the device.
+
+        Returns:
+            queue.Queue of paths.
+        """
+        device_queue = self.devices.get(device)
+        if device_queue is None:
+            device_queue = self.devices[device] = queue.Queue(QUEUE_SIZE)
+            for _ in range(self.scanner.jobs):
+                worker = threading.Thread(target=self.work,
+                                          args=(device_queue,), daemon=True)
+                worker.start()
+                self.workers.append(worker)
+        return device_queue
+
+    def key(self, path):
+        """DeviceScheduler.key() - Find where a file falls in the schedule.
+
+        Args:
+            path (str) - Path to file.
+
+        Returns:
+            tuple of the file's device followed by its sort_key().
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Let check() report it.
+            return (0,)
+        return (stat.st_dev,) + sort_key(path, stat, self.order)
+
+    def schedule(self, paths):
+        """DeviceScheduler.schedule() - Sort a window of files and queue
+                                        them on their devices.
+
+        Args:
+            paths (list) - Paths of files.
+
+        Returns:
+            False if the scan was stopped first.
+        """
+        keyed = [(self.key(path), path) for path in paths]
+        # Stable, so files keep walk order within a device for "device".
+        keyed.sort(key=lambda item: item[0])
+        for key, path in keyed:
+            if not self.put(self.device_queue(key[0]), path):
+                return False
+        return True
+
+    def produce(self):
+        """DeviceScheduler.produce() - Walk the roots and feed the queues.
+                                       Runs in its own thread.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        try:
+            window = []
+            for path in self.scanner.timed_walk():
+                window.append(path)
+                if len(window) >= self.window:
+                    if not self.schedule(window):
+                        return
+                    window = []
+            self.schedule(window)
+        except BaseException as exc:
+            self.results.put(exc)
+        finally:
+            for device_queue in list(self.devices.values()):
+                for _ in range(self.scanner.jobs):
+                    self.put(device_queue, DONE)
+            for worker in self.workers:
+                worker.join()
+            self.results.put(DONE)
+
+    def work(self, device_queue):
+        """DeviceScheduler.work() - Check files from a device's queue until
+                                    it ends. Runs in its own thread.
+
+        Args:
+            device_queue (queue.Queue) - Paths to check.
+
+        Returns:
+            Nothing.
+        """
+        while not self.stopped.is_set():
+            try:
+                path = device_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if path is DONE:
+                return
+            try:
+                self.results.put(self.scanner.check_all(path))
+            except BaseException as exc:
+                self.results.put(exc)
+                return
+
+    def run(self):
+        """DeviceScheduler.run() - Scan all files under the scanner's roots.
+
+        Results are yielded in the order files finish. Closing the
+        generator stops the scan.
+
+        Args:
+            None.
+
+        Returns:
+            Generator yielding a Result for each file.
+        """
+        producer = threading.Thread(target=self.produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                results = self.results.get()
+                if results is DONE:
+                    break
+                if isinstance(results, BaseException):
+                    raise results
+                yield from results
+        finally:
+            self.stopped.set()
+            producer.join()
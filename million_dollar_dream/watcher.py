@@ -0,0 +1,384 @@
+"""
+Watching directory trees for changed files.
+
+On Linux, directories are watched with inotify, called through ctypes so no
+extra packages are needed. Events are coalesced per path and a path is only
+reported once it has been quiet for the debounce period, so a file written
+in many small pieces is hashed once. Directories that can't be watched,
+usually because fs.inotify.max_user_watches has been reached, are scanned
+every poll interval instead, comparing sizes and modification times. If
+inotify isn't available at all, every root is polled.
+"""
+
+import ctypes
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+# inotify(7) event masks.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# Events that mean a file's contents may have changed or it has appeared.
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_ONLYDIR
+
+# Header of each event read from inotify: wd, mask, cookie, name length.
+EVENT = struct.Struct("iIII")
+
+# Seconds a path must be quiet before it's reported.
+DEBOUNCE = 1.0
+
+# Seconds between scans of directories that couldn't be watched.
+POLL_INTERVAL = 300.0
+
+try:
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+except (OSError, AttributeError):
+    # Not Linux.
+    libc = None
+
+
+def check(result):
+    """check() - Raise OSError if a libc call failed.
+
+    Args:
+        result (int) - Return value of the call.
+
+    Returns:
+        result, if it isn't -1.
+    """
+    if result == -1:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
+
+
+class Watcher(object):
+    """Watcher class - Reports files created or modified under a set of
+                       roots.
+
+    Attributes:
+        roots (list) - Directories to watch.
+        debounce (float) - Seconds a path must be quiet before it's reported.
+        interval (float) - Seconds between scans of polled directories.
+        excluded (function) - Called with a path, returns True to skip it,
+                              ex: Scanner.excluded.
+        fd (int) - inotify file descriptor, or None if inotify isn't used.
+        watches (dict) - Watch descriptors mapped to directories.
+        watched (dict) - Directories mapped to watch descriptors.
+        polled (set) - Directories whose whole subtree is scanned every
+                       interval because it couldn't be watched.
+        snapshot (dict) - Files under polled directories mapped to their
+                          (size, mtime) when last scanned.
+        pending (dict) - Changed paths mapped to when they last changed.
+        last_poll (float) - When polled directories were last scanned.
+        overflows (int) - Number of times the kernel dropped events.
+    """
+    def __init__(self, roots, debounce=DEBOUNCE, interval=POLL_INTERVAL,
+                 excluded=None):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.debounce = debounce
+        self.interval = interval
+        self.excluded = excluded or (lambda path: False)
+        self.fd = None
+        self.watches = dict()
+        self.watched = dict()
+        self.polled = set()
+        self.snapshot = dict()
+        self.pending = dict()
+        self.last_poll = time.monotonic()
+        self.overflows = 0
+
+    def start(self):
+        """Watcher.start() - Start watching the roots.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        if libc is not None:
+            try:
+                self.fd = check(libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+            except OSError as exc:
+                sys.stderr.write("[-] inotify unavailable (%s), polling "
+                                 "every %ds\n" % (exc, self.interval))
+        for root in self.roots:
+            if self.fd is None:
+                self.poll_tree(root)
+            else:
+                self.add_tree(root)
+        self.last_poll = time.monotonic()
+
+    def add_watch(self, directory):
+        """Watcher.add_watch() - Watch a single directory.
+
+        Args:
+            directory (str) - Directory to watch.
+
+        Returns:
+            Watch descriptor (int).
+
+        Raises:
+            OSError if the directory can't be watched.
+        """
+        return check(libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), WATCH_MASK))
+
+    def add_tree(self, root):
+        """Watcher.add_tree() - Watch a directory and everything below it.
+
+        Subtrees that can't be watched because a limit was reached are
+        polled instead.
+
+        Args:
+            root (str) - Directory to watch.
+
+        Returns:
+            list of files found in newly watched directories.
+        """
+        found = []
+        for dirpath, dirs, files in os.walk(root):
+            if self.excluded(dirpath):
+                dirs[:] = []
+                continue
+            try:
+                wd = self.add_watch(dirpath)
+            except OSError as exc:
+                dirs[:] = []
+                if exc.errno in (errno.ENOSPC, errno.ENOMEM):
+                    sys.stderr.write("[-] Out of inotify watches at %s, "
+                                     "polling it every %ds\n"
+                                     % (dirpath, self.interval))
+                    self.poll_tree(dirpath)
+                continue
+            self.watches[wd] = dirpath
+            self.watched[dirpath] = wd
+            found.extend(os.path.join(dirpath, filename)
+                         for filename in files)
+        return found
+
+    def remove_tree(self, root):
+        """Watcher.remove_tree() - Stop watching a directory that has been
+                                   moved or deleted, and everything below
+                                   it.
+
+        Args:
+            root (str) - Directory to stop watching.
+
+        Returns:
+            Nothing.
+        """
+        prefix = os.path.join(root, "")
+        for directory in [directory for directory in self.watched
+                          if directory == root or
+                          directory.startswith(prefix)]:
+            wd = self.watched.pop(directory)
+            self.watches.pop(wd, None)
+            libc.inotify_rm_watch(self.fd, wd)
+
+    def poll_tree(self, root):
+        """Watcher.poll_tree() - Poll a directory instead of watching it.
+
+        Args:
+            root (str) - Directory to poll.
+
+        Returns:
+            Nothing.
+        """
+        self.polled.add(root)
+        for path, stat in self.scan_tree(root):
+            self.snapshot[path] = stat
+
+    def scan_tree(self, root):
+        """Watcher.scan_tree() - Find the files below a directory.
+
+        Args:
+            root (str) - Directory to scan.
+
+        Returns:
+            Generator yielding (path, (size, mtime)) for each regular file.
+        """
+        for dirpath, dirs, files in os.walk(root):
+            dirs[:] = [directory for directory in dirs
+                       if not self.excluded(os.path.join(dirpath,
+                                                         directory))]
+            for filename in files:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, (stat.st_size, stat.st_mtime_ns)
+
+    def poll(self):
+        """Watcher.poll() - Scan polled directories for changed files.
+
+        Args:
+            None.
+
+        Returns:
+            list of files created or modified since the last scan.
+        """
+        changed = []
+        seen = set()
+        for root in sorted(self.polled):
+            for path, stat in self.scan_tree(root):
+                seen.add(path)
+                if self.snapshot.get(path) != stat:
+                    self.snapshot[path] = stat
+                    changed.append(path)
+        for path in set(self.snapshot) - seen:
+            del self.snapshot[path]
+        self.last_poll = time.monotonic()
+        return changed
+
+    def read_events(self, timeout):
+        """Watcher.read_events() - Wait for inotify events and record the
+                                   paths they touch.
+
+        Args:
+            timeout (float) - Most seconds to wait.
+
+        Returns:
+            Nothing.
+        """
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        now = time.monotonic()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length]
+            offset += EVENT.size + length
+            self.handle(wd, mask, os.fsdecode(name.rstrip(b"\0")), now)
+
+    def handle(self, wd, mask, name, now):
+        """Watcher.handle() - Act on one inotify event.
+
+        Args:
+            wd (int) - Watch descriptor the event is for.
+            mask (int) - Event mask.
+            name (str) - Name of the file within the watched directory.
+            now (float) - When the event was read.
+
+        Returns:
+            Nothing.
+        """
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped, so anything may have changed.
+            self.overflows += 1
+            sys.stderr.write("[-] inotify queue overflowed, rescanning\n")
+            for root in self.roots:
+                for path, _ in self.scan_tree(root):
+                    self.pending[path] = now
+            return
+        directory = self.watches.get(wd)
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            if self.watched.get(directory) == wd:
+                del self.watched[directory]
+            return
+        if directory is None or not name:
+            return
+        path = os.path.join(directory, name)
+        if self.excluded(path):
+            return
+        if mask & IN_ISDIR:
+            if mask & IN_MOVED_FROM:
+                self.remove_tree(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may have been created before the watch was added.
+                for found in self.add_tree(path):
+                    self.pending[found] = now
+            return
+        if mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+            self.pending[path] = now
+
+    def due(self, now):
+        """Watcher.due() - Take the pending paths that have been quiet for
+                           the debounce period.
+
+        Args:
+            now (float) - Current time.
+
+        Returns:
+            list of paths.
+        """
+        ready = [path for path, changed in self.pending.items()
+                 if now - changed >= self.debounce]
+        for path in ready:
+            del self.pending[path]
+        return ready
+
+    def wait(self, timeout=None):
+        """Watcher.wait() - Wait for changed files.
+
+        Args:
+            timeout (float) - Most seconds to wait, or None to wait until
+                              something changes.
+
+        Returns:
+            Sorted list of files created or modified, empty if timeout
+            passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            waits = [self.debounce]
+            if self.polled:
+                waits.append(self.last_poll + self.interval - now)
+            if deadline is not None:
+                waits.append(deadline - now)
+            self.read_events(max(0.0, min(waits)))
+
+            now = time.monotonic()
+            changed = set(self.due(now))
+            if self.polled and now - self.last_poll >= self.interval:
+                changed.update(self.poll())
+            changed = sorted(path for path in changed
+                             if os.path.isfile(path))
+            if changed or (deadline is not None and now >= deadline):
+                return changed
+
+    def close(self):
+        """Watcher.close() - Stop watching.
+
+        Args:
+            None.
+
+        Returns:
+            Nothing.
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.watches.clear()
+        self.watched.clear()
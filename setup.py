@@ -5,7 +5,7 @@ import sys
 
 from codecs import open
 
-from setuptools import setup
+from setuptools import Extension, setup
 from setuptools.command.test import test as TestCommand
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -42,10 +42,33 @@ if sys.argv[-1] == 'publish':
 
 packages = ['million_dollar_dream']
 
+# noexcept in the .pyx files needs 0.29.31 or later.
 requires = [
-    'Cython>=0.29'
+    'Cython>=0.29.31'
 ]
 
+
+def extensions():
+    """Compiled versions of the BitField and BloomFilter hot paths. They're
+    optional: without Cython or a C compiler the pure-Python code is used."""
+    try:
+        from Cython.Build import cythonize
+    except ImportError:
+        return []
+    modules = [
+        Extension('million_dollar_dream._bitfield',
+                  ['million_dollar_dream/_bitfield.pyx'], optional=True),
+        Extension('million_dollar_dream._bloomfilter',
+                  ['million_dollar_dream/_bloomfilter.pyx'], optional=True),
+    ]
+    try:
+        return cythonize(modules, language_level=3)
+    except Exception as exc:
+        # An old or broken Cython must not stop the install.
+        sys.stderr.write('warning: not compiling extensions: %s\n' % exc)
+        return []
+
+
 test_requirements = [
     'pyfakefs',
     'pytest',
@@ -69,9 +92,10 @@ setup(
     author_email=about['__author_email__'],
     url=about['__url__'],
     packages=packages,
+    ext_modules=extensions(),
     package_dir={'million_dollar_dream': 'million_dollar_dream'},
     include_package_data=True,
-    python_requires=">=3.4, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*",
+    python_requires=">=3.6",
     install_requires=requires,
     zip_safe=False,
     classifiers=[
@@ -79,8 +103,6 @@ setup(
         'Natural Language :: English',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7'
     ],
@@ -0,0 +1,290 @@
+import gzip
+import hashlib
+import io
+import lzma
+import tarfile
+import zipfile
+import pytest
+from million_dollar_dream import archive as archive_module
+from million_dollar_dream import scanner as scanner_module
+from million_dollar_dream.archive import (
+    ArchiveHasher, archive_format, archive_members, is_archive)
+from million_dollar_dream.scanner import Scanner
+
+FILES = {
+    'usr/bin/tool': b'#!/bin/sh\necho tool\n',
+    'usr/share/doc/README': b'read me\n' * 1000,
+    'empty': b'',
+}
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def expected(prefix, files=FILES):
+    return sorted((prefix + '!' + name, len(data), md5(data))
+                  for name, data in files.items())
+
+
+def tar_bytes(files=FILES, mode='w'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        info = tarfile.TarInfo('./usr')
+        info.type = tarfile.DIRTYPE
+        archive.addfile(info)
+        for name, data in files.items():
+            info = tarfile.TarInfo('./' + name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def ar_bytes(members):
+    data = b'!<arch>\n'
+    for name, contents in members:
+        data += ('%-16s%-12s%-6s%-6s%-8s%-10d`\n'
+                 % (name, 0, 0, 0, 100644, len(contents))).encode()
+        data += contents + (b'\n' if len(contents) % 2 else b'')
+    return data
+
+
+def cpio_bytes(files=FILES):
+    data = b''
+    entries = [(name, 0o100644, contents)
+               for name, contents in files.items()]
+    entries.insert(0, ('usr', 0o40755, b''))
+    entries.append(('TRAILER!!!', 0, b''))
+    for number, (name, mode, contents) in enumerate(entries):
+        name = ('./' + name if name != 'TRAILER!!!' else name).encode()
+        header = b'070701' + b''.join(
+            b'%08X' % field for field in
+            (number, mode, 0, 0, 1, 0, len(contents), 0, 0, 0, 0,
+             len(name) + 1, 0))
+        data += header + name + b'\0'
+        data += b'\0' * (-len(data) % 4)
+        data += contents + b'\0' * (-len(contents) % 4)
+    return data
+
+
+def rpm_bytes(payload):
+    lead = b'\xed\xab\xee\xdb' + b'\0' * 92
+
+    def header(count, size):
+        return (b'\x8e\xad\xe8\x01' + b'\0' * 4 + count.to_bytes(4, 'big') +
+                size.to_bytes(4, 'big') + b'\0' * (16 * count + size))
+
+    signature = header(1, 5)
+    signature += b'\0' * (-len(signature) % 8)
+    return lead + signature + header(2, 7) + payload
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_is_archive():
+    assert is_archive('/tmp/x.tar.gz')
+    assert is_archive('pkg.DEB')
+    assert not is_archive('notes.txt')
+    assert archive_format(b'PK\x03\x04') == 'zip'
+    assert archive_format(tar_bytes()[:512]) == 'tar'
+    assert archive_format(b'plain text') is None
+
+
+@pytest.mark.parametrize('suffix,mode', [
+    ('.tar', 'w'), ('.tar.gz', 'w:gz'), ('.tbz2', 'w:bz2'),
+    ('.tar.xz', 'w:xz'),
+])
+def test_tar(tmp_path, suffix, mode):
+    path = write(tmp_path / ('files' + suffix), tar_bytes(mode=mode))
+    assert sorted(archive_members(path)) == expected(path)
+
+
+def test_zip(tmp_path):
+    path = str(tmp_path / 'files.jar')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('usr/', b'')
+        for name, data in FILES.items():
+            archive.writestr(name, data)
+    assert sorted(archive_members(path)) == expected(path)
+
+
+def test_gzip_file(tmp_path):
+    path = write(tmp_path / 'notes.txt.gz', gzip.compress(b'notes'))
+    assert list(archive_members(path)) == \
+        [(path + '!notes.txt', 5, md5(b'notes'))]
+
+
+def test_deb(tmp_path):
+    data = lzma.compress(tar_bytes())
+    control = gzip.compress(tar_bytes({'control': b'Package: x\n'}))
+    path = write(tmp_path / 'x.deb', ar_bytes([
+        ('debian-binary', b'2.0\n'),
+        ('control.tar.gz/', control),
+        ('data.tar.xz/', data),
+    ]))
+    assert sorted(archive_members(path)) == sorted(
+        [(path + '!debian-binary', 4, md5(b'2.0\n')),
+         (path + '!control.tar.gz', len(control), md5(control)),
+         (path + '!data.tar.xz', len(data), md5(data))] +
+        expected(path + '!control.tar.gz', {'control': b'Package: x\n'}) +
+        expected(path + '!data.tar.xz'))
+    # Only the outer archive.
+    assert len(list(archive_members(path, 1))) == 3
+
+
+def test_rpm(tmp_path):
+    path = write(tmp_path / 'x.rpm', rpm_bytes(gzip.compress(cpio_bytes())))
+    assert sorted(archive_members(path)) == expected(path)
+
+
+def test_nested_zip(tmp_path, monkeypatch):
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w') as archive:
+        archive.writestr('inside', b'inside')
+    inner = inner.getvalue()
+    path = write(tmp_path / 'outer.tar',
+                 tar_bytes({'lib/inner.zip': inner}))
+    assert sorted(archive_members(path)) == [
+        (path + '!lib/inner.zip', len(inner), md5(inner)),
+        (path + '!lib/inner.zip!inside', 6, md5(b'inside')),
+    ]
+    # Too big to read into memory, so only hashed.
+    monkeypatch.setattr(archive_module, 'MAX_BUFFER', 10)
+    assert list(archive_members(path)) == \
+        [(path + '!lib/inner.zip', len(inner), md5(inner))]
+
+
+def test_damaged(tmp_path):
+    data = tar_bytes(mode='w:gz')
+    path = write(tmp_path / 'broken.tgz', data[:len(data) // 2])
+    hasher = ArchiveHasher(path)
+    assert len(list(hasher.members())) < len(FILES)
+    assert hasher.error is not None
+    results = list(Scanner([path], archives=True).scan())
+    assert results[-1].path == path
+    assert results[-1].digest == md5(data[:len(data) // 2])
+
+
+def test_read_once(tmp_path, monkeypatch):
+    data = tar_bytes(mode='w:gz')
+    path = write(tmp_path / 'files.tgz', data)
+    opened = []
+
+    def counting_open(name, *args, **kwargs):
+        opened.append(name)
+        return open(name, *args, **kwargs)
+
+    monkeypatch.setattr(archive_module, 'open', counting_open, raising=False)
+    monkeypatch.setattr(scanner_module, 'open', counting_open, raising=False)
+    results = list(Scanner([path], archives=True).scan())
+    assert opened == [path]
+    assert sorted(results[:-1]) == [
+        (name, size, digest, None) for name, size, digest in expected(path)]
+    assert results[-1] == (path, len(data), md5(data), None)
+
+
+def test_big_zip(tmp_path, monkeypatch):
+    path = str(tmp_path / 'files.zip')
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data in FILES.items():
+            archive.writestr(name, data)
+    monkeypatch.setattr(archive_module, 'MAX_BUFFER', 10)
+    hasher = ArchiveHasher(path)
+    assert sorted(hasher.members()) == expected(path)
+    with open(path, 'rb') as zipfile_data:
+        assert hasher.digest == md5(zipfile_data.read())
+
+
+def test_small_zip(tmp_path):
+    path = str(tmp_path / 'files.zip')
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data in FILES.items():
+            archive.writestr(name, data)
+    hasher = ArchiveHasher(path)
+    assert sorted(hasher.members()) == expected(path)
+    assert hasher.error is None
+
+
+def patched_zip(flag_bits=0, method=None):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name in ('first', 'bad', 'last'):
+            archive.writestr(name, name.encode())
+    data = bytearray(buffer.getvalue())
+    # Patch the local and central directory headers of "bad".
+    for signature, flags in ((b'PK\x03\x04', 6), (b'PK\x01\x02', 8)):
+        start = 0
+        while True:
+            start = data.index(signature, start) + 1
+            header = start - 1
+            name_at = header + (30 if flags == 6 else 46)
+            if data[name_at:name_at + 3] == b'bad':
+                break
+        data[header + flags] |= flag_bits
+        if method is not None:
+            data[header + flags + 2:header + flags + 4] = \
+                method.to_bytes(2, 'little')
+    return bytes(data)
+
+
+@pytest.mark.parametrize('flag_bits,method', [
+    # Encrypted, so zipfile wants a password.
+    (0x1, None),
+    # Deflate64, which zipfile can't decompress.
+    (0, 9),
+])
+def test_unreadable_member(tmp_path, flag_bits, method):
+    data = patched_zip(flag_bits, method)
+    path = write(tmp_path / 'files.jar', data)
+    assert list(archive_members(path)) == [
+        (path + '!first', 5, md5(b'first')),
+        (path + '!bad', None, None),
+        (path + '!last', 4, md5(b'last')),
+    ]
+    # Inside another archive too, and the scan carries on past it.
+    outer = write(tmp_path / 'outer.tar', tar_bytes({'lib/files.jar': data}))
+    results = list(Scanner([str(tmp_path)], archives=True).scan())
+    found = dict((result.path, result.digest) for result in results)
+    assert found[outer + '!lib/files.jar!bad'] is None
+    assert found[outer + '!lib/files.jar!last'] == md5(b'last')
+    assert found[path + '!last'] == md5(b'last')
+    assert found[path] == md5(data)
+
+
+def test_damaged_zstd(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    data = zstandard.ZstdCompressor().compress(tar_bytes())
+    damaged = data[:8] + b'\xff' * 64 + data[72:]
+    path = write(tmp_path / 'outer.tar', tar_bytes({'files.tar.zst': damaged,
+                                                   'after': b'after'}))
+    assert sorted(archive_members(path)) == [
+        (path + '!after', 5, md5(b'after')),
+        (path + '!files.tar.zst', len(damaged), md5(damaged)),
+    ]
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_scanner(tmp_path, jobs):
+    archive = write(tmp_path / 'files.tar.gz', tar_bytes(mode='w:gz'))
+    write(tmp_path / 'plain', b'plain')
+    digests = {md5(b'plain'): 'known', md5(FILES['usr/bin/tool']): 'known'}
+
+    class Filters(object):
+        def lookup(self, digest):
+            return [digests[digest]] if digest in digests else []
+
+    results = list(Scanner([str(tmp_path)], Filters(), jobs,
+                           archives=True).scan())
+    paths = [result.path for result in results]
+    assert sorted(paths) == sorted(
+        [archive, str(tmp_path / 'plain')] +
+        [archive + '!' + name for name in FILES])
+    assert paths.index(archive) > paths.index(archive + '!empty')
+    found = dict((result.path, result.filters) for result in results)
+    assert found[archive + '!usr/bin/tool'] == ['known']
+    assert found[archive + '!empty'] == []
+
+    assert len(list(Scanner([str(tmp_path)]).scan())) == 2
@@ -0,0 +1,85 @@
+import hashlib
+import os
+from million_dollar_dream.baseline import (
+    Baseline, manifest_path, read_manifest, read_paths)
+from million_dollar_dream.output import Result
+from million_dollar_dream.scanner import Scanner
+
+
+def md5(contents):
+    return hashlib.md5(contents).hexdigest()
+
+
+def update(path, roots):
+    baseline = Baseline(path)
+    baseline.update(roots, Scanner(roots).scan())
+    baseline.save()
+    return baseline
+
+
+def test_incremental_update(tmp_path, monkeypatch):
+    host = tmp_path / 'host'
+    os.makedirs(str(host / 'bin'))
+    os.makedirs(str(host / 'lib'))
+    for name in ('ls', 'cat'):
+        (host / 'bin' / name).write_bytes(name.encode())
+    (host / 'lib' / 'libc').write_bytes(b'libc')
+    path = str(tmp_path / 'baseline')
+
+    baseline = update(path, [str(host)])
+    assert baseline.added == 3 and baseline.filter.count == 3
+    assert read_manifest(manifest_path(path)) == {
+        str(host / 'bin' / 'ls'): md5(b'ls'),
+        str(host / 'bin' / 'cat'): md5(b'cat'),
+        str(host / 'lib' / 'libc'): md5(b'libc'),
+    }
+
+    # An upgrade changes ls, removes lib and adds sh.
+    (host / 'bin' / 'ls').write_bytes(b'ls 2')
+    (host / 'bin' / 'sh').write_bytes(b'sh')
+    os.remove(str(host / 'lib' / 'libc'))
+    os.rmdir(str(host / 'lib'))
+    changed = tmp_path / 'changed'
+    changed.write_text('\n'.join(
+        ['host/bin/ls', 'host/bin/sh', 'host/lib', 'host/bin/cat', '']))
+    monkeypatch.chdir(str(tmp_path))
+    roots = sorted(read_paths([str(changed)]))
+    assert roots[0] == str(host / 'bin' / 'cat')
+
+    baseline = update(path, roots)
+    assert (baseline.added, baseline.removed, baseline.unchanged) == (2, 2, 1)
+    assert baseline.filter.count == 3
+    assert sorted(baseline.manifest) == [
+        str(host / 'bin' / name) for name in ('cat', 'ls', 'sh')]
+
+    exported = baseline.filter.to_bloomfilter()
+    assert all(exported.lookup(md5(contents))
+               for contents in (b'ls 2', b'sh', b'cat'))
+    assert not exported.lookup(md5(b'libc'))
+    assert not exported.lookup(md5(b'ls'))
+
+
+def test_shared_digests_and_errors(tmp_path):
+    path = str(tmp_path / 'baseline')
+    digest = md5(b'same')
+    baseline = Baseline(path)
+    baseline.update(['/a', '/b'], [Result('/a', 4, digest, None),
+                                   Result('/b', 4, digest, None)])
+    assert baseline.filter.count == 2
+    assert baseline.filter.capacity == 1000
+
+    # Removing one copy keeps the other, and unreadable files keep their
+    # old digest.
+    baseline.update(['/a', '/b'], [Result('/b', None, None, None)])
+    assert baseline.removed == 1
+    assert baseline.manifest == {'/b': digest}
+    assert baseline.filter.lookup(digest)
+
+    # A manifest that doesn't match the filter is reported, not fatal.
+    baseline.manifest['/c'] = md5(b'missing')
+    baseline.update(['/c'], [])
+    assert baseline.errors == 1 and '/c' not in baseline.manifest
+
+    # Siblings sharing a prefix aren't under each other.
+    baseline.manifest.update({'/ab': digest, '/a/x': digest})
+    assert baseline.under(['/a']) == {'/a/x'}
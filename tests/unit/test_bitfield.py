@@ -1,9 +1,21 @@
-from million_dollar_dream.bitfield import BitField
+import random
+import pytest
+from million_dollar_dream import bitfield as bitfield_module
+from million_dollar_dream.bitfield import PyBitField
+
+IMPLEMENTATIONS = [PyBitField]
+if bitfield_module.BitField is not PyBitField:
+    IMPLEMENTATIONS.append(bitfield_module.BitField)
+
+
+@pytest.fixture(params=IMPLEMENTATIONS, ids=lambda cls: cls.__module__)
+def BitField(request):
+    return request.param
 
 
 class TestBitField(object):
 
-    def test_zero_and_set(self):
+    def test_zero_and_set(self, BitField):
         size = 128
         bitfield = BitField(size)
         bitfield.zero()
@@ -12,7 +24,7 @@ class TestBitField(object):
             bitfield.setbit(position)
             assert bitfield.getbit(position) == 1
 
-    def test_one_and_unset(self):
+    def test_one_and_unset(self, BitField):
         size = 128
         bitfield = BitField(size)
         bitfield.one()
@@ -21,9 +33,21 @@ class TestBitField(object):
             bitfield.unsetbit(position)
             assert bitfield.getbit(position) == 0
 
-    def test_get_pos(self):
+    def test_get_pos(self, BitField):
         size = 128
         bitfield = BitField(size)
         position = bitfield.getpos(100)
         assert position.byte == 12
         assert position.bit == 4
+
+    def test_matches_python(self, BitField):
+        size = 1001
+        bitfield = BitField(size)
+        expected = PyBitField(size)
+        for position in random.Random(1).sample(range(size), 300):
+            bitfield.setbit(position)
+            expected.setbit(position)
+            assert bitfield.getpos(position) == expected.getpos(position)
+        assert bitfield.bitfield == expected.bitfield
+        for position in range(size):
+            assert bitfield.getbit(position) == expected.getbit(position)
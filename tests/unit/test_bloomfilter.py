@@ -1,6 +1,25 @@
 import os
+import pytest
+from million_dollar_dream import bloomfilter as bloomfilter_module
+from million_dollar_dream.bitfield import PyBitField
 from million_dollar_dream.bloomfilter import BloomFilter
+from million_dollar_dream.bloomfilter import compressions
 from million_dollar_dream.main import md5_file
+from million_dollar_dream import pymmh3
+
+COMPILED = bloomfilter_module.compiled
+
+
+@pytest.fixture(autouse=True, params=['python', 'compiled'])
+def implementation(request, monkeypatch):
+    # Every test runs against the pure-Python code and, when it has been
+    # built, the Cython extension.
+    if request.param == 'python':
+        monkeypatch.setattr(bloomfilter_module, 'compiled', None)
+        monkeypatch.setattr(bloomfilter_module, 'BitField', PyBitField)
+    elif COMPILED is None:
+        pytest.skip('Cython extension not built')
+    return request.param
 
 
 def test_accuracy():
@@ -76,3 +95,192 @@ def test_save_and_load(fs):
     assert new_bloom_filter.size == expected_size
 
 
+
+
+def test_save_and_load_compressed(fs):
+    fake_dir = '/var/data/'
+    fs.create_dir(fake_dir)
+    bloom_filter = BloomFilter(1000, 0.01)
+    for item in range(100):
+        bloom_filter.add(str(item))
+
+    for compression in compressions() + ['auto']:
+        fake_path = fake_dir + 'test_filter_' + compression
+        bloom_filter.save(fake_path, compression)
+        if compression != 'none':
+            assert os.path.getsize(fake_path) < bloom_filter.bytesize
+
+        new_bloom_filter = BloomFilter(5, 0.02)
+        new_bloom_filter.load(fake_path)
+        assert new_bloom_filter.size == bloom_filter.size
+        assert new_bloom_filter.hashcount == bloom_filter.hashcount
+        assert new_bloom_filter.filter.bitfield == bloom_filter.filter.bitfield
+        assert new_bloom_filter.lookup('99')
+        new_bloom_filter.add('100')
+        assert new_bloom_filter.lookup('100')
+
+
+def test_load_truncated(fs):
+    fake_path = '/var/data/test_filter'
+    fs.create_dir('/var/data/')
+    bloom_filter = BloomFilter(1000, 0.01)
+    bloom_filter.save(fake_path, 'zlib')
+    with open(fake_path, 'rb') as filterfile:
+        data = filterfile.read()
+    with open(fake_path, 'wb') as filterfile:
+        filterfile.write(data[:-10])
+    with pytest.raises(ValueError):
+        BloomFilter(1, 0.01).load(fake_path)
+
+
+def test_mapped(tmp_path):
+    path = str(tmp_path / 'mapped')
+    elements = [str(item) for item in range(2000)]
+    expected = BloomFilter(1000, 0.01)
+    expected.add_many(elements[:1000])
+
+    bloom_filter = BloomFilter(1000, 0.01, path)
+    assert os.path.getsize(path) == 32 + bloom_filter.bytesize
+    bloom_filter.add_many(elements[:500])
+    for element in elements[500:1000]:
+        bloom_filter.add(element)
+    assert bloom_filter.filter.bitfield == expected.filter.bitfield
+    bloom_filter.save(path)
+    bloom_filter.close()
+
+    loaded = BloomFilter(1, 0.01)
+    loaded.load(path)
+    assert loaded.filter.bitfield == expected.filter.bitfield
+
+    loaded.load(path, mapped=True)
+    assert loaded.mmap is not None
+    assert loaded.lookup_many(elements) == expected.lookup_many(elements)
+    assert loaded.lookup('999')
+    loaded.close()
+
+
+def test_mapped_save_compressed(tmp_path):
+    path = str(tmp_path / 'mapped')
+    bloom_filter = BloomFilter(1000, 0.01, path)
+    bloom_filter.add_many([str(item) for item in range(100)])
+    bloom_filter.save(path, 'zlib')
+    assert bloom_filter.lookup('99')
+    bloom_filter.close()
+
+    loaded = BloomFilter(1, 0.01)
+    loaded.load(path, mapped=True)
+    assert loaded.mmap is None
+    assert loaded.lookup('99')
+
+
+def test_lookup_many():
+    bloom_filter = BloomFilter(100, 0.01)
+    elements = [str(item) for item in range(200)]
+    for element in elements[:100]:
+        bloom_filter.add(element)
+    expected = [bloom_filter.lookup(element) for element in elements]
+    assert bloom_filter.lookup_many(elements) == expected
+    assert all(expected[:100])
+    assert bloom_filter.lookup_many([]) == []
+
+
+def test_compiled_matches_python(implementation):
+    if implementation == 'python':
+        pytest.skip('compares the compiled extension with pymmh3')
+    for key in ['', 'a', 'héllo', '5d41402abc4b2a76b9719d911017c592']:
+        for seed in [0, 1, 6, 0xdeadbeef]:
+            assert COMPILED.hash(key, seed) == pymmh3.hash(key, seed)
+
+    elements = [str(item) for item in range(500)]
+    bloom_filter = BloomFilter(300, 0.01)
+    bloom_filter.add_many(elements[:300])
+    expected = BloomFilter(300, 0.01)
+    expected.filter = PyBitField(expected.size)
+    for element in elements[:300]:
+        for seed in range(expected.hashcount):
+            expected.filter.setbit(pymmh3.hash(element, seed) % expected.size)
+    assert bloom_filter.filter.bitfield == expected.filter.bitfield
+    assert bloom_filter.lookup_many(elements) == \
+        [bloom_filter.lookup(element) for element in elements]
+
+
+def test_stats(tmp_path):
+    bloom_filter = BloomFilter(10000, 0.01)
+    assert bloom_filter.stats()['bits_set'] == 0
+    assert bloom_filter.stats()['items'] == 0
+    bloom_filter.add_many(str(item) for item in range(10000))
+    stats = bloom_filter.stats()
+    assert stats['bits_set'] == sum(
+        bin(byte).count('1') for byte in bloom_filter.filter.bitfield)
+    assert 0.45 < stats['fill'] < 0.55
+    assert abs(stats['items'] - 10000) < 200
+    assert stats['fp_rate'] == pytest.approx(0.01, rel=0.2)
+    assert not stats['saturated']
+
+    path = str(tmp_path / 'filter')
+    bloom_filter.save(path, 'zlib')
+    assert BloomFilter.file_stats(path) == stats
+
+    bloom_filter.add_many(str(item) for item in range(10000, 30000))
+    assert bloom_filter.stats()['saturated']
+    bloom_filter.filter.one()
+    assert bloom_filter.stats()['items'] is None
+    assert bloom_filter.stats()['fp_rate'] == 1.0
+
+
+def test_policies(tmp_path):
+    sizes = dict()
+    for policy in ('memory', 'balanced', 'lookup'):
+        bloom_filter = BloomFilter(10000, 0.01, policy=policy)
+        assert bloom_filter.policy == policy
+        sizes[policy] = (bloom_filter.size, bloom_filter.hashcount)
+    assert sizes['memory'][1] > sizes['balanced'][1] > sizes['lookup'][1]
+    assert sizes['memory'][0] < sizes['balanced'][0] < sizes['lookup'][0]
+    assert sizes['balanced'][0] <= 1.25 * sizes['memory'][0]
+    assert sizes['lookup'][0] <= 2 * sizes['memory'][0]
+
+    # Fewer hashes still reach the false positive rate.
+    bloom_filter = BloomFilter(10000, 0.01, policy='lookup')
+    bloom_filter.add_many(str(item) for item in range(10000))
+    assert bloom_filter.stats()['fp_rate'] < 0.011
+    absent = [str(item) for item in range(10000, 30000)]
+    assert sum(bloom_filter.lookup_many(absent)) < 20000 * 0.015
+
+    custom = BloomFilter(10000, 0.01, policy='lookup', hashcount=3)
+    assert custom.policy == 'custom' and custom.hashcount == 3
+    assert custom.size == BloomFilter.hashcount_size(10000, 0.01, 3)
+    with pytest.raises(ValueError):
+        BloomFilter(10000, 0.01, policy='fastest')
+    with pytest.raises(ValueError):
+        BloomFilter(10000, 0.01, hashcount=0)
+
+
+def test_policy_header(tmp_path):
+    path = str(tmp_path / 'filter')
+    bloom_filter = BloomFilter(1000, 0.01)
+    bloom_filter.save(path)
+    # The default policy keeps the original layout.
+    assert os.path.getsize(path) == 32 + bloom_filter.bytesize
+
+    bloom_filter = BloomFilter(1000, 0.01, path, policy='lookup')
+    bloom_filter.add_many(str(item) for item in range(1000))
+    bloom_filter.save(path)
+    bloom_filter.close()
+    with open(path, 'rb') as filterfile:
+        header = BloomFilter.read_header(filterfile)
+    assert header['policy'] == 'lookup'
+    assert header['compression'] == 'none'
+
+    for mapped in (False, True):
+        loaded = BloomFilter(1, 0.01)
+        loaded.load(path, mapped)
+        assert loaded.policy == 'lookup'
+        assert loaded.hashcount == bloom_filter.hashcount
+        assert all(loaded.lookup_many(str(item) for item in range(1000)))
+        loaded.close()
+
+    loaded.load(path)
+    loaded.save(path, 'zlib')
+    loaded = BloomFilter(1, 0.01)
+    loaded.load(path)
+    assert loaded.policy == 'lookup'
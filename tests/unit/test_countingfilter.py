@@ -0,0 +1,82 @@
+import pytest
+from million_dollar_dream import countingfilter as countingfilter_module
+from million_dollar_dream.bloomfilter import BloomFilter
+from million_dollar_dream.countingfilter import (
+    COUNTER_MAX, CountingBloomFilter)
+
+
+def test_add_remove_lookup():
+    elements = [str(item) for item in range(1000)]
+    counting_filter = CountingBloomFilter(1000, 0.01)
+    assert len(counting_filter.counters) == (counting_filter.size + 1) // 2
+    for element in elements:
+        counting_filter.add(element)
+    assert counting_filter.count == 1000
+    assert all(counting_filter.lookup(element) for element in elements)
+
+    for element in elements[:500]:
+        counting_filter.remove(element)
+    assert counting_filter.count == 500
+    assert all(counting_filter.lookup(element) for element in elements[500:])
+    assert sum(counting_filter.lookup(element)
+               for element in elements[:500]) < 20
+
+    with pytest.raises(ValueError):
+        counting_filter.remove('never added')
+    assert counting_filter.count == 500
+
+    # Duplicates are counted.
+    counting_filter.add(elements[500])
+    counting_filter.remove(elements[500])
+    assert counting_filter.lookup(elements[500])
+
+
+def test_saturated_counters():
+    counting_filter = CountingBloomFilter(10, 0.01)
+    for _ in range(COUNTER_MAX + 5):
+        counting_filter.add('busy')
+    positions = counting_filter.positions('busy')
+    assert all(counting_filter.counter(position) == COUNTER_MAX
+               for position in positions)
+    for _ in range(COUNTER_MAX + 5):
+        counting_filter.remove('busy')
+    # Counters that overflowed never go back down.
+    assert counting_filter.lookup('busy')
+
+
+@pytest.mark.parametrize('vectorized', [True, False])
+def test_to_bloomfilter(monkeypatch, vectorized):
+    if not vectorized:
+        monkeypatch.setattr(countingfilter_module, 'numpy', None)
+    elif countingfilter_module.numpy is None:
+        pytest.skip('NumPy is not installed')
+    elements = [str(item) for item in range(2000)]
+    counting_filter = CountingBloomFilter(1000, 0.01, policy='lookup')
+    for element in elements:
+        counting_filter.add(element)
+    for element in elements[1000:]:
+        counting_filter.remove(element)
+
+    expected = BloomFilter(1000, 0.01, policy='lookup')
+    expected.add_many(elements[:1000])
+    exported = counting_filter.to_bloomfilter()
+    assert (exported.size, exported.hashcount, exported.policy) == \
+        (expected.size, expected.hashcount, 'lookup')
+    assert bytes(exported.filter.bitfield) == bytes(expected.filter.bitfield)
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'counting')
+    counting_filter = CountingBloomFilter(1000, 0.01, hashcount=3)
+    for item in range(100):
+        counting_filter.add(str(item))
+    counting_filter.save(path)
+
+    loaded = CountingBloomFilter.load(path)
+    assert loaded.counters == counting_filter.counters
+    assert (loaded.size, loaded.hashcount, loaded.policy, loaded.capacity,
+            loaded.count) == (counting_filter.size, 3, 'custom', 1000, 100)
+
+    BloomFilter(1000, 0.01).save(path)
+    with pytest.raises(ValueError):
+        CountingBloomFilter.load(path)
@@ -0,0 +1,43 @@
+import os
+import pytest
+from million_dollar_dream.delta import apply_delta
+from million_dollar_dream.delta import decode_varint
+from million_dollar_dream.delta import encode_varint
+from million_dollar_dream.delta import make_delta
+
+
+def test_varint_roundtrip():
+    for value in [0, 1, 127, 128, 300, 2 ** 40]:
+        encoded = encode_varint(value)
+        assert decode_varint(encoded + b'\xff', 0) == (value, len(encoded))
+
+
+def test_make_and_apply_delta():
+    old = bytearray(os.urandom(65536))
+    new = bytearray(old)
+    for position in [0, 1, 5, 4000, 4001, 65535]:
+        new[position] ^= 0x10
+    delta = make_delta(bytes(old), bytes(new))
+    assert len(delta) < 100
+
+    apply_delta(old, delta)
+    assert old == new
+
+
+def test_identical_files():
+    data = bytearray(b'\x01' * 1024)
+    apply_delta(data, make_delta(bytes(data), bytes(data)))
+    assert data == b'\x01' * 1024
+
+
+def test_bad_deltas():
+    with pytest.raises(ValueError):
+        make_delta(b'\x00' * 4, b'\x00' * 5)
+
+    delta = make_delta(b'\x00' * 4, b'\x00\x01\x00\x00')
+    with pytest.raises(ValueError):
+        apply_delta(bytearray(5), delta)
+    with pytest.raises(ValueError):
+        apply_delta(bytearray(4), b'NOTDELTA' + delta[8:])
+    with pytest.raises(ValueError):
+        apply_delta(bytearray(4), delta[:-4])
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import pytest
+from million_dollar_dream.bloomfilter import BloomFilter
+from million_dollar_dream.digeststore import (
+    DigestStore, DigestStoreWriter, store_path)
+
+
+def digests(count, salt=''):
+    return [hashlib.md5((salt + str(item)).encode()).hexdigest()
+            for item in range(count)]
+
+
+def write_store(path, items, run_size=1000):
+    writer = DigestStoreWriter(path, run_size=run_size)
+    writer.add_many(items)
+    return writer.close()
+
+
+def test_write_and_find(tmp_path):
+    path = str(tmp_path / 'store')
+    present = digests(2500)
+    # Duplicates and upper case are stored once.
+    count = write_store(path, present + present[:100] +
+                        [digest.upper() for digest in present[100:200]])
+    assert count == 2500
+    assert not [name for name in os.listdir(str(tmp_path))
+                if name != 'store']
+
+    store = DigestStore(path)
+    assert len(store) == 2500
+    assert all(digest in store for digest in present)
+    assert present[0].upper() in store
+    assert not any(digest in store for digest in digests(2500, 'absent'))
+    assert 'not hex' not in store
+    assert 'abcd' not in store
+    store.close()
+
+
+def test_runs_match_single_pass(tmp_path):
+    items = digests(3000)
+    write_store(str(tmp_path / 'runs'), items, run_size=100)
+    write_store(str(tmp_path / 'single'), items, run_size=10000)
+    with open(str(tmp_path / 'runs'), 'rb') as runs, \
+            open(str(tmp_path / 'single'), 'rb') as single:
+        assert runs.read() == single.read()
+
+
+def test_skewed_digests(tmp_path):
+    # Identical prefixes defeat interpolation, so this relies on bisection.
+    path = str(tmp_path / 'store')
+    items = ['00' * 12 + '%08x' % (item * 3) for item in range(1000)]
+    write_store(path, items)
+    store = DigestStore(path)
+    for item in range(3000):
+        assert ('00' * 12 + '%08x' % item in store) == (item % 3 == 0)
+
+
+def test_empty_and_invalid(tmp_path):
+    path = str(tmp_path / 'store')
+    assert write_store(path, []) == 0
+    store = DigestStore(path)
+    assert len(store) == 0
+    assert digests(1)[0] not in store
+
+    with pytest.raises(ValueError):
+        DigestStoreWriter(path).add('abcd')
+    with open(path, 'ab') as storefile:
+        storefile.write(b'\x00' * 5)
+    with pytest.raises(ValueError):
+        DigestStore(path)
+    with open(path, 'wb') as storefile:
+        storefile.write(b'\x00' * 32)
+    with pytest.raises(ValueError):
+        DigestStore(path)
+
+
+def test_filter_false_positives(tmp_path):
+    path = str(tmp_path / 'filter')
+    present = digests(50)
+    bloom_filter = BloomFilter(50, 0.3)
+    bloom_filter.add_many(present)
+    bloom_filter.save(path)
+    write_store(store_path(path), present)
+
+    absent = digests(2000, 'absent')
+    false_positives = [digest for digest, found
+                       in zip(absent, bloom_filter.lookup_many(absent))
+                       if found]
+    assert false_positives
+
+    loaded = BloomFilter(1, 0.01)
+    loaded.load(path)
+    assert loaded.digests is not None
+    assert all(loaded.lookup_many(present))
+    assert not any(loaded.lookup_many(absent))
+    assert not any(loaded.lookup(digest) for digest in false_positives)
+    assert loaded.probe_many(false_positives) == [True] * len(false_positives)
+
+    # Adding to the filter makes the store incomplete, so it's dropped.
+    loaded.add(false_positives[0])
+    assert loaded.digests is None
+    assert loaded.lookup(false_positives[0])
+
+
+def test_filter_closes_store(tmp_path):
+    path = str(tmp_path / 'filter')
+    present = digests(50)
+    bloom_filter = BloomFilter(50, 0.01)
+    bloom_filter.add_many(present)
+    bloom_filter.save(path)
+    write_store(store_path(path), present)
+
+    loaded = BloomFilter(1, 0.01)
+    loaded.load(path)
+    store = loaded.digests
+    # Reloading, adding and closing each close the store they replace.
+    loaded.load(path)
+    assert store.mmap is None
+    store = loaded.digests
+    loaded.add(digests(1, 'new')[0])
+    assert store.mmap is None
+    loaded.load(path)
+    store = loaded.digests
+    loaded.close()
+    assert store.mmap is None and loaded.digests is None
@@ -0,0 +1,113 @@
+import hashlib
+import pytest
+from million_dollar_dream.bloomfilter import BloomFilter
+from million_dollar_dream.digeststore import DigestStoreWriter, store_path
+from million_dollar_dream.diskfilter import DiskBloomFilter
+from million_dollar_dream.filterbank import FilterBank
+
+
+def digests(count, salt=''):
+    return [hashlib.md5((salt + str(item)).encode()).hexdigest()
+            for item in range(count)]
+
+
+def save_filter(path, elements, fp_rate=0.01, compression=None):
+    bloom_filter = BloomFilter(len(elements), fp_rate)
+    bloom_filter.add_many(elements)
+    bloom_filter.save(path, compression)
+    return bloom_filter
+
+
+def test_matches_bloomfilter(tmp_path):
+    path = str(tmp_path / 'filter')
+    present = digests(20000)
+    bloom_filter = save_filter(path, present)
+    elements = present[:2000] + digests(2000, 'absent')
+
+    disk_filter = DiskBloomFilter(path)
+    assert disk_filter.size == bloom_filter.size
+    assert disk_filter.hashcount == bloom_filter.hashcount
+    assert disk_filter.lookup_many(elements) == \
+        bloom_filter.lookup_many(elements)
+    assert disk_filter.lookup(present[0])
+    assert disk_filter.lookup_many([]) == []
+    disk_filter.close()
+
+
+def test_legacy_layout(tmp_path):
+    path = str(tmp_path / 'filter')
+    present = digests(1000)
+    bloom_filter = BloomFilter(1000, 0.01, path)
+    bloom_filter.add_many(present)
+    bloom_filter.save(path)
+    bloom_filter.close()
+
+    disk_filter = DiskBloomFilter(path)
+    assert disk_filter.offset == 32
+    assert all(disk_filter.lookup_many(present))
+    disk_filter.close()
+
+
+def test_bounded_cache(tmp_path):
+    path = str(tmp_path / 'filter')
+    present = digests(50000)
+    save_filter(path, present)
+
+    disk_filter = DiskBloomFilter(path, cache_pages=4)
+    assert all(disk_filter.lookup_many(present))
+    assert len(disk_filter.cache) <= 4
+    # Probes in neighbouring pages share reads.
+    assert disk_filter.reads < disk_filter.pages_read
+    disk_filter.close()
+    assert not disk_filter.cache
+
+    # Repeated lookups are served from cache.
+    disk_filter = DiskBloomFilter(path)
+    disk_filter.lookup(present[0])
+    pages_read, cache_hits = disk_filter.pages_read, disk_filter.cache_hits
+    disk_filter.lookup(present[0])
+    assert disk_filter.pages_read == pages_read
+    assert disk_filter.cache_hits - cache_hits == disk_filter.hashcount
+    disk_filter.close()
+
+
+def test_digest_store(tmp_path):
+    path = str(tmp_path / 'filter')
+    present = digests(50)
+    bloom_filter = save_filter(path, present, fp_rate=0.3)
+    writer = DigestStoreWriter(store_path(path))
+    writer.add_many(present)
+    writer.close()
+
+    absent = digests(2000, 'absent')
+    assert any(bloom_filter.lookup_many(absent))
+    disk_filter = DiskBloomFilter(path)
+    assert all(disk_filter.lookup_many(present))
+    assert not any(disk_filter.lookup_many(absent))
+    disk_filter.close()
+
+
+def test_invalid(tmp_path):
+    path = str(tmp_path / 'filter')
+    save_filter(path, digests(1000), compression='zlib')
+    with pytest.raises(ValueError):
+        DiskBloomFilter(path)
+
+    save_filter(path, digests(1000))
+    with open(path, 'r+b') as filterfile:
+        filterfile.truncate(100)
+    with pytest.raises(ValueError):
+        DiskBloomFilter(path)
+
+
+def test_filterbank(tmp_path):
+    present = digests(1000)
+    save_filter(str(tmp_path / 'first'), present[:500])
+    save_filter(str(tmp_path / 'second'), present[500:])
+
+    bank = FilterBank()
+    bank.load(str(tmp_path), on_disk=True)
+    assert all(isinstance(bloom_filter, DiskBloomFilter)
+               for bloom_filter in bank.filters.values())
+    matches = bank.lookup_many(present[499:501])
+    assert matches == [['first'], ['second']]
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import pytest
+from million_dollar_dream.bloomfilter import BloomFilter
+from million_dollar_dream.digeststore import DigestStoreWriter, store_path
+from million_dollar_dream import filterbank
+from million_dollar_dream.filterbank import (
+    UNION, FilterBank, LookupMemo, build_union, entry_size, filter_paths,
+    or_bytes)
+
+
+def digests(count, salt=''):
+    return [hashlib.md5((salt + str(item)).encode()).hexdigest()
+            for item in range(count)]
+
+
+def save_filter(path, elements, expected=None, store=True):
+    bloom_filter = BloomFilter(expected or len(elements), 0.01)
+    bloom_filter.add_many(elements)
+    bloom_filter.save(path)
+    if store:
+        writer = DigestStoreWriter(store_path(path))
+        writer.add_many(elements)
+        writer.close()
+
+
+@pytest.fixture
+def bank_dir(tmp_path):
+    # Overlapping filters, like consecutive releases of an OS.
+    present = digests(3000)
+    save_filter(str(tmp_path / 'first'), present[:2000])
+    save_filter(str(tmp_path / 'second'), present[1000:])
+    os.mkdir(str(tmp_path / 'more'))
+    save_filter(str(tmp_path / 'more' / 'third'), present[2500:])
+    return tmp_path
+
+
+def test_union_rebuild(bank_dir):
+    union, method = build_union(str(bank_dir))
+    assert method == 'rebuild'
+    assert union.size == BloomFilter(3000, 0.01).size
+    assert [name for name, _ in filter_paths(str(bank_dir))] == \
+        ['first', 'second', os.path.join('more', 'third')]
+    with open(str(bank_dir / (UNION + '.json'))) as memberfile:
+        assert sorted(json.load(memberfile)['members']) == \
+            ['first', os.path.join('more', 'third'), 'second']
+
+    present = digests(3000)
+    absent = digests(3000, 'absent')
+    bank = FilterBank()
+    bank.load(str(bank_dir))
+    assert bank.union is not None
+    assert len(bank) == 3
+    assert all(bank.union.lookup_many(present))
+    elements = present + absent
+    expected = FilterBank(bank.filters).lookup_many(elements)
+    assert bank.lookup_many(elements) == expected
+    assert bank.lookup(present[1500]) == ['first', 'second']
+    assert not any(bank.lookup_many(absent))
+
+
+def test_union_or(tmp_path):
+    present = digests(2000)
+    save_filter(str(tmp_path / 'first'), present[:1000], 2000, False)
+    save_filter(str(tmp_path / 'second'), present[1000:], 2000, False)
+    union, method = build_union(str(tmp_path))
+    assert method == 'or'
+
+    expected = BloomFilter(2000, 0.01)
+    expected.add_many(present)
+    assert union.filter.bitfield == expected.filter.bitfield
+
+    bank = FilterBank()
+    bank.load(str(tmp_path), on_disk=True)
+    assert bank.union is not None
+    assert [bool(names) for names in bank.lookup_many(present)] == \
+        [True] * 2000
+
+
+def test_union_refused(tmp_path):
+    with pytest.raises(ValueError):
+        build_union(str(tmp_path))
+    save_filter(str(tmp_path / 'first'), digests(1000), store=False)
+    save_filter(str(tmp_path / 'second'), digests(2000), store=False)
+    with pytest.raises(ValueError):
+        build_union(str(tmp_path))
+    assert not os.path.exists(str(tmp_path / UNION))
+
+
+def test_stale_union(bank_dir):
+    build_union(str(bank_dir))
+    save_filter(str(bank_dir / 'fourth'), digests(100, 'new'))
+    bank = FilterBank()
+    bank.load(str(bank_dir))
+    assert bank.union is None
+    assert bank.lookup(digests(100, 'new')[0]) == ['fourth']
+
+    build_union(str(bank_dir))
+    bank.load(str(bank_dir))
+    assert bank.union is not None
+    # Filters added by hand aren't in the union.
+    bank.add('extra', BloomFilter(10, 0.01))
+    assert bank.union is None
+
+
+def test_lookup_memo():
+    present = digests(10)
+    bloom_filter = BloomFilter(100, 0.001)
+    bloom_filter.add_many(present[:5])
+    bank = FilterBank(dict(first=bloom_filter))
+    memo = LookupMemo(max_entries=3)
+    assert memo.lookup(bank, present[0]) == (['first'], False)
+    assert memo.lookup(bank, present[0]) == (['first'], True)
+    assert memo.lookup(bank, present[9]) == ([], False)
+    assert memo.lookup(bank, present[9]) == ([], True)
+    assert (memo.hits, memo.misses) == (2, 2)
+
+    # The least recently used entry is evicted.
+    memo.lookup(bank, present[1])
+    memo.lookup(bank, present[0])
+    memo.lookup(bank, present[2])
+    assert list(memo.entries) == [present[1], present[0], present[2]]
+
+    # Changing a filter, or the bank, forgets every entry.
+    bloom_filter.add(present[9])
+    assert memo.lookup(bank, present[9]) == (['first'], False)
+    assert len(memo) == 1
+    replaced = BloomFilter(100, 0.001)
+    bank.add('second', replaced)
+    assert memo.lookup(bank, present[9]) == (['first'], False)
+    second = BloomFilter(100, 0.001)
+    second.add(present[9])
+    bank.add('second', second)
+    assert memo.lookup(bank, present[9]) == (['first', 'second'], False)
+
+    # Filters no longer in the bank don't invalidate it.
+    changes = bank.changes
+    replaced.add(present[8])
+    assert bank.changes == changes
+    second.add(present[8])
+    assert bank.changes == changes + 1
+    # Every bank holding a filter hears about its changes.
+    other = FilterBank(dict(second=second))
+    second.add(present[7])
+    assert (bank.changes, other.changes) == (changes + 2, 1)
+
+
+def test_lookup_memo_bytes():
+    bank = FilterBank(dict(first=BloomFilter(100, 0.001)))
+    limit = 5 * entry_size(digests(1)[0], ())
+    memo = LookupMemo(max_entries=None, max_bytes=limit)
+    for digest in digests(20):
+        memo.lookup(bank, digest)
+    assert len(memo) == 5
+    assert memo.bytes <= limit
+    memo.clear()
+    assert (len(memo), memo.bytes) == (0, 0)
+
+
+@pytest.mark.parametrize('vectorized', [True, False])
+def test_or_bytes(monkeypatch, vectorized):
+    if not vectorized:
+        monkeypatch.setattr(filterbank, 'numpy', None)
+    elif filterbank.numpy is None:
+        pytest.skip('NumPy is not installed')
+    bits = bytearray(b'\x01\x00\xf0\x0f')
+    or_bytes(memoryview(bits)[1:3], b'\x81\x0f')
+    assert bits == bytearray(b'\x01\x81\xff\x0f')
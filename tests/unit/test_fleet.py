@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import threading
+import pytest
+from million_dollar_dream import fleet
+from million_dollar_dream.fleet import (
+    Agent, Collector, CollectorServer, decode_batch, encode_record,
+    parse_address, split_records)
+from million_dollar_dream.output import Result
+
+
+def digest(name):
+    return hashlib.md5(name.encode()).hexdigest()
+
+
+def unknown(directory):
+    with open(str(directory / fleet.UNKNOWN)) as unknownfile:
+        return [json.loads(line) for line in unknownfile]
+
+
+@pytest.fixture
+def collector(tmp_path):
+    collector = Collector(str(tmp_path / 'collected'), capacity=1000)
+    collector.open()
+    server = CollectorServer(('127.0.0.1', 0), collector)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    collector.address = server.server_address
+    yield collector
+    server.shutdown()
+    server.server_close()
+    collector.close()
+
+
+def test_parse_address():
+    assert parse_address('collector:9000') == ('collector', 9000)
+    assert parse_address('9000', '') == ('', 9000)
+    assert parse_address('[::1]:9000') == ('::1', 9000)
+    with pytest.raises(ValueError):
+        parse_address('collector')
+    with pytest.raises(ValueError):
+        parse_address('collector:70000')
+
+
+def test_batches():
+    records = [(digest('a'), '/bin/a'), (digest('b'), None),
+               (digest('c'), '/café/\udcff')]
+    payload = fleet.zlib.compress(b''.join(encode_record(*record)
+                                           for record in records))
+    assert decode_batch(payload) == [
+        (digest('a'), '/bin/a'), (digest('b'), ''),
+        (digest('c'), '/café/\udcff')]
+    with pytest.raises(ValueError):
+        encode_record('ab' * 32, '/sha256')
+    with pytest.raises(ValueError):
+        decode_batch(fleet.zlib.compress(encode_record(digest('a'),
+                                                       '/a')[:-1]))
+    with pytest.raises(ValueError):
+        decode_batch(b'not zlib')
+    encoded = [encode_record(*record) for record in records]
+    assert split_records(b''.join(encoded) + encoded[0][:-1]) == encoded
+
+
+def test_agents(collector, tmp_path):
+    def run(host, names, unique):
+        agent = Agent(collector.address, host, batch_size=7, unique=unique)
+        agent.connect()
+        for name in names:
+            # Files found in a filter, and unreadable ones, aren't sent.
+            agent.write(Result('/' + host + '/known', 1, digest('known'),
+                               ['filter']))
+            agent.write(Result('/' + host + '/unreadable', None, None,
+                               None))
+            agent.write(Result('/' + host + '/' + name, 1, digest(name), []))
+        agent.close()
+        agents[host] = agent
+
+    agents = dict()
+    # Every host has the shared files, twice over.
+    shared = ['shared%d' % index for index in range(20)] * 2
+    threads = [
+        threading.Thread(target=run, args=(
+            'host%d' % index, shared + ['own%d' % index], index % 2 == 0))
+        for index in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert agents['host0'].sent == 21
+    assert agents['host1'].sent == 41
+    assert sum(agent.new for agent in agents.values()) == 24
+    reported = unknown(tmp_path / 'collected')
+    assert sorted(entry['digest'] for entry in reported) == sorted(
+        set(digest(name) for name in shared + ['own0', 'own1', 'own2',
+                                               'own3']))
+    own = [entry for entry in reported if entry['path'] == '/host2/own2']
+    assert own[0]['host'] == 'host2'
+    assert collector.reports['host3'] == 41
+
+    # Digests recorded before aren't reported again.
+    agent = Agent(collector.address, 'late')
+    agent.connect()
+    agent.write(Result('/late/shared0', 1, digest('shared0'), []))
+    agent.write(Result('/late/new', 1, digest('new'), []))
+    agent.close()
+    assert (agent.sent, agent.new) == (2, 1)
+    assert len(unknown(tmp_path / 'collected')) == 25
+
+
+def test_restart(tmp_path):
+    directory = tmp_path / 'collected'
+    collector = Collector(str(directory), capacity=1000)
+    collector.open()
+    assert collector.receive('host', [(digest('a'), '/a')]) == 1
+    collector.close()
+
+    # Written after the filter was saved, ex: before a crash.
+    collector = Collector(str(directory), capacity=1000)
+    collector.open()
+    assert collector.receive('host', [(digest('b'), '/b')]) == 1
+    collector.unknown.write(b'{"digest": "trunc')
+    collector.unknown.close()
+
+    collector = Collector(str(directory), capacity=1000)
+    collector.open()
+    assert collector.receive('host', [(digest('a'), '/a'),
+                                      (digest('b'), '/b'),
+                                      (digest('c'), '/c')]) == 1
+    collector.close()
+    with open(str(directory / fleet.UNKNOWN)) as unknownfile:
+        lines = unknownfile.read().splitlines()
+    assert len(lines) == 4
+    assert json.loads(lines[3])['path'] == '/c'
+
+
+def test_collector_killed(collector):
+    listener = fleet.socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    batches = []
+
+    def serve():
+        # Acknowledge one batch, then die while reading the next.
+        sock, _ = listener.accept()
+        stream = sock.makefile('rb')
+        fleet.read_frame(stream)
+        batches.append(fleet.read_frame(stream))
+        fleet.write_frame(sock, fleet.ACK, fleet.ACKNOWLEDGE.pack(2, 2))
+        batches.append(fleet.read_frame(stream))
+        stream.close()
+        sock.close()
+        listener.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    agent = Agent(listener.getsockname(), 'host', batch_size=2)
+    agent.connect()
+
+    def send(*names):
+        for name in names:
+            agent.write(Result('/' + name, 1, digest(name), []))
+
+    send('a', 'b')
+    assert (agent.sent, agent.dropped) == (2, 0)
+    with pytest.raises(OSError):
+        send('c', 'd')
+    thread.join()
+    assert len(batches) == 2
+    assert (agent.sock, agent.dropped) == (None, 2)
+
+    # Batches are dropped until it's time to reconnect, then the failed
+    # attempt backs off further.
+    send('e', 'f')
+    assert agent.dropped == 4
+    agent.retry_at = 0.0
+    with pytest.raises(OSError):
+        send('g', 'h')
+    assert (agent.dropped, agent.delay) == (6, 4 * fleet.RETRY_DELAY)
+    # Nothing is sent again on close.
+    send('i')
+    agent.close()
+    assert (agent.sent, agent.dropped) == (2, 7)
+
+    # A collector that comes back gets later batches.
+    agent.address = collector.address
+    agent.retry_at = 0.0
+    send('j', 'k')
+    agent.close()
+    assert (agent.sent, agent.new, agent.delay) == (4, 4, fleet.RETRY_DELAY)
+
+
+def test_collector_stopped(tmp_path):
+    directory = str(tmp_path / 'collected')
+    spool = str(tmp_path / 'unsent')
+
+    def start(port=0):
+        collector = Collector(directory, capacity=1000)
+        collector.open()
+        server = CollectorServer(('127.0.0.1', port), collector)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return collector, server
+
+    def stop(collector, server):
+        server.shutdown()
+        server.server_close()
+        collector.close()
+
+    def send(agent, *names):
+        for name in names:
+            agent.write(Result('/' + name, 1, digest(name), []))
+
+    collector, server = start()
+    address = server.server_address
+    agent = Agent(address, 'host', batch_size=2, spool=spool)
+    agent.connect()
+    send(agent, 'a', 'b')
+    # The collector stops partway through the run.
+    stop(collector, server)
+    with pytest.raises(OSError):
+        send(agent, 'c', 'd')
+    send(agent, 'e', 'f', 'g')
+    agent.close()
+    assert (agent.sent, agent.spooled, agent.dropped) == (2, 5, 0)
+
+    # The next run sends them first once the collector is back.
+    collector, server = start(address[1])
+    agent = Agent(address, 'host', batch_size=2, spool=spool)
+    agent.connect()
+    assert (agent.sent, agent.spooled) == (5, 0)
+    assert not os.path.exists(spool)
+    agent.close()
+    stop(collector, server)
+    assert sorted(entry['path'] for entry in unknown(tmp_path / 'collected')) \
+        == ['/a', '/b', '/c', '/d', '/e', '/f', '/g']
+
+
+def test_bad_agent(collector):
+    sock = fleet.socket.create_connection(collector.address)
+    fleet.write_frame(sock, fleet.HELLO, b'nonsense')
+    # The collector hangs up on anything that isn't an agent.
+    assert sock.recv(1) == b''
+    sock.close()
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import pytest
+from million_dollar_dream.bloomfilter import BloomFilter
+from million_dollar_dream.filterbank import FilterBank, LookupMemo
+from million_dollar_dream.identify import (
+    Identifier, SampledScanner, size_class, wilson_interval)
+
+
+def test_wilson_interval():
+    assert wilson_interval(0, 0) == (0.0, 1.0)
+    low, high = wilson_interval(50, 100)
+    assert low == pytest.approx(0.4038, abs=1e-4)
+    assert high == pytest.approx(0.5962, abs=1e-4)
+    low, high = wilson_interval(0, 20)
+    assert low == 0.0 and 0 < high < 0.2
+    low, high = wilson_interval(20, 20)
+    assert 0.8 < low < 1 and high == 1.0
+    # More samples, narrower interval.
+    low, high = wilson_interval(500, 1000)
+    assert high - low < 0.07
+
+
+def test_stratified_order(tmp_path):
+    # A big directory of small files and a small directory of big ones.
+    os.mkdir(str(tmp_path / 'many'))
+    os.mkdir(str(tmp_path / 'few'))
+    for item in range(90):
+        (tmp_path / 'many' / str(item)).write_bytes(b'x')
+    for item in range(10):
+        (tmp_path / 'few' / str(item)).write_bytes(b'x' * 5000)
+    assert size_class(1) != size_class(5000)
+
+    scanner = SampledScanner([str(tmp_path)], seed=1)
+    order = list(scanner.walk())
+    assert scanner.total == 100
+    assert len(set(order)) == 100
+    # Every prefix holds the strata in proportion.
+    for length in (10, 20, 50):
+        few = sum(1 for path in order[:length]
+                  if os.sep + 'few' + os.sep in path)
+        assert abs(few - length // 10) <= 1
+    assert order == list(SampledScanner([str(tmp_path)], seed=1).walk())
+
+    # Only limit files are kept per stratum, still in proportion.
+    scanner = SampledScanner([str(tmp_path)], seed=1, limit=20)
+    sample = list(scanner.walk())
+    assert scanner.total == 100
+    assert len(sample) == 20 and len(set(sample)) == 20
+    few = sum(1 for path in sample if os.sep + 'few' + os.sep in path)
+    assert abs(few - 2) <= 1
+
+
+def test_identify(tmp_path):
+    os.mkdir(str(tmp_path / 'image'))
+    digests = []
+    for item in range(400):
+        contents = b'file %d' % item
+        (tmp_path / 'image' / str(item)).write_bytes(contents)
+        digests.append(hashlib.md5(contents).hexdigest())
+
+    # "best" holds 90% of the files, "close" 80% and "other" 10%.
+    filters = dict(best=digests[:360], close=digests[40:360],
+                   other=digests[:40])
+    bank = FilterBank()
+    for name, elements in filters.items():
+        bank.add(name, BloomFilter(400, 0.001))
+        bank.filters[name].add_many(elements)
+
+    identifier = Identifier(bank.filters)
+    scanner = SampledScanner([str(tmp_path / 'image')], bank, seed=2)
+    assert identifier.consume(scanner.scan(), 5000)
+    assert identifier.samples < 400
+    ranking = identifier.ranking()
+    assert [name for name, _, _, _ in ranking] == ['best', 'close', 'other']
+    assert ranking[0][2] > ranking[1][3]
+    assert ranking[0][2] <= 0.9 <= ranking[0][3]
+    text = identifier.format_text(2)
+    assert 'best' in text and 'other' not in text
+
+    # Filters that can't be told apart sample up to the limit.
+    bank = FilterBank(dict(first=bank.filters['best'],
+                           second=bank.filters['best']))
+    identifier = Identifier(bank.filters)
+    memo = LookupMemo()
+    scanner = SampledScanner([str(tmp_path / 'image')], bank, seed=2,
+                             memo=memo)
+    assert not identifier.consume(scanner.scan(), 150)
+    assert identifier.samples == 150
+    assert memo.misses >= 150
@@ -0,0 +1,97 @@
+import errno
+import hashlib
+import os
+import subprocess
+import sys
+import time
+import zipfile
+import pytest
+from million_dollar_dream import impact as impact_module
+from million_dollar_dream.impact import CHUNK, LowImpact, TokenBucket
+from million_dollar_dream.instrument import ScanStats
+from million_dollar_dream.scanner import Scanner
+
+
+def test_token_bucket():
+    bucket = TokenBucket(1000, 10)
+    assert bucket.take(10) == 0
+    start = time.monotonic()
+    waited = bucket.take(100)
+    assert 0.08 < waited < 0.2
+    assert time.monotonic() - start >= waited
+    # The wait was paid for, so the next caller waits for its own tokens.
+    assert 0 < bucket.take(10) < 0.05
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_md5_file(tmp_path, direct):
+    low_impact = LowImpact(direct=direct)
+    for size in (0, 1, 4096, CHUNK + 123):
+        path = tmp_path / ('file%d' % size)
+        data = os.urandom(size)
+        path.write_bytes(data)
+        assert low_impact.md5_file(str(path)) == hashlib.md5(data).hexdigest()
+    with pytest.raises(OSError):
+        low_impact.md5_file(str(tmp_path / 'missing'))
+
+
+def test_direct_fallback(tmp_path, monkeypatch):
+    path = tmp_path / 'file'
+    data = os.urandom(CHUNK * 2 + 7)
+    path.write_bytes(data)
+    preadv = os.preadv
+    calls = []
+
+    def unaligned(fd, buffers, offset):
+        calls.append(offset)
+        if offset and len(calls) == 2:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        return preadv(fd, buffers, offset)
+
+    monkeypatch.setattr(impact_module.os, 'preadv', unaligned)
+    low_impact = LowImpact(direct=True)
+    monkeypatch.setattr(low_impact, 'open',
+                        lambda filename: (os.open(filename, os.O_RDONLY),
+                                          True))
+    assert low_impact.md5_file(str(path)) == hashlib.md5(data).hexdigest()
+    assert calls[:3] == [0, CHUNK, CHUNK]
+
+
+def test_rate_limits(tmp_path):
+    for index in range(5):
+        (tmp_path / str(index)).write_bytes(b'x' * 1000)
+    stats = ScanStats()
+    low_impact = LowImpact(bytes_per_sec=20000, files_per_sec=1000)
+    low_impact.bytes_bucket.take(20000)
+    start = time.monotonic()
+    results = list(Scanner([str(tmp_path)], stats=stats,
+                           impact=low_impact).scan())
+    assert len(results) == 5
+    assert results[0].digest == hashlib.md5(b'x' * 1000).hexdigest()
+    assert time.monotonic() - start >= 0.2
+    assert stats.phases['throttle'][0] >= 0.2
+
+
+def test_archive_rate_limit(tmp_path):
+    path = tmp_path / 'files.zip'
+    with zipfile.ZipFile(str(path), 'w') as archive:
+        archive.writestr('a', os.urandom(5000))
+        archive.writestr('b', os.urandom(5000))
+    stats = ScanStats()
+    low_impact = LowImpact(bytes_per_sec=20000)
+    low_impact.bytes_bucket.take(20000)
+    start = time.monotonic()
+    results = list(Scanner([str(path)], stats=stats, archives=True,
+                           impact=low_impact).scan())
+    assert len(results) == 3
+    # The members and the archive itself are each read within the limit.
+    assert time.monotonic() - start >= 0.5
+    assert stats.phases['throttle'][0] >= 0.5
+
+
+def test_lower_priority():
+    code = ('import os; from million_dollar_dream.impact import '
+            'lower_priority; before = os.nice(0); lower_priority(); '
+            'print(os.nice(0) - before)')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert int(output) > 0
@@ -0,0 +1,64 @@
+import json
+from million_dollar_dream.instrument import ScanStats
+from million_dollar_dream.scanner import HashCache
+from million_dollar_dream.scanner import Scanner
+
+
+def test_counters_and_slowest():
+    stats = ScanStats(keep_slowest=2)
+    stats.file_done('/a', 0.5, 100)
+    stats.file_done('/b', 0.1, 200)
+    stats.file_done('/c', 0.9, None)
+    stats.add('hash', 1.0, 0.5, 2)
+    stats.add('hash', 1.0, 0.5)
+    stats.count('cache_hits', 3)
+    stats.count('cache_misses')
+    stats.stop()
+
+    summary = stats.summary()
+    assert summary['counters'] == dict(files=3, bytes=300, errors=1,
+                                       cache_hits=3, cache_misses=1)
+    assert summary['phases']['hash'] == dict(wall=2.0, cpu=1.0, calls=3)
+    assert summary['hit_ratios'] == dict(cache=0.75)
+    assert [entry['path'] for entry in summary['slowest']] == ['/c', '/a']
+    assert summary == stats.summary()
+
+
+def test_scan_stats(fs):
+    fs.create_file('/data/a', contents='a' * 10000)
+    fs.create_file('/data/b', contents='b')
+    stats = ScanStats()
+    cache = HashCache()
+    for _ in Scanner(['/data'], {}, cache=cache, stats=stats).scan():
+        pass
+    for _ in Scanner(['/data'], {}, cache=cache, stats=stats).scan():
+        pass
+
+    summary = stats.summary()
+    assert summary['counters']['files'] == 4
+    assert summary['counters']['bytes'] == 20002
+    assert summary['hit_ratios'] == dict(cache=0.5)
+    assert set(summary['phases']) == set(['walk', 'read', 'hash', 'lookup'])
+    # 3 reads of 4k for a, then one more returning nothing; 2 for b.
+    assert summary['phases']['read']['calls'] == 6
+    assert summary['phases']['hash']['calls'] == 4
+
+
+def test_export(fs):
+    fs.create_dir('/stats')
+    stats = ScanStats()
+    stats.file_done('/a', 0.5, 100)
+    stats.add('walk', 0.25, 0.125)
+
+    stats.export('/stats/scan.json')
+    with open('/stats/scan.json') as statsfile:
+        assert json.load(statsfile)['counters']['bytes'] == 100
+
+    stats.export('/stats/scan.prom')
+    with open('/stats/scan.prom') as statsfile:
+        lines = statsfile.read().splitlines()
+    assert 'mdd_scan_files_total 1' in lines
+    assert 'mdd_scan_phase_wall_seconds{phase="walk"} 0.25' in lines
+    assert '# TYPE mdd_scan_bytes_total counter' in lines
+    assert not [line for line in lines if line.startswith('mdd_scan_errors')
+                and not line.endswith(' 0')]
@@ -1,14 +1,26 @@
 import hashlib
 import os
+import pytest
 from million_dollar_dream.bloomfilter import BloomFilter
+from million_dollar_dream.main import OPTIONS
+from million_dollar_dream.main import apply_profile
 from million_dollar_dream.main import calculate_hashes
 from million_dollar_dream.main import count_files
+from million_dollar_dream.main import human_size
 from million_dollar_dream.main import is_md5
+from million_dollar_dream.main import lookup_digests
 from million_dollar_dream.main import lookup_hashes
+from million_dollar_dream.main import lookup_results
+from million_dollar_dream.main import make_memo
 from million_dollar_dream.main import md5_file
 from million_dollar_dream.main import md5_first_8192
+from million_dollar_dream.main import parse_options
+from million_dollar_dream.main import parse_size
+from million_dollar_dream.main import print_stats
+from million_dollar_dream.main import read_digests
 from million_dollar_dream.main import readable_file
 from million_dollar_dream.main import writeable_file
+from million_dollar_dream.output import ResultWriter
 
 
 def test_count_files(fs):
@@ -33,6 +45,75 @@ def test_is_md5():
     assert not is_md5('x' * 32)
 
 
+def test_parse_options():
+    defaults = dict(compress=None, verbose=False)
+    options, args = parse_options(
+        ['lookup', '--compress', 'zlib', 'x', '--verbose', '--', '--y'],
+        defaults)
+    assert options == dict(compress='zlib', verbose=True)
+    assert args == ['lookup', 'x', '--y']
+
+    options, args = parse_options(['--compress=auto'], defaults)
+    assert options['compress'] == 'auto'
+    assert defaults['compress'] is None
+
+    with pytest.raises(ValueError):
+        parse_options(['--bogus'], defaults)
+    with pytest.raises(ValueError):
+        parse_options(['--compress'], defaults)
+    with pytest.raises(ValueError):
+        parse_options(['--verbose=yes'], defaults)
+
+
+def test_human_size():
+    assert human_size(4) == '4bytes'
+    assert human_size(2048) == '2.0Kb'
+    assert human_size(1536 * 1024) == '1.5Mb'
+
+
+def test_parse_size():
+    assert parse_size('512') == 512
+    assert parse_size('4K') == 4096
+    assert parse_size('1.5gb') == 1536 * 1024 * 1024
+    with pytest.raises(ValueError):
+        parse_size('lots')
+    with pytest.raises(ValueError):
+        parse_size('-1')
+
+
+def test_make_memo():
+    assert make_memo(None).max_entries == 65536
+    assert make_memo('1000').max_entries == 1000
+    memo = make_memo('64M')
+    assert (memo.max_entries, memo.max_bytes) == (None, 64 * 1024 * 1024)
+    assert make_memo('0') is None
+    with pytest.raises(ValueError):
+        make_memo('lots')
+
+
+def test_apply_profile(monkeypatch):
+    import million_dollar_dream.main as mdd_main
+    profiles = dict(
+        system={'exclude': ['/proc', '/sys'], 'one-file-system': True,
+                'max-size': '1G', 'type': 'file'},
+        bad={'output': '/tmp/x'},
+    )
+    monkeypatch.setattr(mdd_main, 'get_config',
+                        lambda: dict(profiles=profiles))
+    options, _ = parse_options(['--exclude', '*.log', '--max-size', '2G'],
+                               OPTIONS)
+    merged = apply_profile(options, 'system')
+    assert merged['exclude'] == ['/proc', '/sys', '*.log']
+    assert merged['one-file-system']
+    assert merged['max-size'] == '2G'
+    assert merged['type'] == ['file']
+    assert options['exclude'] == ['*.log']
+    with pytest.raises(ValueError):
+        apply_profile(options, 'bad')
+    with pytest.raises(ValueError):
+        apply_profile(options, 'missing')
+
+
 def test_md5_first_8192(fs):
     file_path = '/var/data/xx1.txt'
     fs.create_file(file_path, contents='x' * 8193)
@@ -90,3 +171,155 @@ def test_calculate_and_lookup_hashes(fs):
     lookup_hashes(fake_sub_dir + 'file7.txt', bloomfilter)
     os.chmod(fake_sub_dir + 'file7.txt', 0o111)
     lookup_hashes(fake_sub_dir + 'file7.txt', bloomfilter)
+
+
+def test_lookup_results(fs):
+    bloomfilter = BloomFilter(10, 0.001)
+    fs.create_file('/var/data/known.txt', contents='known')
+    fs.create_file('/var/data/sub/unknown.txt', contents='unknown!')
+    bloomfilter.add(md5_file('/var/data/known.txt'))
+
+    results = sorted(lookup_results('/var/data', {'test': bloomfilter}))
+    assert [result.path for result in results] == \
+        ['/var/data/known.txt', '/var/data/sub/unknown.txt']
+    assert [result.size for result in results] == [5, 8]
+    assert results[0].digest == hashlib.md5(b'known').hexdigest()
+    assert results[0].filters == ['test']
+    assert results[1].filters == []
+
+
+def test_patch_filter(tmp_path, monkeypatch):
+    import million_dollar_dream.main as mdd_main
+    from million_dollar_dream.delta import make_delta
+    from million_dollar_dream.main import patch_filter
+
+    package_dir = tmp_path / 'package'
+    (package_dir / 'filters').mkdir(parents=True)
+    repo_dir = tmp_path / 'repo'
+    repo_dir.mkdir()
+    old = os.urandom(4096)
+    new = bytearray(old)
+    new[100] ^= 0xff
+    new = bytes(new)
+    (package_dir / 'filters' / 'test').write_bytes(old)
+    (repo_dir / 'test.delta').write_bytes(make_delta(old, new))
+
+    monkeypatch.setattr(mdd_main, '__file__', str(package_dir / 'main.py'))
+    monkeypatch.setattr(mdd_main, 'get_config',
+                        lambda: dict(repo=repo_dir.as_uri() + '/'))
+
+    digest = hashlib.sha256(new).hexdigest()
+    wrong = hashlib.sha256(old).hexdigest()
+    assert not patch_filter('test', 'missing.delta', 'sha256', digest)
+    assert not patch_filter('test', 'test.delta', 'sha256', wrong)
+    assert (package_dir / 'filters' / 'test').read_bytes() == old
+    assert patch_filter('test', 'test.delta', 'sha256', digest)
+    assert (package_dir / 'filters' / 'test').read_bytes() == new
+    assert os.listdir(str(package_dir / 'filters')) == ['test']
+
+
+def test_update_removes_store(tmp_path, monkeypatch):
+    import million_dollar_dream.main as mdd_main
+    from million_dollar_dream.delta import make_delta
+    from million_dollar_dream.digeststore import DigestStoreWriter, store_path
+    from million_dollar_dream.main import download_filter, patch_filter
+
+    package_dir = tmp_path / 'package'
+    (package_dir / 'filters').mkdir(parents=True)
+    repo_dir = tmp_path / 'repo'
+    repo_dir.mkdir()
+    path = str(package_dir / 'filters' / 'test')
+    old = [hashlib.md5(str(item).encode()).hexdigest() for item in range(50)]
+    added = hashlib.md5(b'added').hexdigest()
+
+    def install(digests):
+        bloomfilter = BloomFilter(100, 0.01)
+        bloomfilter.add_many(digests)
+        bloomfilter.save(path)
+        store = DigestStoreWriter(store_path(path))
+        store.add_many(digests)
+        store.close()
+
+    bloomfilter = BloomFilter(100, 0.01)
+    bloomfilter.add_many(old + [added])
+    bloomfilter.save(str(repo_dir / 'test'))
+    new = (repo_dir / 'test').read_bytes()
+    monkeypatch.setattr(mdd_main, '__file__', str(package_dir / 'main.py'))
+    monkeypatch.setattr(mdd_main, 'get_config',
+                        lambda: dict(repo=repo_dir.as_uri() + '/'))
+
+    def lookup(digest):
+        loaded = BloomFilter(1, 0.01)
+        loaded.load(path)
+        try:
+            return loaded.lookup(digest)
+        finally:
+            loaded.close()
+
+    # The old store doesn't list digests the update added.
+    install(old)
+    assert not lookup(added)
+    download_filter('test')
+    assert not os.path.exists(store_path(path))
+    assert lookup(added)
+
+    install(old)
+    with open(path, 'rb') as filterfile:
+        (repo_dir / 'test.delta').write_bytes(
+            make_delta(filterfile.read(), new))
+    assert patch_filter('test', 'test.delta', 'sha256',
+                        hashlib.sha256(new).hexdigest())
+    assert not os.path.exists(store_path(path))
+    assert lookup(added)
+
+
+def test_lookup_digests(fs):
+    import io
+    import json
+    known = [hashlib.md5(str(item).encode()).hexdigest() for item in range(10)]
+    unknown = hashlib.md5(b'unknown').hexdigest()
+    bloomfilter = BloomFilter(10, 0.001)
+    for digest in known:
+        bloomfilter.add(digest)
+    hashlist = '/var/data/hashes.txt'
+    fs.create_file(hashlist, contents='\n'.join(
+        ['# comment', known[0].upper(), 'not a hash', unknown] + known[1:]))
+
+    assert list(read_digests([hashlist])) == known[:1] + [unknown] + known[1:]
+    # Lists of nothing but digests take a quicker path.
+    fs.create_file('/var/data/plain.txt', contents='\n'.join(
+        [known[0].upper()] + known[1:]))
+    fs.create_file('/var/data/spaced.txt', contents='\n'.join(
+        [known[0][:2] + '  ' + known[0][4:]] + known[1:]) + '\n')
+    assert list(read_digests(['/var/data/plain.txt'])) == known
+    assert list(read_digests(['/var/data/spaced.txt'])) == known[1:]
+
+    output = io.BytesIO()
+    writer = ResultWriter(output, only_misses=True)
+    assert lookup_digests([hashlist], bloomfilter, writer) == (11, 1)
+    assert output.getvalue() == (unknown + '\n').encode()
+
+    output = io.BytesIO()
+    lookup_digests([hashlist], bloomfilter, ResultWriter(output, 'ndjson'))
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(results) == 11
+    assert results[1] == dict(path=None, size=None, digest=unknown,
+                              filters=[])
+    assert results[0] == dict(path=None, size=None, digest=known[0],
+                              filters=['filter'])
+
+
+def test_print_stats(tmp_path, capsys):
+    os.mkdir(str(tmp_path / 'filters'))
+    bloom_filter = BloomFilter(1000, 0.01)
+    bloom_filter.add_many(str(item) for item in range(1000))
+    bloom_filter.save(str(tmp_path / 'filters' / 'ok'))
+    bloom_filter.add_many(str(item) for item in range(1000, 3000))
+    bloom_filter.save(str(tmp_path / 'filters' / 'full'), 'zlib')
+
+    assert print_stats(str(tmp_path / 'filters')) == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[2].startswith('full') and lines[2].endswith('SATURATED')
+    assert lines[3].startswith('ok') and 'SATURATED' not in lines[3]
+    assert lines[-1] == '[+] 2 filters, 1 saturated'
+    assert print_stats(str(tmp_path / 'filters' / 'ok')) == 0
@@ -0,0 +1,51 @@
+import os
+import random
+import pytest
+from million_dollar_dream import bloomfilter as bloomfilter_module
+from million_dollar_dream import pymmh3
+from million_dollar_dream.bloomfilter import BloomFilter
+
+np = pytest.importorskip('numpy')
+npmmh3 = pytest.importorskip('million_dollar_dream.npmmh3')
+
+KEYS = ['', 'a', 'ab', 'abc', 'abcd', 'héllo wörld', 'x' * 31,
+        '5d41402abc4b2a76b9719d911017c592'] + \
+    [bytes(random.Random(length).getrandbits(8) for _ in range(length))
+     for length in range(40)]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 6, 0xdeadbeef])
+def test_hash_batch(seed):
+    expected = [pymmh3.hash(key, seed) for key in KEYS]
+    assert npmmh3.hash_batch(KEYS, seed).tolist() == expected
+    mmh3 = pytest.importorskip('mmh3')
+    assert expected == [mmh3.hash(key, seed) for key in KEYS]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 6, 0xdeadbeef])
+def test_hash128_batch(seed):
+    low, high = npmmh3.hash128_batch(KEYS, seed)
+    hashes = [int(h1) | int(h2) << 64 for h1, h2 in zip(low, high)]
+    assert hashes == [pymmh3.hash128(key, seed) for key in KEYS]
+
+
+def test_fixed_length_batch():
+    keys = [os.urandom(16).hex() for _ in range(1000)]
+    assert npmmh3.hash_batch(keys, 3).tolist() == \
+        [pymmh3.hash(key, 3) for key in keys]
+    assert npmmh3.hash_batch([], 3).tolist() == []
+
+
+def test_vectorized_filter(monkeypatch):
+    elements = [os.urandom(16).hex() for _ in range(600)]
+    scalar = BloomFilter(300, 0.01)
+    for element in elements[:300]:
+        scalar.add(element)
+    expected = [scalar.lookup(element) for element in elements]
+
+    monkeypatch.setattr(bloomfilter_module, 'mmh3', pymmh3)
+    assert BloomFilter.vectorized()
+    vectorized = BloomFilter(300, 0.01)
+    vectorized.add_many(elements[:300])
+    assert vectorized.filter.bitfield == scalar.filter.bitfield
+    assert vectorized.lookup_many(elements) == expected
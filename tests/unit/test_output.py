@@ -0,0 +1,80 @@
+import io
+import json
+import pytest
+from million_dollar_dream import output
+from million_dollar_dream.output import Result
+from million_dollar_dream.output import ResultWriter
+
+RESULTS = [
+    Result('/bin/ls', 10, 'a' * 32, ['debian']),
+    Result('/bin/evil, "x"', 20, 'b' * 32, []),
+    Result('/bin/secret', 30, None, None),
+    Result('/bin/cat', 40, 'c' * 32, None),
+]
+
+
+def write_results(*args, **kwargs):
+    outfile = io.BytesIO()
+    writer = ResultWriter(outfile, *args, **kwargs)
+    for result in RESULTS:
+        writer.write(result)
+    writer.flush()
+    return outfile.getvalue().decode()
+
+
+def test_text():
+    assert write_results() == (
+        '/bin/ls is in filter\n'
+        '/bin/evil, "x" is not in filter\n'
+        '/bin/secret Permission Denied\n'
+        '   /bin/cat ' + 'c' * 32 + '\n'
+    )
+
+
+def test_ndjson():
+    lines = write_results('ndjson').splitlines()
+    assert [json.loads(line) for line in lines] == \
+        [result._asdict() for result in RESULTS]
+
+
+def test_csv_only_misses():
+    assert write_results('csv', only_misses=True) == (
+        'path,size,digest,filters\n'
+        '"/bin/evil, ""x""",20,' + 'b' * 32 + ',\n'
+        '/bin/secret,30,,\n'
+        '/bin/cat,40,' + 'c' * 32 + ',\n'
+    )
+
+
+@pytest.mark.parametrize('output_format', output.FORMATS)
+@pytest.mark.parametrize('only_misses', [False, True])
+def test_write_digests(output_format, only_misses):
+    digests = ['a' * 32, 'b' * 32, 'c' * 32]
+    found = [True, False, True]
+    expected = io.BytesIO()
+    writer = ResultWriter(expected, output_format, only_misses)
+    for digest, hit in zip(digests, found):
+        writer.write(Result(None, None, digest, ['x, 100%'] if hit else []))
+    writer.flush()
+    outfile = io.BytesIO()
+    writer = ResultWriter(outfile, output_format, only_misses)
+    writer.write_digests(digests, found, 'x, 100%')
+    writer.flush()
+    assert outfile.getvalue() == expected.getvalue()
+
+
+def test_buffering(monkeypatch):
+    monkeypatch.setattr(output, 'BUFFER_SIZE', 64)
+    outfile = io.BytesIO()
+    writer = ResultWriter(outfile)
+    writer.write(RESULTS[0])
+    assert outfile.getvalue() == b''
+    writer.write(RESULTS[1])
+    writer.write(RESULTS[2])
+    assert outfile.getvalue() != b''
+    assert writer.buffer == []
+
+
+def test_bad_format():
+    with pytest.raises(ValueError):
+        ResultWriter(io.BytesIO(), 'xml')
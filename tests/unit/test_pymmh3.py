@@ -0,0 +1,51 @@
+import random
+import pytest
+from million_dollar_dream import pymmh3
+
+# Digest lengths get precomputed unpackers, the rest cover every tail size.
+KEYS = ['', 'a', 'héllo wörld', bytearray(b'abcde'),
+        '5d41402abc4b2a76b9719d911017c592',
+        'aaf4c61ddcc5e8a2dabede0f3b482cd9aea9434d',
+        '2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824'] + \
+    [bytes(random.Random(length).getrandbits(8) for _ in range(length))
+     for length in range(70)]
+
+SEEDS = [0, 1, 6, 0xdeadbeef]
+
+
+def test_reference_values():
+    key = '5d41402abc4b2a76b9719d911017c592'
+    assert pymmh3.hash('', 0) == 0
+    assert pymmh3.hash('', 5) == -871541811
+    assert pymmh3.hash('hello', 0) == 613153351
+    assert pymmh3.hash(key, 0) == -286279941
+    assert pymmh3.hash(key, 5) == -226540201
+    assert pymmh3.hash(bytes(range(17)), 5) == 628144899
+    assert pymmh3.hash128('hello') == \
+        0x5b1e906a48ae1d19cbd8a7b341bd9b02
+    assert pymmh3.hash128(key) == 0x2c6a3d78bd19c6ad7304094f6ca08f4b
+    assert pymmh3.hash128(key, 0, False) == \
+        0xa9980b6462b73134aed7c36d75b23b89
+    assert pymmh3.hash128(bytes(range(17)), 0, False) == \
+        0xa275ab51ae1673ad359c940b6ac99cdb
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_matches_mmh3(seed):
+    mmh3 = pytest.importorskip('mmh3')
+    for key in KEYS:
+        native = bytes(key) if isinstance(key, bytearray) else key
+        assert pymmh3.hash(key, seed) == mmh3.hash(native, seed)
+        assert pymmh3.hash128(key, seed) == mmh3.hash128(native, seed)
+        assert pymmh3.hash128(key, seed, False) == \
+            mmh3.hash128(native, seed, False)
+        assert pymmh3.hash64(key, seed) == mmh3.hash64(native, seed)
+
+
+def test_hash_seeds():
+    for key in KEYS:
+        assert pymmh3.hash_seeds(key, range(8)) == \
+            [pymmh3.hash(key, seed) for seed in range(8)]
+    assert pymmh3.hash_seeds('abc', SEEDS) == \
+        [pymmh3.hash('abc', seed) for seed in SEEDS]
+    assert pymmh3.hash_seeds('abc', []) == []
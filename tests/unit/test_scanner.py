@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import pytest
+from million_dollar_dream.bloomfilter import BloomFilter
+from million_dollar_dream.filterbank import LookupMemo
+from million_dollar_dream.instrument import ScanStats
+from million_dollar_dream.scanner import HashCache
+from million_dollar_dream.scanner import Scanner
+from million_dollar_dream.scanner import WalkRules
+from million_dollar_dream.scanner import compile_patterns
+
+
+def make_tree(fs):
+    fs.create_file('/data/a.txt', contents='a')
+    fs.create_file('/data/b.log', contents='bb')
+    fs.create_file('/data/cache/c.txt', contents='ccc')
+    fs.create_file('/data/sub/d.txt', contents='dddd')
+    fs.create_file('/data/sub/cache/e.txt', contents='eeeee')
+
+
+def test_compile_patterns():
+    assert compile_patterns([]) is None
+    pattern = compile_patterns(['*.log', '/data/sub/'])
+    assert pattern.match('b.log\x00/data/b.log')
+    assert pattern.match('sub\x00/data/sub')
+    assert not pattern.match('sub\x00/other/sub')
+    assert not pattern.match('b.log.txt\x00/data/b.log.txt')
+
+
+def test_scan(fs):
+    make_tree(fs)
+    bloomfilter = BloomFilter(10, 0.001)
+    bloomfilter.add(hashlib.md5(b'a').hexdigest())
+    results = sorted(Scanner(['/data'], bloomfilter).scan())
+    assert [result.path for result in results] == [
+        '/data/a.txt', '/data/b.log', '/data/cache/c.txt',
+        '/data/sub/cache/e.txt', '/data/sub/d.txt']
+    assert results[0].filters == ['filter']
+    assert results[1].filters == []
+    assert results[1].size == 2
+    assert results[1].digest == hashlib.md5(b'bb').hexdigest()
+
+    results = list(Scanner(['/data/a.txt']).scan())
+    assert len(results) == 1
+    assert results[0].filters is None
+
+
+def test_exclude(fs):
+    make_tree(fs)
+    scanner = Scanner(['/data'], exclude=['cache', '*.log'])
+    paths = sorted(result.path for result in scanner.scan())
+    assert paths == ['/data/a.txt', '/data/sub/d.txt']
+
+    scanner = Scanner(['/data'], exclude=['/data/sub'])
+    paths = sorted(result.path for result in scanner.scan())
+    assert paths == ['/data/a.txt', '/data/b.log', '/data/cache/c.txt']
+
+
+def test_walk_rules(fs):
+    make_tree(fs)
+    fs.create_file('/data/sub/run.sh', contents='#!/bin/sh', st_mode=0o100755)
+    fs.create_symlink('/data/link', '/data/sub/d.txt')
+    fs.create_file('/mnt/other/f.txt', contents='f')
+    fs.add_mount_point('/mnt/other')
+    fs.create_symlink('/data/mnt', '/mnt')
+
+    def walk(roots=['/data'], **rules):
+        return sorted(Scanner(roots, rules=WalkRules(**rules)).walk())
+
+    assert walk(include=['*.txt'], exclude=['sub']) == [
+        '/data/a.txt', '/data/cache/c.txt']
+    assert walk(min_size=2, max_size=4) == [
+        '/data/b.log', '/data/cache/c.txt', '/data/link', '/data/sub/d.txt']
+    assert walk(types=['link', 'exec']) == ['/data/link', '/data/sub/run.sh']
+    assert walk(types=['file'], include=['*.txt']) == [
+        '/data/a.txt', '/data/cache/c.txt', '/data/sub/cache/e.txt',
+        '/data/sub/d.txt']
+    # Named files are filtered too.
+    assert walk(['/data/b.log', '/data/a.txt'], min_size=2) == [
+        '/data/b.log']
+
+    assert walk(['/'], include=['f.txt']) == ['/mnt/other/f.txt']
+    assert walk(['/'], include=['f.txt'], one_file_system=True) == []
+    assert walk(['/mnt/other'], one_file_system=True) == ['/mnt/other/f.txt']
+
+    with pytest.raises(ValueError):
+        WalkRules(types=['socket'])
+
+    # exclude still works without rules, and adds to them.
+    assert sorted(Scanner(['/data'], exclude=['*.txt', 'link']).walk()) == [
+        '/data/b.log', '/data/sub/run.sh']
+    rules = WalkRules(exclude=['*.txt'], max_size=4)
+    scanner = Scanner(['/data'], exclude=['link', '*.txt'], rules=rules)
+    assert sorted(scanner.walk()) == ['/data/b.log']
+    assert scanner.rules.excludes == ['*.txt', 'link']
+    assert rules.excludes == ['*.txt']
+    assert Scanner(['/data'], exclude=['*.txt'], rules=rules).rules is rules
+
+
+def test_jobs(fs):
+    make_tree(fs)
+    expected = sorted(Scanner(['/data']).scan())
+    assert sorted(Scanner(['/data'], jobs=4).scan()) == expected
+
+    # Stopping early shouldn't hang or leak the worker threads.
+    results = Scanner(['/data'], jobs=2).scan()
+    next(results)
+    results.close()
+
+
+def test_cache(fs):
+    make_tree(fs)
+    cache = HashCache('/tmp/cache.json')
+    cache.load()
+    expected = sorted(Scanner(['/data'], cache=cache).scan())
+    assert len(cache.entries) == 5
+    cache.save()
+
+    cache = HashCache('/tmp/cache.json')
+    cache.load()
+    digest = cache.entries['/data/a.txt'][3]
+    assert digest == hashlib.md5(b'a').hexdigest()
+
+    # Cached digests are used for unchanged files.
+    cache.entries['/data/a.txt'][3] = 'f' * 32
+    results = sorted(Scanner(['/data'], cache=cache).scan())
+    assert results[0].digest == 'f' * 32
+    assert results[1:] == expected[1:]
+
+    # Changed files are hashed again.
+    with open('/data/a.txt', 'w') as changed:
+        changed.write('changed')
+    results = sorted(Scanner(['/data'], cache=cache).scan())
+    assert results[0].digest == hashlib.md5(b'changed').hexdigest()
+
+
+def test_memo(fs):
+    for index in range(6):
+        fs.create_file('/data/copy%d/lib.so' % index, contents='shared')
+    fs.create_file('/data/other.txt', contents='other')
+    bloomfilter = BloomFilter(10, 0.001)
+    bloomfilter.add(hashlib.md5(b'shared').hexdigest())
+    memo = LookupMemo()
+    stats = ScanStats()
+    results = sorted(Scanner(['/data'], bloomfilter, jobs=3, stats=stats,
+                             memo=memo).scan())
+    assert results == sorted(Scanner(['/data'], bloomfilter).scan())
+    counters = stats.summary()['counters']
+    assert counters['memo_hits'] + counters['memo_misses'] == 7
+    assert counters['memo_misses'] >= 2
+    assert len(memo) == 2
+
+
+def test_ascan(tmp_path):
+    for name in ['a', 'b', 'c']:
+        (tmp_path / name).write_text(name)
+
+    async def collect(limit=None):
+        results = []
+        async for result in Scanner([str(tmp_path)]).ascan():
+            results.append(result)
+            if limit and len(results) == limit:
+                break
+        return results
+
+    results = asyncio.run(collect())
+    assert sorted(result.digest for result in results) == sorted(
+        hashlib.md5(name.encode()).hexdigest() for name in ['a', 'b', 'c'])
+    assert len(asyncio.run(collect(1))) == 1
@@ -0,0 +1,84 @@
+import os
+import threading
+from million_dollar_dream import schedule
+from million_dollar_dream.scanner import Scanner
+from million_dollar_dream.schedule import physical_offset, sort_key
+
+
+def make_files(tmp_path, count=30):
+    paths = []
+    for index in range(count):
+        path = tmp_path / ('dir%d' % (index % 3)) / ('file%02d' % index)
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b'x' * (index * 100))
+        paths.append(str(path))
+    return paths
+
+
+class RecordingScanner(Scanner):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checked = []
+        self.threads = dict()
+
+    def check_all(self, path):
+        self.checked.append(path)
+        self.threads[path] = threading.current_thread().name
+        return super().check_all(path)
+
+
+def test_sort_key(tmp_path):
+    path = make_files(tmp_path, 2)[1]
+    stat = os.stat(path)
+    assert sort_key(path, stat, 'inode') == (stat.st_ino,)
+    assert sort_key(path, stat, 'device') == ()
+    offset = physical_offset(path)
+    assert offset is None or offset >= 0
+    assert sort_key(path, stat, 'extent') == \
+        (-1 if offset is None else offset, stat.st_ino)
+    assert physical_offset(str(tmp_path / 'missing')) is None
+
+
+def test_orders(tmp_path):
+    paths = make_files(tmp_path)
+    expected = sorted(Scanner([str(tmp_path)]).scan())
+    for order in schedule.ORDERS:
+        for jobs in (1, 3):
+            scanner = Scanner([str(tmp_path)], jobs=jobs, order=order)
+            assert sorted(scanner.scan()) == expected
+
+    scanner = RecordingScanner([str(tmp_path)], order='inode')
+    list(scanner.scan())
+    assert scanner.checked == sorted(paths,
+                                     key=lambda path: os.stat(path).st_ino)
+
+
+def test_devices(tmp_path):
+    paths = make_files(tmp_path)
+
+    class TwoDevices(schedule.DeviceScheduler):
+        def key(self, path):
+            # Files in dir1 are on another device.
+            return (2 if '/dir1/' in path else 1,)
+
+    scanner = RecordingScanner([str(tmp_path)], order='device')
+    checker = TwoDevices(scanner, 'device', window=7)
+    results = list(checker.run())
+
+    assert sorted(result.path for result in results) == sorted(paths)
+    assert sorted(checker.devices) == [1, 2]
+    threads = set(scanner.threads[path] for path in paths
+                  if '/dir1/' in path)
+    assert len(threads) == 1
+    assert threads.isdisjoint(scanner.threads[path] for path in paths
+                              if '/dir1/' not in path)
+
+
+def test_stop_early(tmp_path, monkeypatch):
+    make_files(tmp_path)
+    monkeypatch.setattr(schedule, 'QUEUE_SIZE', 2)
+    before = threading.active_count()
+    results = Scanner([str(tmp_path)], jobs=2, order='inode').scan()
+    next(results)
+    results.close()
+    assert threading.active_count() == before
@@ -0,0 +1,94 @@
+import errno
+import os
+import pytest
+from million_dollar_dream import watcher as watcher_module
+from million_dollar_dream.watcher import Watcher
+
+inotify = pytest.mark.skipif(watcher_module.libc is None,
+                             reason="inotify is only available on Linux")
+
+
+def write(path, data=b'data'):
+    with open(str(path), 'wb') as f:
+        f.write(data)
+
+
+@inotify
+def test_created_and_modified(tmp_path):
+    write(tmp_path / 'old')
+    watcher = Watcher([str(tmp_path)], debounce=0.05)
+    watcher.start()
+    assert watcher.polled == set()
+    assert watcher.wait(0.1) == []
+
+    write(tmp_path / 'new')
+    (tmp_path / 'sub').mkdir()
+    write(tmp_path / 'sub' / 'nested')
+    assert watcher.wait(2) == [str(tmp_path / 'new'),
+                               str(tmp_path / 'sub' / 'nested')]
+
+    write(tmp_path / 'sub' / 'nested', b'changed')
+    assert watcher.wait(2) == [str(tmp_path / 'sub' / 'nested')]
+    watcher.close()
+
+
+@inotify
+def test_debounce(tmp_path):
+    watcher = Watcher([str(tmp_path)], debounce=0.3)
+    watcher.start()
+    with open(str(tmp_path / 'growing'), 'wb') as f:
+        for _ in range(5):
+            f.write(b'chunk')
+            f.flush()
+            assert watcher.wait(0.05) == []
+    assert watcher.wait(2) == [str(tmp_path / 'growing')]
+    assert watcher.wait(0.4) == []
+    watcher.close()
+
+
+@inotify
+def test_excluded(tmp_path):
+    (tmp_path / 'skip').mkdir()
+    watcher = Watcher([str(tmp_path)], debounce=0.05,
+                      excluded=lambda path: path.endswith('skip'))
+    watcher.start()
+    write(tmp_path / 'skip' / 'file')
+    write(tmp_path / 'kept')
+    assert watcher.wait(2) == [str(tmp_path / 'kept')]
+    watcher.close()
+
+
+@inotify
+def test_out_of_watches(tmp_path, monkeypatch):
+    (tmp_path / 'full').mkdir()
+    write(tmp_path / 'full' / 'unchanged')
+    add_watch = Watcher.add_watch
+
+    def limited(self, directory):
+        if directory.endswith('full'):
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        return add_watch(self, directory)
+
+    monkeypatch.setattr(Watcher, 'add_watch', limited)
+    watcher = Watcher([str(tmp_path)], debounce=0.05, interval=0.2)
+    watcher.start()
+    assert watcher.polled == {str(tmp_path / 'full')}
+    assert list(watcher.watched) == [str(tmp_path)]
+
+    write(tmp_path / 'full' / 'added')
+    write(tmp_path / 'watched')
+    assert watcher.wait(2) == [str(tmp_path / 'watched')]
+    assert watcher.wait(2) == [str(tmp_path / 'full' / 'added')]
+    watcher.close()
+
+
+def test_without_inotify(tmp_path, monkeypatch):
+    monkeypatch.setattr(watcher_module, 'libc', None)
+    write(tmp_path / 'old')
+    watcher = Watcher([str(tmp_path)], interval=0.1)
+    watcher.start()
+    assert watcher.polled == {str(tmp_path)}
+    write(tmp_path / 'new')
+    os.remove(str(tmp_path / 'old'))
+    assert watcher.wait(2) == [str(tmp_path / 'new')]
+    assert str(tmp_path / 'old') not in watcher.snapshot